@@ -1,7 +1,15 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Store, Dish, DishModifier, Order, OrderDishRelation
+from .models import (
+    Store,
+    Dish,
+    DishModifier,
+    Order,
+    OrderDishRelation,
+    ArchivedOrder,
+    IdempotencyRecord,
+)
 
 
 class OrderAdmin(admin.ModelAdmin):
@@ -16,3 +24,5 @@ admin.site.register(Dish)
 admin.site.register(DishModifier)
 admin.site.register(Order)
 admin.site.register(OrderDishRelation)
+admin.site.register(ArchivedOrder)
+admin.site.register(IdempotencyRecord)
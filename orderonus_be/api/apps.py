@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Connect the signals that keep the store ownership cache fresh and
+        # generate image derivatives
+        from . import images, ownership  # noqa: F401
@@ -0,0 +1,94 @@
+"""Moving old completed orders out of the order tables.
+
+Completed orders older than ``ARCHIVE_AFTER_DAYS`` are copied to
+``ArchivedOrder`` with their lines and modifiers serialized in one JSON
+column, then deleted with their lines, a batch per transaction. Exports
+and rollup rebuilds read both tables, and the rollups themselves are left
+untouched, so archiving does not change what the export and analytics
+endpoints return. Each removal takes a number in the store's change
+sequence, so the sync endpoint can tell clients which orders went away.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from .cache import bump_orders_version
+from .changes import allocate_changes
+from .export import export_record
+from .models import ArchivedOrder, Order, Store
+from .serializers import prefetch_orders
+
+
+def archive_cutoff(days: Optional[int] = None) -> datetime:
+    """Orders created before this time may be archived"""
+    if days is None:
+        days = settings.ARCHIVE_AFTER_DAYS
+    return timezone.now() - timedelta(days=days)
+
+
+def archivable(cutoff: datetime, store: Optional[Store] = None) -> "QuerySet[Order]":
+    """The completed orders created before the cutoff, oldest first"""
+    queryset = Order.objects.filter(is_completed=True, created_at__lt=cutoff)
+    if store is not None:
+        queryset = queryset.filter(store=store)
+    return queryset.order_by("created_at", "id")
+
+
+def archive_batch(
+    cutoff: datetime, batch_size: int, store: Optional[Store] = None
+) -> int:
+    """Archive up to ``batch_size`` orders in one transaction"""
+    with transaction.atomic():
+        orders = list(
+            prefetch_orders(archivable(cutoff, store)).select_for_update()[:batch_size]
+        )
+        if not orders:
+            return 0
+        archived_at = timezone.now()
+        # The next change number of each store, oldest orders removed first
+        sequence: Dict[int, int] = {}
+        for store_id, count in Counter(order.store_id for order in orders).items():
+            sequence[store_id] = allocate_changes(store_id, count) - count
+        archived = []
+        for order in orders:
+            sequence[order.store_id] += 1
+            archived.append(
+                ArchivedOrder(
+                    id=order.id,
+                    store_id=order.store_id,
+                    created_at=order.created_at,
+                    is_online=order.is_online,
+                    is_completed=order.is_completed,
+                    archived_at=archived_at,
+                    lines=export_record(order)["lines"],
+                    change_seq=sequence[order.store_id],
+                )
+            )
+        ArchivedOrder.objects.bulk_create(archived)
+        Order.objects.filter(id__in=[order.id for order in orders]).delete()
+    for store_id in {order.store_id for order in orders}:
+        bump_orders_version(store_id)
+    return len(orders)
+
+
+def archive_orders(
+    cutoff: datetime,
+    batch_size: int = 0,
+    max_batches: Optional[int] = None,
+    store: Optional[Store] = None,
+) -> int:
+    """Archive the orders before the cutoff, at most ``max_batches`` batches"""
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(cutoff, batch_size, store)
+        archived += count
+        batches += 1
+        if count < batch_size:
+            break
+    return archived
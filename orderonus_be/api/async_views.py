@@ -0,0 +1,221 @@
+"""Async variants of the API read endpoints for the ASGI deployment.
+
+They use the async ORM interface and async user lookups, so under an ASGI
+server a request is not handed to a worker thread as a whole. The order
+stream is always served from here, and only under ASGI. The other views
+replace their sync counterparts in ``api.urls`` when ``API_ASYNC_VIEWS``
+is enabled.
+"""
+
+import asyncio
+import json
+from functools import wraps
+from typing import Any, AsyncIterator, Awaitable, Callable, List
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http.request import HttpRequest
+from django.http.response import (
+    HttpResponse,
+    HttpResponseNotAllowed,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+
+from .cache import acached_menu
+from .conditional import (
+    astore_menu_etag,
+    astore_order_etag,
+    astore_orders_etag,
+    async_condition,
+)
+from .dates import requested_range
+from .events import broker
+from .models import Dish, Order, Store
+from .pagination import PaginationError, apaginate
+from .serializers import (
+    aload_dishes,
+    aload_orders,
+    serialize_dishes,
+    serialize_order_lines,
+    serialize_orders,
+)
+from .utils import arequest_store, get_request_user
+
+AsyncView = Callable[..., Awaitable[HttpResponse]]
+
+
+def async_require_GET(view: AsyncView) -> AsyncView:
+    """Async counterpart of ``require_GET``"""
+
+    @wraps(view)
+    async def inner(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        if request.method != "GET":
+            return HttpResponseNotAllowed(["GET"])
+        return await view(request, *args, **kwargs)
+
+    return inner
+
+
+def async_login_required(view: AsyncView) -> AsyncView:
+    """Async counterpart of ``login_required``"""
+
+    @wraps(view)
+    async def inner(request: HttpRequest, *args: Any, **kwargs: Any) -> HttpResponse:
+        user = await get_request_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+
+    return inner
+
+
+@async_require_GET
+@async_login_required
+@async_condition(astore_orders_etag)
+async def orders(request: HttpRequest, store_id: int) -> HttpResponse:
+    """Retrive the orders from the database"""
+    store = await arequest_store(request, store_id)
+    if store is None:
+        return JsonResponse({"error": "Store not found"}, status=404)
+
+    try:
+        start, end = requested_range(request, store)
+    except ValueError:
+        return JsonResponse({"error": "Invalid date range"}, status=400)
+
+    try:
+        pending_orders, next_cursor = await apaginate(
+            Order.objects.filter(
+                store=store, created_at__gte=start, created_at__lt=end
+            ),
+            request,
+            ("created_at", "id"),
+        )
+    except PaginationError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    await aload_orders(pending_orders)
+    return JsonResponse(
+        {
+            "data": serialize_orders(pending_orders),
+            "next": next_cursor,
+        }
+    )
+
+
+@async_require_GET
+@async_login_required
+@async_condition(astore_order_etag)
+async def order_by_id(
+    request: HttpRequest, store_id: int, order_id: int
+) -> HttpResponse:
+    """Retrive the order by id from the database"""
+    store = await arequest_store(request, store_id)
+    if store is None:
+        return JsonResponse({"error": "Store not found"}, status=404)
+
+    order = await Order.objects.filter(id=order_id, store=store).afirst()
+    if order is None:
+        return JsonResponse({"error": "Order not found"}, status=404)
+
+    await aload_orders([order])
+    return JsonResponse(
+        {
+            "data": {
+                "order": order.to_dict(),
+                "dishes": serialize_order_lines(order.get_lines()),
+            }
+        }
+    )
+
+
+@async_require_GET
+@async_login_required
+@async_condition(astore_menu_etag)
+async def get_dishes(request: HttpRequest, store_id: int) -> HttpResponse:
+    """Gets the possible dishes"""
+    store = await arequest_store(request, store_id)
+    if store is None:
+        return JsonResponse({"error": "Store not found"}, status=404)
+
+    async def build() -> bytes:
+        dishes, next_cursor = await apaginate(
+            Dish.objects.filter(store=store), request, ("id",)
+        )
+        await aload_dishes(dishes)
+        return json.dumps(
+            {"data": serialize_dishes(dishes), "next": next_cursor},
+            cls=DjangoJSONEncoder,
+        ).encode()
+
+    variant = f"{request.GET.get('cursor', '')}:{request.GET.get('limit', '')}"
+    try:
+        content, hit = await acached_menu(store.id, variant, build)
+    except PaginationError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    response = HttpResponse(content, content_type="application/json")
+    response["X-Menu-Cache"] = "hit" if hit else "miss"
+    return response
+
+
+@async_require_GET
+@async_login_required
+async def get_stores(request: HttpRequest) -> HttpResponse:
+    """Gets the stores"""
+    try:
+        stores, next_cursor = await apaginate(Store.objects.all(), request, ("id",))
+    except PaginationError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    return JsonResponse(
+        {"data": list(map(lambda x: x.to_dict(), stores)), "next": next_cursor}
+    )
+
+
+@async_require_GET
+@async_login_required
+async def order_stream(request: HttpRequest, store_id: int) -> HttpResponse:
+    """Stream new orders and completion changes as Server-Sent Events.
+
+    Requires the ASGI application. A WSGI server reads a streaming response
+    to its end before sending it, so an endless stream would never deliver
+    an event and would hold a worker forever; it is refused with a 501.
+    """
+    store = await arequest_store(request, store_id)
+    if store is None:
+        return JsonResponse({"error": "Store not found"}, status=404)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {"error": "The order stream is only served over ASGI"}, status=501
+        )
+
+    try:
+        last_event_id = int(request.headers.get("Last-Event-ID", ""))
+    except ValueError:
+        last_event_id = None
+    subscriber = broker.subscribe(store.id, last_event_id)
+
+    async def stream() -> AsyncIterator[bytes]:
+        try:
+            yield f"retry: {settings.ORDER_STREAM_HEARTBEAT * 1000}\n\n".encode()
+            for event in subscriber.backlog:
+                yield event.encode()
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        subscriber.queue.get(), settings.ORDER_STREAM_HEARTBEAT
+                    )
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield event.encode()
+        finally:
+            broker.unsubscribe(subscriber)
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,340 @@
+"""Uploading the orders a store queued while it was offline.
+
+A batch holds up to ``ORDER_BATCH_MAX_ORDERS`` orders, each with the id the
+client gave it and the time it was taken. The whole batch is validated
+against one snapshot of the dishes and modifiers it names, then the valid
+orders are written ``ORDER_BATCH_CHUNK_SIZE`` at a time, with their lines,
+modifiers, rollups and change numbers, one transaction per chunk.
+
+The client order id is used as the order's idempotency key, so orders
+already uploaded, in an earlier batch or by ``add_order`` with the same
+``Idempotency-Key``, are reported as duplicates instead of being added
+twice. Both endpoints fingerprint the order's flags and dishes the same
+way, leaving out the time it was taken. Every order gets its own result,
+and a rejected order does not stop the others.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+
+from .changes import allocate_changes
+from .dates import store_timezone
+from .idempotency import ORDER_ADDED, expiry, find_records, order_fingerprint
+from .models import (
+    Dish,
+    DishModifier,
+    IdempotencyRecord,
+    Order,
+    OrderDishRelation,
+    Store,
+)
+from .orders import CartError, CartLine, build_line, load_menu
+from .rollups import Sale, SaleLine, record_orders
+
+# How far ahead of the server's clock an order may have been taken
+CLOCK_SKEW = timedelta(minutes=5)
+OTHER_COMMENTS_LENGTH = OrderDishRelation._meta.get_field("other_comments").max_length
+
+
+@dataclass
+class QueuedOrder:
+    """A validated order of a batch, ready to be written"""
+
+    index: int
+    client_id: str
+    digest: str
+    created_at: datetime
+    is_online: bool
+    is_completed: bool
+    lines: List[CartLine]
+    order_id: Optional[int] = None
+
+    def result(self: "QueuedOrder", status: str = "created") -> Dict[str, Any]:
+        return {"client_id": self.client_id, "status": status, "id": self.order_id}
+
+
+def error_result(client_id: Optional[str], error: CartError) -> Dict[str, Any]:
+    return {
+        "client_id": client_id,
+        "status": "error",
+        "error": error.message,
+        "code": error.status,
+    }
+
+
+def client_order_id(entry: Dict[str, Any]) -> str:
+    client_id = entry.get("client_id")
+    if isinstance(client_id, int) and not isinstance(client_id, bool):
+        client_id = str(client_id)
+    if not isinstance(client_id, str) or not client_id.strip():
+        raise CartError("Missing client_id", 400)
+    if len(client_id) > IdempotencyRecord._meta.get_field("key").max_length:
+        raise CartError("Invalid client_id", 400)
+    return client_id.strip()
+
+
+def parse_created_at(value: Any, store: Store) -> datetime:
+    """The time the order was taken, naive times being in the store's timezone"""
+    moment = parse_datetime(value) if isinstance(value, str) else None
+    if moment is None:
+        raise CartError("Invalid created_at", 400)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, store_timezone(store))
+    if moment > timezone.now() + CLOCK_SKEW:
+        raise CartError("created_at is in the future", 400)
+    return moment
+
+
+def is_id(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def check_item(item: Any) -> None:
+    """Check the types of a dish entry before it is looked up in the menu"""
+    if not isinstance(item, dict) or not is_id(item.get("id")):
+        raise CartError("Invalid dish", 400)
+    modifiers = item.get("modifier", [])
+    if not isinstance(modifiers, list) or not all(map(is_id, modifiers)):
+        raise CartError("Invalid modifier", 400)
+    quantity = item.get("quantity", None)
+    if quantity is None:
+        raise CartError("Missing parameter", 400)
+    if not is_id(quantity) or quantity < 1:
+        raise CartError("Invalid quantity", 400)
+    comments = item.get("other_comments", "")
+    if not isinstance(comments, str) or len(comments) > OTHER_COMMENTS_LENGTH:
+        raise CartError("Invalid other_comments", 400)
+
+
+def is_valid_item(item: Any) -> bool:
+    try:
+        check_item(item)
+    except CartError:
+        return False
+    return True
+
+
+def queue_order(
+    index: int,
+    entry: Dict[str, Any],
+    client_id: str,
+    digest: str,
+    store: Store,
+    dish_map: Dict[int, Dish],
+    modifier_map: Dict[int, DishModifier],
+) -> QueuedOrder:
+    """Validate one order of the batch against the menu snapshot"""
+    created_at = parse_created_at(entry.get("created_at"), store)
+    dishes = entry.get("dishes", None)
+    if not isinstance(dishes, list):
+        raise CartError("Missing parameter", 400)
+    if len(dishes) == 0:
+        raise CartError("No dishes in order", 400)
+    for item in dishes:
+        check_item(item)
+    return QueuedOrder(
+        index=index,
+        client_id=client_id,
+        digest=digest,
+        created_at=created_at,
+        is_online=bool(entry.get("isOnline", False)),
+        is_completed=bool(entry.get("isCompleted", False)),
+        lines=[build_line(item, dish_map, modifier_map) for item in dishes],
+    )
+
+
+def plan_batch(
+    store: Store, entries: List[Any]
+) -> Tuple[List[Optional[Dict[str, Any]]], List[QueuedOrder], Dict[int, QueuedOrder]]:
+    """Validate the batch with one query for each of the dishes, the modifiers
+    and the already used client ids.
+
+    Returns the results known before writing, the orders to write and the
+    repeats of those orders within the batch, by index.
+    """
+    entries = [entry if isinstance(entry, dict) else {} for entry in entries]
+    items = [
+        item
+        for entry in entries
+        if isinstance(entry.get("dishes"), list)
+        for item in entry["dishes"]
+        if is_valid_item(item)
+    ]
+    dish_map, modifier_map = load_menu(store, items)
+    client_ids: List[Optional[str]] = []
+    for entry in entries:
+        try:
+            client_ids.append(client_order_id(entry))
+        except CartError:
+            client_ids.append(None)
+    records = find_records(store, [key for key in client_ids if key is not None])
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(entries)
+    queued: List[QueuedOrder] = []
+    repeats: Dict[int, QueuedOrder] = {}
+    # client id -> (digest, the order or error result of its first entry)
+    seen: Dict[str, Tuple[str, Any]] = {}
+    for index, (entry, client_id) in enumerate(zip(entries, client_ids)):
+        try:
+            if client_id is None:
+                client_order_id(entry)
+                continue
+            digest = order_fingerprint(entry)
+            record = records.get(client_id)
+            if record is not None:
+                if record.fingerprint != digest:
+                    raise CartError("client_id was used for a different order", 422)
+                results[index] = {
+                    "client_id": client_id,
+                    "status": "duplicate",
+                    "id": record.order_id,
+                }
+                continue
+            first = seen.get(client_id)
+            if first is not None:
+                if first[0] != digest:
+                    raise CartError("client_id was used for a different order", 422)
+                if isinstance(first[1], QueuedOrder):
+                    repeats[index] = first[1]
+                else:
+                    results[index] = first[1]
+                continue
+            try:
+                order = queue_order(
+                    index, entry, client_id, digest, store, dish_map, modifier_map
+                )
+            except CartError as error:
+                seen[client_id] = (digest, error_result(client_id, error))
+                raise
+            seen[client_id] = (digest, order)
+            queued.append(order)
+        except CartError as error:
+            results[index] = error_result(client_id, error)
+    return results, queued, repeats
+
+
+def write_chunk(store: Store, chunk: List[QueuedOrder]) -> None:
+    """Write the orders with their lines, modifiers, rollups and idempotency
+    records in one transaction, setting their ids.
+
+    Raises ``IntegrityError`` when a concurrent upload stored one of the
+    client ids first.
+    """
+    through = OrderDishRelation.modifiers.through
+    keys = [queued.client_id for queued in chunk]
+    with transaction.atomic():
+        last = allocate_changes(store.id, len(chunk))
+        updated_at = timezone.now()
+        orders = Order.objects.bulk_create(
+            [
+                Order(
+                    store=store,
+                    created_at=queued.created_at,
+                    updated_at=updated_at,
+                    change_seq=last - len(chunk) + offset + 1,
+                    is_online=queued.is_online,
+                    is_completed=queued.is_completed,
+                )
+                for offset, queued in enumerate(chunk)
+            ]
+        )
+        lines = [line for queued in chunk for line in queued.lines]
+        relations = OrderDishRelation.objects.bulk_create(
+            [
+                OrderDishRelation(
+                    order=order,
+                    dish=line.dish,
+                    quantity=line.quantity,
+                    other_comments=line.other_comments,
+                )
+                for order, queued in zip(orders, chunk)
+                for line in queued.lines
+            ]
+        )
+        through.objects.bulk_create(
+            [
+                through(orderdishrelation_id=relation.id, dishmodifier_id=modifier.id)
+                for relation, line in zip(relations, lines)
+                for modifier in line.modifiers
+            ]
+        )
+        IdempotencyRecord.objects.filter(
+            store=store, key__in=keys, created_at__lt=expiry()
+        ).delete()
+        IdempotencyRecord.objects.bulk_create(
+            [
+                IdempotencyRecord(
+                    store=store,
+                    key=queued.client_id,
+                    fingerprint=queued.digest,
+                    order_id=order.id,
+                    status=200,
+                    response=ORDER_ADDED,
+                    created_at=updated_at,
+                )
+                for order, queued in zip(orders, chunk)
+            ]
+        )
+        record_orders(
+            store,
+            [
+                Sale(
+                    created_at=queued.created_at,
+                    is_completed=queued.is_completed,
+                    lines=[SaleLine.from_cart(line) for line in queued.lines],
+                )
+                for queued in chunk
+            ],
+        )
+    for order, queued in zip(orders, chunk):
+        queued.order_id = order.id
+
+
+def upload_orders(
+    store: Store, entries: List[Any]
+) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """Add the valid orders of the batch and return the result of every order
+    with the ids of the orders created.
+    """
+    results, pending, repeats = plan_batch(store, entries)
+    created: List[int] = []
+    size = settings.ORDER_BATCH_CHUNK_SIZE
+    for start in range(0, len(pending), size):
+        chunk = pending[start : start + size]
+        while chunk:
+            try:
+                write_chunk(store, chunk)
+            except IntegrityError:
+                # Some client ids were stored by a concurrent upload meanwhile
+                records = find_records(store, [queued.client_id for queued in chunk])
+                if not records:
+                    raise
+                for queued in chunk:
+                    record = records.get(queued.client_id)
+                    if record is None:
+                        continue
+                    if record.fingerprint == queued.digest:
+                        queued.order_id = record.order_id
+                        results[queued.index] = queued.result("duplicate")
+                    else:
+                        results[queued.index] = error_result(
+                            queued.client_id,
+                            CartError("client_id was used for a different order", 422),
+                        )
+                chunk = [queued for queued in chunk if queued.client_id not in records]
+                continue
+            for queued in chunk:
+                results[queued.index] = queued.result()
+                created.append(queued.order_id)
+            chunk = []
+    for index, first in repeats.items():
+        repeat = results[first.index]
+        if repeat["status"] == "created":
+            repeat = {**repeat, "status": "duplicate"}
+        results[index] = repeat
+    return results, created
@@ -0,0 +1,495 @@
+"""Helpers for the API benchmark management commands.
+
+Benchmarks run in-process against a throwaway test database, driving the
+sync views through the test ``Client`` (the WSGI request path) and the async
+views through ``AsyncClient`` (the ASGI request path).
+"""
+
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import include, path
+from django.utils.timezone import now
+
+from . import async_views
+from . import urls as api_urls
+from .models import Dish, DishModifier, Order, OrderDishRelation, Store
+
+# The read endpoints that have async implementations, by URL name
+ASYNC_VIEWS = {
+    "stores": async_views.get_stores,
+    "orders": async_views.orders,
+    "order_by_id": async_views.order_by_id,
+    "get_dishes": async_views.get_dishes,
+}
+
+
+@contextmanager
+def benchmark_database() -> Iterator[None]:
+    """Run the block against a fresh test database with query logging off"""
+    with override_settings(DEBUG=False):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            yield
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def async_urlconf() -> ModuleType:
+    """A URLconf that routes the read endpoints to their async views"""
+    module = ModuleType("benchmark_async_urls")
+    module.urlpatterns = [
+        path(
+            "api/",
+            include(
+                [
+                    path(
+                        str(pattern.pattern),
+                        ASYNC_VIEWS.get(pattern.name, pattern.callback),
+                        name=pattern.name,
+                    )
+                    for pattern in api_urls.urlpatterns
+                ]
+            ),
+        )
+    ]
+    return module
+
+
+def seed_store(
+    user: User,
+    name: str,
+    dishes: int,
+    modifiers: int,
+    orders: int,
+    lines: int,
+    days: int = 0,
+) -> Store:
+    """Create a store with a menu and orders using bulk inserts.
+
+    The orders are a second apart up to now, or spread evenly over the last
+    ``days`` days.
+    """
+    store = Store.objects.create(name=name, description="", user=user)
+    menu = Dish.objects.bulk_create(
+        [
+            Dish(store=store, name=f"Dish {i}", price=1000 + i, description="")
+            for i in range(dishes)
+        ]
+    )
+    options = DishModifier.objects.bulk_create(
+        [
+            DishModifier(dish=dish, name=f"Option {j}", price=100 * j)
+            for dish in menu
+            for j in range(modifiers)
+        ]
+    )
+    span = timedelta(days=days) if days else timedelta(seconds=orders)
+    start = now() - span
+    created = Order.objects.bulk_create(
+        [
+            Order(
+                store=store,
+                created_at=start + span * i / max(orders, 1),
+                is_online=i % 2 == 0,
+                is_completed=False,
+            )
+            for i in range(orders)
+        ]
+    )
+    relations = OrderDishRelation.objects.bulk_create(
+        [
+            OrderDishRelation(
+                order=order,
+                dish=menu[(i + j) % len(menu)],
+                quantity=1 + j,
+                other_comments="",
+            )
+            for i, order in enumerate(created)
+            for j in range(lines)
+        ]
+    )
+    through = OrderDishRelation.modifiers.through
+    per_dish = {dish.id: [] for dish in menu}
+    for option in options:
+        per_dish[option.dish_id].append(option)
+    through.objects.bulk_create(
+        [
+            through(orderdishrelation_id=relation.id, dishmodifier_id=option.id)
+            for relation in relations
+            for option in per_dish[relation.dish_id][:1]
+        ]
+    )
+    return store
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    """The nearest-rank percentile of the samples"""
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(latencies: List[float], wall: float) -> Dict[str, float]:
+    """Throughput and latency percentiles of a benchmark run, in milliseconds"""
+    return {
+        "requests": len(latencies),
+        "throughput": round(len(latencies) / wall, 1) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def split(total: int, workers: int) -> List[int]:
+    """Share the requests between the workers"""
+    return [total // workers + (i < total % workers) for i in range(workers)]
+
+
+def run_threaded(
+    clients: List[Client],
+    request: Callable[[Client], Any],
+    total: int,
+) -> Tuple[List[float], float]:
+    """Send the requests from one thread per client, like a threaded WSGI server.
+
+    The clients are logged in beforehand, as logging in writes to the database.
+    """
+
+    def worker(client: Client, count: int) -> List[float]:
+        latencies = []
+        try:
+            for _ in range(count):
+                start = time.perf_counter()
+                request(client)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            connections.close_all()
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(clients)) as pool:
+        results = list(pool.map(worker, clients, split(total, len(clients))))
+    wall = time.perf_counter() - start
+    return [latency for result in results for latency in result], wall
+
+
+def run_async(
+    client: AsyncClient,
+    request: Callable[[AsyncClient], Any],
+    total: int,
+    concurrency: int,
+) -> Tuple[List[float], float]:
+    """Send the requests from concurrent tasks on one event loop, like ASGI"""
+
+    async def worker(count: int) -> List[float]:
+        latencies = []
+        for _ in range(count):
+            start = time.perf_counter()
+            await request(client)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    async def main() -> List[List[float]]:
+        return await asyncio.gather(
+            *(worker(count) for count in split(total, concurrency))
+        )
+
+    start = time.perf_counter()
+    results = asyncio.run(main())
+    wall = time.perf_counter() - start
+    return [latency for result in results for latency in result], wall
+
+
+def check(response: Any, expected: Optional[int] = 200) -> Any:
+    """Fail the benchmark when an endpoint does not answer as expected"""
+    if expected is not None and response.status_code != expected:
+        raise RuntimeError(
+            f"Unexpected status {response.status_code}: {response.content[:200]!r}"
+        )
+    return response
+
+
+# Data sizes the endpoint suite runs at: stores, dishes per store, orders per
+# store and the days they are spread over
+SCALES = {
+    "small": {"stores": 2, "dishes": 20, "orders": 500, "days": 30},
+    "medium": {"stores": 10, "dishes": 100, "orders": 5000, "days": 180},
+    "large": {"stores": 50, "dishes": 500, "orders": 7300, "days": 365},
+}
+
+
+@dataclass
+class Endpoint:
+    """How to call one route repeatedly in a benchmark"""
+
+    method: str
+    # Builds the URL of the i-th request
+    url: Callable[[int], str]
+    # Builds the JSON body of the i-th request
+    body: Optional[Callable[[int], Any]] = None
+    status: int = 200
+    # Caps the number of requests, for routes that hash passwords
+    limit: Optional[int] = None
+    # Creates what the requests will consume, given their number
+    prepare: Optional[Callable[[int], None]] = None
+    # Server-Sent Events, timed to the first chunk on the ASGI path
+    stream: bool = False
+
+
+def route_labels() -> List[str]:
+    """Every route of api.urls and auth.urls, by URL name or path"""
+    from auth import urls as auth_urls
+
+    return [pattern.name for pattern in api_urls.urlpatterns] + [
+        f"accounts/{pattern.pattern}" for pattern in auth_urls.urlpatterns
+    ]
+
+
+def endpoint_suite(user: User, password: str, store: Store) -> Dict[str, Endpoint]:
+    """The requests made to each route against a seeded store"""
+    from auth.tokens import issue_token
+
+    base = f"/api/stores/{store.id}"
+    dishes = list(Dish.objects.filter(store=store).order_by("id")[:10])
+    order = Order.objects.filter(store=store).order_by("-created_at").first()
+    modifier = DishModifier.objects.filter(dish=dishes[0]).first()
+    today = now().date()
+    doomed: List[Dish] = []
+    tokens: List[str] = []
+
+    def make_doomed(total: int) -> None:
+        doomed[:] = Dish.objects.bulk_create(
+            [
+                Dish(store=store, name=f"Doomed {i}", price=1, description="")
+                for i in range(total)
+            ]
+        )
+
+    def make_tokens(total: int) -> None:
+        tokens[:] = [issue_token(user, f"Bench {i}") for i in range(total)]
+
+    credentials = {"username": user.username, "password": password}
+    return {
+        "stores": Endpoint("get", lambda i: "/api/stores/"),
+        "add_store": Endpoint(
+            "post",
+            lambda i: "/api/stores/add",
+            lambda i: {"name": f"Bench store {i}", "description": ""},
+        ),
+        "orders": Endpoint("get", lambda i: f"{base}/orders/"),
+        "add_order": Endpoint(
+            "post",
+            lambda i: f"{base}/orders/add",
+            lambda i: {
+                "isOnline": True,
+                "dishes": [
+                    {"id": dishes[0].id, "quantity": 2, "modifier": [modifier.id]},
+                    {"id": dishes[i % len(dishes)].id, "quantity": 1},
+                ],
+            },
+        ),
+        "batch_orders": Endpoint(
+            "post",
+            lambda i: f"{base}/orders/batch",
+            lambda i: {
+                "orders": [
+                    {
+                        "client_id": f"bench-{i}-{index}",
+                        "created_at": (now() - timedelta(minutes=index)).isoformat(),
+                        "dishes": [
+                            {"id": dishes[index % len(dishes)].id, "quantity": 1}
+                        ],
+                    }
+                    for index in range(100)
+                ]
+            },
+        ),
+        "order_stream": Endpoint("get", lambda i: f"{base}/orders/stream", stream=True),
+        "sync_orders": Endpoint("get", lambda i: f"{base}/orders/sync?limit=100"),
+        "export_orders": Endpoint(
+            "get",
+            lambda i: f"{base}/orders/export?from={today - timedelta(days=6)}",
+        ),
+        "order_by_id": Endpoint("get", lambda i: f"{base}/orders/{order.id}/"),
+        "complete_order": Endpoint(
+            "post",
+            lambda i: f"{base}/orders/{order.id}/complete",
+            lambda i: {"is_completed": i % 2 == 0},
+        ),
+        "sales_analytics": Endpoint(
+            "get", lambda i: f"{base}/analytics?from={today - timedelta(days=29)}"
+        ),
+        "get_dishes": Endpoint("get", lambda i: f"{base}/dishes/"),
+        "add_dishes": Endpoint(
+            "post",
+            lambda i: f"{base}/dishes/add",
+            lambda i: {
+                "name": f"Bench dish {i}",
+                "price": 1000,
+                "modifiers": [{"name": "Large", "price": 100}],
+            },
+        ),
+        "bulk_menu": Endpoint(
+            "post",
+            lambda i: f"{base}/dishes/bulk",
+            lambda i: {
+                "operations": [
+                    {"op": "update_dish", "id": dish.id, "price": 1000 + i}
+                    for dish in dishes
+                ]
+            },
+        ),
+        "bulk_available": Endpoint(
+            "post",
+            lambda i: f"{base}/dishes/available",
+            lambda i: {"is_available": i % 2 == 1, "dishes": {"match": "Dish 1"}},
+        ),
+        "edit_dish": Endpoint(
+            "post",
+            lambda i: f"{base}/dishes/{dishes[1].id}/edit",
+            lambda i: {"price": 2000 + i},
+        ),
+        "delete dish": Endpoint(
+            "post",
+            lambda i: f"{base}/dishes/{doomed[i].id}/delete",
+            lambda i: {},
+            prepare=make_doomed,
+        ),
+        "available": Endpoint(
+            "post",
+            lambda i: f"{base}/dishes/{dishes[2].id}/available",
+            lambda i: {"is_available": i % 2 == 1},
+        ),
+        "Add modifier": Endpoint(
+            "post",
+            lambda i: f"{base}/dishes/{dishes[3].id}/modifier/add",
+            lambda i: {"name": f"Option {i}", "price": 50},
+        ),
+        "accounts/login/": Endpoint(
+            "post", lambda i: "/accounts/login/", lambda i: credentials, limit=20
+        ),
+        "accounts/register/": Endpoint(
+            "post",
+            lambda i: "/accounts/register/",
+            lambda i: {"username": f"bench-user-{i}", "password": password},
+            status=201,
+            limit=20,
+        ),
+        "accounts/tokens/": Endpoint(
+            "post",
+            lambda i: "/accounts/tokens/",
+            lambda i: {**credentials, "device": f"Bench {i}"},
+            status=201,
+            limit=20,
+        ),
+        "accounts/tokens/revoke": Endpoint(
+            "post",
+            lambda i: "/accounts/tokens/revoke",
+            lambda i: {"token": tokens[i]},
+            prepare=make_tokens,
+        ),
+    }
+
+
+def measure_endpoint(
+    client: Client, async_client: AsyncClient, endpoint: Endpoint, total: int
+) -> Dict[str, Any]:
+    """Latency percentiles, throughput and queries per request of one route.
+
+    Requests are sent one at a time so that their queries can be counted.
+    """
+    total = min(total, endpoint.limit or total)
+    if endpoint.prepare is not None:
+        endpoint.prepare(total)
+    if endpoint.stream:
+        return measure_stream(async_client, endpoint, total)
+
+    latencies: List[float] = []
+    queries: List[int] = []
+    started = time.perf_counter()
+    for i in range(total):
+        body = endpoint.body(i) if endpoint.body else None
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            if endpoint.method == "get":
+                response = client.get(endpoint.url(i))
+            else:
+                response = client.post(
+                    endpoint.url(i), body, content_type="application/json"
+                )
+            if response.streaming:
+                b"".join(response.streaming_content)
+            latencies.append(time.perf_counter() - start)
+        check(response, endpoint.status)
+        queries.append(len(context.captured_queries))
+    summary: Dict[str, Any] = summarize(latencies, time.perf_counter() - started)
+    summary["queries_p50"] = sorted(queries)[len(queries) // 2]
+    summary["queries_max"] = max(queries)
+    return summary
+
+
+def measure_stream(
+    client: AsyncClient, endpoint: Endpoint, total: int
+) -> Dict[str, Any]:
+    """Time opening an event stream until its first chunk arrives"""
+
+    async def request(client: AsyncClient) -> None:
+        response = check(await client.get(endpoint.url(0)), endpoint.status)
+        chunks = response.streaming_content
+        await chunks.__anext__()
+        await chunks.aclose()
+
+    summary: Dict[str, Any] = summarize(*run_async(client, request, total, 1))
+    # Queries run on the ORM's worker thread and are not counted
+    summary["queries_p50"] = summary["queries_max"] = None
+    return summary
+
+
+def compare_results(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float,
+    min_delta_ms: float = 5.0,
+) -> List[str]:
+    """The regressions of the results against a baseline run.
+
+    A route regresses when it runs more queries, or when its p95 latency
+    grew by more than the tolerance and by at least ``min_delta_ms``.
+    """
+    regressions = []
+    for scale, routes in results["scales"].items():
+        for route, summary in routes.items():
+            base = baseline.get("scales", {}).get(scale, {}).get(route)
+            if base is None:
+                continue
+            if (
+                base["queries_max"] is not None
+                and summary["queries_max"] is not None
+                and summary["queries_max"] > base["queries_max"]
+            ):
+                regressions.append(
+                    f"{scale} {route}: {summary['queries_max']} queries, "
+                    f"was {base['queries_max']}"
+                )
+            slower = summary["p95_ms"] - base["p95_ms"]
+            if slower > min_delta_ms and summary["p95_ms"] > base["p95_ms"] * (
+                1 + tolerance
+            ):
+                regressions.append(
+                    f"{scale} {route}: p95 {summary['p95_ms']} ms, "
+                    f"was {base['p95_ms']} ms"
+                )
+    return regressions
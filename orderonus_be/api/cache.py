@@ -0,0 +1,140 @@
+import hashlib
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Tuple
+from django.conf import settings
+from django.core.cache import BaseCache, caches
+from orderonus_be.metrics import registry
+
+MENU = "menu"
+ORDERS = "orders"
+
+
+class CacheStats:
+    """Hit and miss counters of a cache, shared by the threads of the process.
+
+    Lookups are also counted in the metrics registry, which exposes them
+    summed over every process as ``orderonus_cache_lookups_total``.
+    """
+
+    def __init__(self: "CacheStats", name: str) -> None:
+        self.name = name
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self: "CacheStats", hit: bool) -> None:
+        """Count a lookup"""
+        registry.observe_cache(self.name, hit)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def to_dict(self: "CacheStats") -> Dict[str, int]:
+        """Serialize the counters to a dictionary"""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+menu_stats = CacheStats("menu")
+
+
+def get_cache() -> BaseCache:
+    """The cache backend configured for the API"""
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def version_key(kind: str, store_id: int) -> str:
+    return f"api:{kind}:version:{store_id}"
+
+
+def initial_version() -> int:
+    """A starting version larger than any the evicted key could have reached"""
+    return time.time_ns() // 1000
+
+
+def get_version(kind: str, store_id: int) -> int:
+    """The current version of the store's data of the given kind"""
+    cache = get_cache()
+    key = version_key(kind, store_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, initial_version(), timeout=None)
+        version = cache.get(key, initial_version())
+    return version
+
+
+async def aget_version(kind: str, store_id: int) -> int:
+    """Async version of ``get_version``, for views running on the event loop"""
+    cache = get_cache()
+    key = version_key(kind, store_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, initial_version(), timeout=None)
+        version = await cache.aget(key, initial_version())
+    return version
+
+
+def bump_version(kind: str, store_id: int) -> int:
+    """Invalidate everything cached for the store's data of the given kind"""
+    cache = get_cache()
+    key = version_key(kind, store_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = initial_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def bump_menu_version(store_id: int) -> int:
+    """Invalidate the cached menu of the store, call after changing it"""
+    return bump_version(MENU, store_id)
+
+
+def bump_orders_version(store_id: int) -> int:
+    """Invalidate the order feeds of the store, call after changing an order"""
+    return bump_version(ORDERS, store_id)
+
+
+def menu_key(store_id: int, variant: str, version: int) -> str:
+    digest = hashlib.sha1(variant.encode()).hexdigest()
+    return f"api:{MENU}:{store_id}:{version}:{digest}"
+
+
+def cached_menu(
+    store_id: int, variant: str, build: Callable[[], bytes]
+) -> Tuple[bytes, bool]:
+    """Get the serialized menu page from the cache, building it on a miss.
+
+    ``variant`` identifies the page (cursor and page size) within the menu.
+    Returns the content and whether it came from the cache.
+    """
+    cache = get_cache()
+    key = menu_key(store_id, variant, get_version(MENU, store_id))
+    content = cache.get(key)
+    menu_stats.record(content is not None)
+    if content is not None:
+        return content, True
+
+    content = build()
+    cache.set(key, content, timeout=settings.MENU_CACHE_TIMEOUT)
+    return content, False
+
+
+async def acached_menu(
+    store_id: int, variant: str, build: Callable[[], Awaitable[bytes]]
+) -> Tuple[bytes, bool]:
+    """Async version of ``cached_menu``"""
+    cache = get_cache()
+    key = menu_key(store_id, variant, await aget_version(MENU, store_id))
+    content = await cache.aget(key)
+    menu_stats.record(content is not None)
+    if content is not None:
+        return content, True
+
+    content = await build()
+    await cache.aset(key, content, timeout=settings.MENU_CACHE_TIMEOUT)
+    return content, False
@@ -0,0 +1,78 @@
+"""The change sequence of a store's orders, for delta sync.
+
+Every write to an order through the API gives it the next number of its
+store's sequence, kept in ``ChangeSequence``. The number is taken inside
+the transaction writing the order and the counter row stays locked until
+it commits, so orders become visible in sequence order and a client that
+remembers the last ``(change_seq, id)`` it saw never misses a change.
+
+Archiving an order removes it from ``Order`` and gives the removal a number
+of the same sequence, kept on its ``ArchivedOrder``. Removals are merged
+into the changes by their number and reported as ids only.
+"""
+
+import heapq
+from typing import List, Optional, Tuple, Union
+from django.db.models import F
+from django.http.request import HttpRequest
+from django.utils.timezone import now
+
+from .models import ArchivedOrder, ChangeSequence, Order, Store
+from .pagination import encode_cursor, page_queryset
+from .serializers import prefetch_orders
+
+SYNC_FIELDS = ("change_seq", "id")
+
+
+def allocate_changes(store_id: int, count: int = 1) -> int:
+    """Take ``count`` numbers of the store's sequence and return the last one.
+
+    Must be called inside the transaction writing the changes.
+    """
+    counter = ChangeSequence.objects.filter(store_id=store_id)
+    if not counter.update(value=F("value") + count):
+        ChangeSequence.objects.bulk_create(
+            [ChangeSequence(store_id=store_id)], ignore_conflicts=True
+        )
+        counter.update(value=F("value") + count)
+    return counter.values_list("value", flat=True).get()
+
+
+def mark_changed(order: Order) -> None:
+    """Stamp the order with the time and the next sequence number, before saving"""
+    order.change_seq = allocate_changes(order.store_id)
+    order.updated_at = now()
+
+
+def changed_orders(
+    store: Store, request: HttpRequest
+) -> Tuple[List[Order], List[int], Optional[str], bool]:
+    """The orders changed and the ids of the orders archived after the
+    ?cursor=, the cursor to poll with next and whether more changes are
+    waiting.
+
+    Without a cursor every order of the store is returned, oldest change
+    first, and no removals. Raises ``PaginationError`` for an invalid cursor
+    or page size.
+    """
+    page, size = page_queryset(
+        prefetch_orders(Order.objects.filter(store=store)), request, SYNC_FIELDS
+    )
+    changes: List[Union[Order, ArchivedOrder]] = list(page)
+    if request.GET.get("cursor"):
+        removed, _ = page_queryset(
+            ArchivedOrder.objects.filter(store=store).only(*SYNC_FIELDS),
+            request,
+            SYNC_FIELDS,
+        )
+        changes = list(
+            heapq.merge(changes, removed, key=lambda row: (row.change_seq, row.id))
+        )
+    more = len(changes) > size
+    changes = changes[:size]
+    rows = [row for row in changes if isinstance(row, Order)]
+    removed_ids = [row.id for row in changes if isinstance(row, ArchivedOrder)]
+    if not changes:
+        return rows, removed_ids, request.GET.get("cursor") or None, more
+    cursor = encode_cursor([changes[-1].change_seq, changes[-1].id])
+    return rows, removed_ids, cursor, more
@@ -0,0 +1,135 @@
+"""ETag hooks for ``django.views.decorators.http.condition``.
+
+The ETags are derived from the per-store change versions kept in
+``api.cache``, so a conditional request is answered without loading or
+serializing the menu or the orders. Orders embed their dishes and
+modifiers, so their ETags change with the menu too. The ``a`` prefixed
+hooks read the versions with the async cache API, for the async views.
+
+No Last-Modified date is sent: it only has a resolution of one second, so
+a client relying on If-Modified-Since would miss a second change made in
+the same second.
+"""
+
+import hashlib
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional
+from django.http.request import HttpRequest
+from django.http.response import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .cache import MENU, ORDERS, aget_version, get_version
+from .dates import requested_range
+from .models import Store
+from .utils import arequest_store, request_store
+
+
+def page_digest(request: HttpRequest, *parts: str) -> str:
+    """Identify the page of a listing that the request asks for"""
+    variant = ":".join(
+        [*parts, request.GET.get("cursor", ""), request.GET.get("limit", "")]
+    )
+    return hashlib.sha1(variant.encode()).hexdigest()[:16]
+
+
+def orders_versions(store: Store) -> str:
+    """The versions serialized orders depend on, their own and the menu's"""
+    return f"{get_version(ORDERS, store.id)}-{get_version(MENU, store.id)}"
+
+
+def store_menu_etag(request: HttpRequest, store: Store) -> Optional[str]:
+    return f"menu-{store.id}-{get_version(MENU, store.id)}-{page_digest(request)}"
+
+
+def store_orders_etag(request: HttpRequest, store: Store) -> Optional[str]:
+    try:
+        start, end = requested_range(request, store)
+    except ValueError:
+        return None
+    digest = page_digest(request, start.isoformat(), end.isoformat())
+    return f"orders-{store.id}-{orders_versions(store)}-{digest}"
+
+
+def store_sync_etag(request: HttpRequest, store: Store) -> Optional[str]:
+    return f"sync-{store.id}-{orders_versions(store)}-{page_digest(request)}"
+
+
+def store_order_etag(request: HttpRequest, store: Store, order_id: int) -> str:
+    return f"order-{store.id}-{order_id}-{orders_versions(store)}"
+
+
+async def aorders_versions(store: Store) -> str:
+    orders = await aget_version(ORDERS, store.id)
+    return f"{orders}-{await aget_version(MENU, store.id)}"
+
+
+async def astore_menu_etag(request: HttpRequest, store: Store) -> Optional[str]:
+    version = await aget_version(MENU, store.id)
+    return f"menu-{store.id}-{version}-{page_digest(request)}"
+
+
+async def astore_orders_etag(request: HttpRequest, store: Store) -> Optional[str]:
+    try:
+        start, end = requested_range(request, store)
+    except ValueError:
+        return None
+    digest = page_digest(request, start.isoformat(), end.isoformat())
+    return f"orders-{store.id}-{await aorders_versions(store)}-{digest}"
+
+
+async def astore_order_etag(request: HttpRequest, store: Store, order_id: int) -> str:
+    return f"order-{store.id}-{order_id}-{await aorders_versions(store)}"
+
+
+def for_store(hook: Callable[..., Any]) -> Callable[..., Any]:
+    """Adapt a hook taking the store to the view arguments ``condition`` passes"""
+
+    @wraps(hook)
+    def inner(request: HttpRequest, store_id: int, *args: Any, **kwargs: Any) -> Any:
+        store = request_store(request, store_id)
+        if store is None:
+            return None
+        return hook(request, store, *args, **kwargs)
+
+    return inner
+
+
+menu_etag = for_store(store_menu_etag)
+orders_etag = for_store(store_orders_etag)
+order_etag = for_store(store_order_etag)
+sync_etag = for_store(store_sync_etag)
+
+
+def async_condition(
+    etag_func: Callable[..., Awaitable[Optional[str]]],
+) -> Callable[..., Any]:
+    """Async counterpart of ``condition`` for views of a store.
+
+    The hook is a coroutine function taking the resolved store instead of
+    the store id.
+    """
+
+    def decorator(
+        view: Callable[..., Awaitable[HttpResponse]],
+    ) -> Callable[..., Awaitable[HttpResponse]]:
+        @wraps(view)
+        async def inner(
+            request: HttpRequest, store_id: int, *args: Any, **kwargs: Any
+        ) -> HttpResponse:
+            store = await arequest_store(request, store_id)
+            if store is None:
+                return await view(request, store_id, *args, **kwargs)
+
+            etag = await etag_func(request, store, *args, **kwargs)
+            etag = quote_etag(etag) if etag is not None else None
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = await view(request, store_id, *args, **kwargs)
+            if etag:
+                response.headers.setdefault("ETag", etag)
+            return response
+
+        return inner
+
+    return decorator
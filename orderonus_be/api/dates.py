@@ -0,0 +1,82 @@
+from datetime import date, datetime, time, timedelta, tzinfo
+from typing import Any, Optional, Tuple
+import zoneinfo
+from django.http.request import HttpRequest
+from django.utils import timezone
+
+from .models import Store
+
+
+def store_timezone(store: Store) -> tzinfo:
+    """The timezone the store's business day is counted in"""
+    try:
+        return zoneinfo.ZoneInfo(store.timezone)
+    except (zoneinfo.ZoneInfoNotFoundError, TypeError, ValueError):
+        return timezone.get_default_timezone()
+
+
+def is_valid_timezone(name: Any) -> bool:
+    """Check if the name is a timezone that stores can be assigned"""
+    if not isinstance(name, str):
+        return False
+    try:
+        zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def start_of_day(day: date, tz: tzinfo) -> datetime:
+    """The first instant of the day in the given timezone"""
+    return timezone.make_aware(datetime.combine(day, time.min), tz)
+
+
+def local_today(store: Store) -> date:
+    """Today's date in the store's timezone"""
+    return timezone.localtime(timezone.now(), store_timezone(store)).date()
+
+
+def day_range(day: date, tz: tzinfo) -> Tuple[datetime, datetime]:
+    """The half-open datetime range covering the day in the given timezone"""
+    return start_of_day(day, tz), start_of_day(day + timedelta(days=1), tz)
+
+
+def parse_bound(value: str, tz: tzinfo, is_end: bool) -> datetime:
+    """Parse a date or datetime bound, interpreting naive values in tz.
+
+    A bare date used as the end of a range includes the whole of that day.
+    """
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        moment = datetime.fromisoformat(value)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment, tz)
+        return moment
+    return start_of_day(day + timedelta(days=1) if is_end else day, tz)
+
+
+def parse_range(
+    store: Store, start_param: Optional[str], end_param: Optional[str]
+) -> Tuple[datetime, datetime]:
+    """The half-open ``[start, end)`` range between two optional bounds.
+
+    Missing bounds default to today in the store's timezone. Raises
+    ``ValueError`` when a bound cannot be parsed or the range is reversed.
+    """
+    tz = store_timezone(store)
+    start, end = day_range(local_today(store), tz)
+    if start_param:
+        start = parse_bound(start_param, tz, is_end=False)
+        if not end_param:
+            end = max(end, day_range(start.astimezone(tz).date(), tz)[1])
+    if end_param:
+        end = parse_bound(end_param, tz, is_end=True)
+    if start >= end:
+        raise ValueError("The range must end after it starts")
+    return start, end
+
+
+def requested_range(request: HttpRequest, store: Store) -> Tuple[datetime, datetime]:
+    """The range asked for with ?from= and ?to=, see ``parse_range``"""
+    return parse_range(store, request.GET.get("from"), request.GET.get("to"))
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Set
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Order
+from .serializers import prefetch_orders
+
+
+@dataclass
+class Event:
+    """A change to the orders of a store, sent to the order streams"""
+
+    id: int
+    name: str
+    data: Dict[str, Any]
+
+    def encode(self: "Event") -> bytes:
+        """Format the event as a Server-Sent Events message"""
+        payload = json.dumps(self.data, cls=DjangoJSONEncoder)
+        return f"id: {self.id}\nevent: {self.name}\ndata: {payload}\n\n".encode()
+
+
+@dataclass(eq=False)
+class Subscriber:
+    """An open order stream waiting for events on its event loop"""
+
+    store_id: int
+    loop: asyncio.AbstractEventLoop
+    queue: "asyncio.Queue[Optional[Event]]"
+    backlog: List[Event] = field(default_factory=list)
+    closed: bool = False
+
+    def deliver(self: "Subscriber", event: Optional[Event]) -> None:
+        """Queue the event, closing the stream if the client is not keeping up"""
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client reconnects with Last-Event-ID and replays what it missed
+            self.closed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class OrderEventBroker:
+    """In-process fan-out of order events to the open streams of each store.
+
+    Recent events of stores that have, or recently had, a listener are kept
+    so a reconnecting client can resume from its Last-Event-ID. Each worker
+    process has its own broker, so clients only see the changes made through
+    the process they are connected to.
+    """
+
+    def __init__(self: "OrderEventBroker") -> None:
+        self.lock = threading.Lock()
+        # Start from the clock so ids keep increasing across restarts and a
+        # Last-Event-ID from a previous process is detected as too old
+        self.last_id = time.time_ns() // 1000
+        self.history: Dict[int, Deque[Event]] = {}
+        self.subscribers: Dict[int, Set[Subscriber]] = {}
+        self.last_seen: Dict[int, float] = {}
+
+    def is_active(self: "OrderEventBroker", store_id: int) -> bool:
+        """Check if anyone is, or was recently, listening to the store"""
+        with self.lock:
+            return self._is_active(store_id)
+
+    def _is_active(self: "OrderEventBroker", store_id: int) -> bool:
+        if self.subscribers.get(store_id):
+            return True
+        last_seen = self.last_seen.get(store_id)
+        if last_seen is None:
+            return False
+        if time.monotonic() - last_seen > settings.ORDER_STREAM_RETENTION:
+            self.last_seen.pop(store_id, None)
+            self.history.pop(store_id, None)
+            return False
+        return True
+
+    def publish(
+        self: "OrderEventBroker", store_id: int, name: str, data: Dict[str, Any]
+    ) -> Optional[Event]:
+        """Send an event to the streams of the store, from any thread"""
+        with self.lock:
+            if not self._is_active(store_id):
+                return None
+            self.last_id += 1
+            event = Event(self.last_id, name, data)
+            self.history.setdefault(
+                store_id, deque(maxlen=settings.ORDER_STREAM_HISTORY)
+            ).append(event)
+            subscribers = list(self.subscribers.get(store_id, ()))
+
+        for subscriber in subscribers:
+            if subscriber.closed:
+                self.unsubscribe(subscriber)
+                continue
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, event)
+            except RuntimeError:
+                # The event loop of the stream has been closed
+                self.unsubscribe(subscriber)
+        return event
+
+    def subscribe(
+        self: "OrderEventBroker", store_id: int, last_event_id: Optional[int] = None
+    ) -> Subscriber:
+        """Open a stream on the running event loop.
+
+        The backlog holds the events after ``last_event_id``, or a ``reset``
+        event when they are no longer available and the client must refetch.
+        """
+        subscriber = Subscriber(
+            store_id=store_id,
+            loop=asyncio.get_running_loop(),
+            queue=asyncio.Queue(maxsize=settings.ORDER_STREAM_QUEUE_SIZE),
+        )
+        with self.lock:
+            self.subscribers.setdefault(store_id, set()).add(subscriber)
+            if last_event_id is not None:
+                history = list(self.history.get(store_id, ()))
+                oldest = history[0].id if history else self.last_id + 1
+                if last_event_id + 1 < oldest:
+                    subscriber.backlog.append(Event(self.last_id, "reset", {}))
+                else:
+                    subscriber.backlog.extend(
+                        event for event in history if event.id > last_event_id
+                    )
+        return subscriber
+
+    def unsubscribe(self: "OrderEventBroker", subscriber: Subscriber) -> None:
+        """Close a stream"""
+        with self.lock:
+            self.subscribers.get(subscriber.store_id, set()).discard(subscriber)
+            self.last_seen[subscriber.store_id] = time.monotonic()
+
+
+broker = OrderEventBroker()
+
+
+def publish_order_created(order: Order) -> None:
+    """Send a new order to the streams of its store"""
+    if not broker.is_active(order.store_id):
+        return
+    order = prefetch_orders(Order.objects.filter(id=order.id)).get()
+    broker.publish(order.store_id, "order.created", order.to_dict())
+
+
+def publish_orders_created(store_id: int, order_ids: List[int]) -> None:
+    """Send new orders to the streams of their store, loading them in one go"""
+    if not order_ids or not broker.is_active(store_id):
+        return
+    orders = prefetch_orders(Order.objects.filter(id__in=order_ids).order_by("id"))
+    for order in orders:
+        broker.publish(store_id, "order.created", order.to_dict())
+
+
+def publish_order_completed(order: Order) -> None:
+    """Send the completion status of an order to the streams of its store"""
+    broker.publish(
+        order.store_id,
+        "order.completed",
+        {"id": order.id, "is_completed": order.is_completed},
+    )
@@ -0,0 +1,190 @@
+import csv
+import heapq
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterator, List
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from .models import ArchivedOrder, DishModifier, Order, OrderDishRelation, Store
+from .pagination import after
+from .serializers import LINES_ATTR, MODIFIERS_ATTR
+
+CSV_HEADER = [
+    "order_id",
+    "created_at",
+    "is_online",
+    "is_completed",
+    "dish_id",
+    "dish",
+    "unit_price",
+    "quantity",
+    "modifiers",
+    "modifiers_price",
+    "line_total",
+    "other_comments",
+]
+
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def iter_orders(
+    store: Store, start: datetime, end: datetime, chunk_size: int = 0
+) -> Iterator[Order]:
+    """Yield the orders of the range in creation order, one chunk at a time.
+
+    Each chunk is fetched with a keyset query and its lines and chosen
+    modifiers are prefetched, so memory use is bounded by the chunk size.
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    queryset = (
+        Order.objects.filter(store=store, created_at__gte=start, created_at__lt=end)
+        .order_by("created_at", "id")
+        .prefetch_related(
+            Prefetch(
+                "orderdishrelation_set",
+                queryset=OrderDishRelation.objects.select_related("dish")
+                .prefetch_related(
+                    Prefetch(
+                        "modifiers",
+                        queryset=DishModifier.objects.order_by("id"),
+                        to_attr=MODIFIERS_ATTR,
+                    )
+                )
+                .order_by("id"),
+                to_attr=LINES_ATTR,
+            )
+        )
+    )
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield from chunk
+        last = chunk[-1]
+        chunk = list(
+            queryset.filter(after(("created_at", "id"), (last.created_at, last.id)))[
+                :chunk_size
+            ]
+        )
+
+
+def iter_archived(
+    store: Store, start: datetime, end: datetime, chunk_size: int = 0
+) -> Iterator[ArchivedOrder]:
+    """Yield the archived orders of the range in creation order, in chunks"""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    queryset = ArchivedOrder.objects.filter(
+        store=store, created_at__gte=start, created_at__lt=end
+    ).order_by("created_at", "id")
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield from chunk
+        last = chunk[-1]
+        chunk = list(
+            queryset.filter(after(("created_at", "id"), (last.created_at, last.id)))[
+                :chunk_size
+            ]
+        )
+
+
+def export_record(order: Order) -> Dict[str, Any]:
+    """Serialize an order with its lines and chosen modifiers for export"""
+    return {
+        "id": order.id,
+        "created_at": order.created_at.isoformat(),
+        "is_online": order.is_online,
+        "is_completed": order.is_completed,
+        "lines": [
+            {
+                "dish_id": line.dish_id,
+                "dish": line.dish.name,
+                "price": line.dish.price,
+                "quantity": line.quantity,
+                "other_comments": line.other_comments,
+                "modifiers": [
+                    {"id": modifier.id, "name": modifier.name, "price": modifier.price}
+                    for modifier in line.get_modifiers()
+                ],
+            }
+            for line in order.get_lines()
+        ],
+    }
+
+
+def iter_records(
+    store: Store, start: datetime, end: datetime
+) -> Iterator[Dict[str, Any]]:
+    """Export records of the range's orders and archived orders, in creation order"""
+    hot = (
+        (order.created_at, order.id, export_record(order))
+        for order in iter_orders(store, start, end)
+    )
+    cold = (
+        (order.created_at, order.id, order.to_record())
+        for order in iter_archived(store, start, end)
+    )
+    for _, _, record in heapq.merge(hot, cold, key=lambda item: item[:2]):
+        yield record
+
+
+def csv_rows(record: Dict[str, Any]) -> List[List[Any]]:
+    """Flatten an export record to one CSV row per order line"""
+    order = [
+        record["id"],
+        record["created_at"],
+        record["is_online"],
+        record["is_completed"],
+    ]
+    if not record["lines"]:
+        return [order + [""] * (len(CSV_HEADER) - len(order))]
+    rows = []
+    for line in record["lines"]:
+        modifiers_price = sum(modifier["price"] for modifier in line["modifiers"])
+        rows.append(
+            order
+            + [
+                line["dish_id"],
+                line["dish"],
+                line["price"],
+                line["quantity"],
+                "; ".join(modifier["name"] for modifier in line["modifiers"]),
+                modifiers_price,
+                (line["price"] + modifiers_price) * line["quantity"],
+                line["other_comments"],
+            ]
+        )
+    return rows
+
+
+class Echo:
+    """A file-like object that hands back what is written to it"""
+
+    def write(self: "Echo", value: str) -> str:
+        return value
+
+
+def stream_ndjson(records: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    """Format export records as newline delimited JSON"""
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + "\n"
+
+
+def stream_csv(records: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    """Format export records as CSV with a header row"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for record in records:
+        yield "".join(writer.writerow(row) for row in csv_rows(record))
+
+
+def stream_export(
+    store: Store, start: datetime, end: datetime, export_format: str
+) -> Iterator[str]:
+    """Stream the orders of the range in the given format"""
+    records = iter_records(store, start, end)
+    if export_format == "csv":
+        return stream_csv(records)
+    return stream_ndjson(records)
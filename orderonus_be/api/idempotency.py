@@ -0,0 +1,147 @@
+"""Idempotency keys for order requests.
+
+A client may send an ``Idempotency-Key`` header with an order. The
+response is stored under the key in the transaction that creates the
+order, and a retry with the same key is answered with the stored response
+after one lookup on the unique ``(store, key)`` index. A key reused with a
+different order is refused. Records expire after ``IDEMPOTENCY_KEY_TTL``
+seconds and are deleted by ``manage.py purge_idempotency_keys``.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional
+from django.conf import settings
+from django.http.request import HttpRequest
+from django.http.response import JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyRecord, Store
+
+HEADER = "Idempotency-Key"
+# What add_order answers, stored for the orders of batch uploads too
+ORDER_ADDED = {"data": "Order added successfully"}
+
+
+class IdempotencyError(Exception):
+    """Raised when an idempotency key cannot be used for the request"""
+
+    def __init__(self: "IdempotencyError", message: str, status: int) -> None:
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def idempotency_key(request: HttpRequest) -> Optional[str]:
+    """The key sent with the request, if any"""
+    key = request.headers.get(HEADER)
+    if key is None:
+        return None
+    key = key.strip()
+    if not key or len(key) > IdempotencyRecord._meta.get_field("key").max_length:
+        raise IdempotencyError(f"Invalid {HEADER}", 400)
+    return key
+
+
+def fingerprint(payload: Any) -> str:
+    """A digest identifying the request a key was first used for"""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    return hashlib.sha256(payload).hexdigest()
+
+
+def order_fingerprint(order: Dict[str, Any]) -> str:
+    """The digest of an order as sent to add_order or in a batch upload.
+
+    Only the fields that make up the order are hashed, with their defaults
+    filled in, so the same order has the same digest on both endpoints.
+    """
+    dishes = order.get("dishes")
+    if isinstance(dishes, list):
+        dishes = [
+            (
+                {
+                    "id": item.get("id"),
+                    "quantity": item.get("quantity"),
+                    "modifier": item.get("modifier", []),
+                    "other_comments": item.get("other_comments", ""),
+                }
+                if isinstance(item, dict)
+                else item
+            )
+            for item in dishes
+        ]
+    canonical = {
+        "isOnline": bool(order.get("isOnline", False)),
+        "isCompleted": bool(order.get("isCompleted", False)),
+        "dishes": dishes,
+    }
+    return fingerprint(json.dumps(canonical, sort_keys=True, default=str))
+
+
+def expiry() -> datetime:
+    """Records created before this time have expired"""
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def find_record(store: Store, key: str) -> Optional[IdempotencyRecord]:
+    """The unexpired record of the key"""
+    return IdempotencyRecord.objects.filter(
+        store=store, key=key, created_at__gte=expiry()
+    ).first()
+
+
+def find_records(store: Store, keys: Iterable[str]) -> Dict[str, IdempotencyRecord]:
+    """The unexpired records of the keys, by key, in one query"""
+    return {
+        record.key: record
+        for record in IdempotencyRecord.objects.filter(
+            store=store, key__in=set(keys), created_at__gte=expiry()
+        )
+    }
+
+
+def check_record(record: IdempotencyRecord, digest: str) -> None:
+    if record.fingerprint != digest:
+        raise IdempotencyError(f"{HEADER} was used for a different request", 422)
+
+
+def replay(record: IdempotencyRecord) -> JsonResponse:
+    """The stored response of the key"""
+    response = JsonResponse(record.response, status=record.status)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def remember(
+    store: Store,
+    key: str,
+    digest: str,
+    order_id: Optional[int],
+    status: int,
+    response: Any,
+) -> IdempotencyRecord:
+    """Store the response of the key, inside the transaction creating the order.
+
+    An expired record of the key is replaced. Raises ``IntegrityError`` when
+    a concurrent request stored the key first.
+    """
+    IdempotencyRecord.objects.filter(
+        store=store, key=key, created_at__lt=expiry()
+    ).delete()
+    return IdempotencyRecord.objects.create(
+        store=store,
+        key=key,
+        fingerprint=digest,
+        order_id=order_id,
+        status=status,
+        response=response,
+        created_at=timezone.now(),
+    )
+
+
+def purge_expired() -> int:
+    """Delete the expired records and return how many there were"""
+    deleted, _ = IdempotencyRecord.objects.filter(created_at__lt=expiry()).delete()
+    return deleted
@@ -0,0 +1,190 @@
+"""Resized and WebP derivatives of store and dish images.
+
+When a store or dish is saved with a new image, the derivatives listed in
+``IMAGE_VARIANTS`` are generated in a background thread pool once the
+transaction commits. They are written next to the original, e.g.
+``dishes/ramen.jpg`` gets ``dishes/ramen.thumb.webp``, and recorded in the
+model's ``image_variants`` so ``to_dict`` can list their URLs. The
+derivatives of the previous image are deleted once they are replaced.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from io import BytesIO
+from typing import Any, Dict, Iterator, Optional, Set, Type
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, models, transaction
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+from PIL import Image, ImageOps
+
+from .cache import bump_menu_version
+from .models import Dish, Store
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_pending: Set[Future] = set()
+
+
+def image_pool() -> ThreadPoolExecutor:
+    """The worker pool derivatives are generated in"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                settings.IMAGE_WORKERS, thread_name_prefix="image-variants"
+            )
+        return _pool
+
+
+def variant_name(name: str, variant: str, extension: str) -> str:
+    """The storage name of a derivative, next to the original"""
+    root, _ = os.path.splitext(name)
+    return f"{root}.{variant}.{extension}"
+
+
+def variant_files(variants: Dict[str, Dict[str, str]]) -> Iterator[str]:
+    """The storage names listed in ``image_variants``"""
+    for files in variants.values():
+        yield from files.values()
+
+
+def delete_variants(
+    variants: Dict[str, Dict[str, str]], keep: Dict[str, Dict[str, str]] = {}
+) -> None:
+    """Delete the files of derivatives that are not listed in ``keep``"""
+    kept = set(variant_files(keep))
+    for name in variant_files(variants):
+        if name not in kept:
+            default_storage.delete(name)
+
+
+def render_variants(name: str) -> Dict[str, Dict[str, str]]:
+    """Write the derivatives of the stored image and return their names"""
+    with default_storage.open(name, "rb") as source:
+        original = ImageOps.exif_transpose(Image.open(source))
+        original.load()
+
+    variants: Dict[str, Dict[str, str]] = {}
+    for variant, size in settings.IMAGE_VARIANTS.items():
+        image = original.copy()
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        variants[variant] = {}
+        for extension, image_format in FORMATS.items():
+            converted = image
+            if image_format == "JPEG" and image.mode not in ["RGB", "L"]:
+                converted = image.convert("RGB")
+            buffer = BytesIO()
+            converted.save(
+                buffer, image_format, quality=settings.IMAGE_QUALITY, optimize=True
+            )
+            target = variant_name(name, variant, extension)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            variants[variant][extension] = default_storage.save(
+                target, ContentFile(buffer.getvalue())
+            )
+    return variants
+
+
+def generate_variants(model: Type[models.Model], pk: int, name: str) -> None:
+    """Generate the derivatives of an image and record them on its row"""
+    try:
+        variants = render_variants(name)
+    except Exception:
+        logger.exception("Could not generate variants of %s", name)
+        return
+    with transaction.atomic():
+        rows = model.objects.filter(pk=pk, image=name)
+        previous = rows.values_list("image_variants", flat=True).first()
+        # The image was replaced in the meantime
+        if previous is None:
+            transaction.on_commit(lambda: delete_variants(variants))
+            return
+        rows.update(image_variants=variants)
+        transaction.on_commit(lambda: delete_variants(previous, keep=variants))
+    if model is Dish:
+        store_id = Dish.objects.filter(pk=pk).values_list("store_id", flat=True).first()
+        if store_id is not None:
+            bump_menu_version(store_id)
+
+
+def generate_in_worker(model: Type[models.Model], pk: int, name: str) -> None:
+    """``generate_variants`` in a pool thread, which keeps its own connection
+    and closes it like request threads do once it is too old or broken"""
+    close_old_connections()
+    try:
+        generate_variants(model, pk, name)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(model: Type[models.Model], pk: int, name: str) -> Future:
+    """Queue the generation of an image's derivatives, or generate them now
+    when ``IMAGE_WORKERS`` is 0"""
+    if not settings.IMAGE_WORKERS:
+        future: Future = Future()
+        generate_variants(model, pk, name)
+        future.set_result(None)
+        return future
+    future = image_pool().submit(generate_in_worker, model, pk, name)
+    _pending.add(future)
+    future.add_done_callback(_pending.discard)
+    return future
+
+
+def wait_for_variants(timeout: Optional[float] = None) -> None:
+    """Block until the queued derivatives have been generated"""
+    wait(list(_pending), timeout=timeout)
+
+
+def queue_variants(model: Type[models.Model], instance: Any) -> None:
+    """Regenerate the derivatives of the row's image once the transaction commits.
+
+    Needed after ``bulk_create`` and ``bulk_update``, which skip the signals.
+    """
+    name = instance.image.name if instance.image else ""
+    if not name:
+        if instance.image_variants:
+            model.objects.filter(pk=instance.pk, image="").update(image_variants={})
+            previous = instance.image_variants
+            transaction.on_commit(lambda: delete_variants(previous))
+            instance.image_variants = {}
+        return
+    pk = instance.pk
+    transaction.on_commit(lambda: schedule_variants(model, pk, name))
+
+
+def loaded_image(instance: Any) -> str:
+    value = instance.__dict__.get("image")
+    return getattr(value, "name", value) or ""
+
+
+@receiver(post_init, sender=Store)
+@receiver(post_init, sender=Dish)
+def remember_loaded_image(instance: Any, **kwargs: Any) -> None:
+    """Note the image a row was loaded with, to notice new uploads"""
+    instance.__dict__["_loaded_image"] = loaded_image(instance)
+
+
+@receiver(post_save, sender=Store)
+@receiver(post_save, sender=Dish)
+def image_saved(
+    sender: Type[models.Model], instance: Any, created: bool, **kwargs: Any
+) -> None:
+    """Generate the derivatives of a new image"""
+    if "image" not in instance.__dict__:
+        return
+    name = loaded_image(instance)
+    changed = created or name != instance.__dict__.get("_loaded_image")
+    instance.__dict__["_loaded_image"] = name
+    if changed:
+        queue_variants(sender, instance)
@@ -0,0 +1,44 @@
+from typing import Any
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...archive import archive_cutoff, archive_orders
+from ...models import Store
+
+
+class Command(BaseCommand):
+    help = (
+        "Move completed orders older than --days days to the archive table, "
+        "in batches of --batch-size orders."
+    )
+
+    def add_arguments(self: "Command", parser: Any) -> None:
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=None,
+            help=f"Age in days, {settings.ARCHIVE_AFTER_DAYS} by default",
+        )
+        parser.add_argument("--batch-size", type=int, default=0)
+        parser.add_argument(
+            "--max-batches", type=int, default=None, help="Stop after this many"
+        )
+        parser.add_argument("--store", type=int, help="Only this store")
+
+    def handle(self: "Command", *args: Any, **options: Any) -> None:
+        if options["days"] is not None and options["days"] < 0:
+            raise CommandError("Invalid number of days")
+        if options["batch_size"] < 0:
+            raise CommandError("Invalid batch size")
+        store = None
+        if options["store"] is not None:
+            store = Store.objects.filter(id=options["store"]).first()
+            if store is None:
+                raise CommandError("Store not found")
+        archived = archive_orders(
+            archive_cutoff(options["days"]),
+            options["batch_size"],
+            options["max_batches"],
+            store,
+        )
+        self.stdout.write(f"Archived {archived} orders")
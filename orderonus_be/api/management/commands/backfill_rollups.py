@@ -0,0 +1,37 @@
+from datetime import date
+from typing import Any
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Store
+from ...rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the daily sales rollups from the orders. Days are in each "
+        "store's timezone, the range defaults to every day with orders, "
+        "archived or not."
+    )
+
+    def add_arguments(self: "Command", parser: Any) -> None:
+        parser.add_argument("--store", type=int, help="Only this store")
+        parser.add_argument("--from", dest="start", help="First day, YYYY-MM-DD")
+        parser.add_argument("--to", dest="end", help="Last day, YYYY-MM-DD")
+
+    def handle(self: "Command", *args: Any, **options: Any) -> None:
+        try:
+            first_day = options["start"] and date.fromisoformat(options["start"])
+            last_day = options["end"] and date.fromisoformat(options["end"])
+        except ValueError:
+            raise CommandError("Invalid date")
+        if first_day and last_day and first_day > last_day:
+            raise CommandError("Invalid date range")
+
+        stores = Store.objects.order_by("id")
+        if options["store"] is not None:
+            stores = stores.filter(id=options["store"])
+            if not stores.exists():
+                raise CommandError("Store not found")
+        for store in stores:
+            rebuild_rollups(store, first_day or None, last_day or None)
+            self.stdout.write(f"Rebuilt rollups of store {store.id}")
@@ -0,0 +1,91 @@
+import json
+from typing import Any, Dict
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from ...benchmarks import (
+    async_urlconf,
+    benchmark_database,
+    check,
+    run_async,
+    run_threaded,
+    seed_store,
+    summarize,
+)
+from ...models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare throughput and latency of the sync read endpoints on the WSGI "
+        "path with their async versions on the ASGI path"
+    )
+
+    def add_arguments(self: "Command", parser: Any) -> None:
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=16)
+        parser.add_argument("--dishes", type=int, default=50)
+        parser.add_argument("--orders", type=int, default=100)
+        parser.add_argument("--output", help="Write the results as JSON to a file")
+
+    def handle(self: "Command", *args: Any, **options: Any) -> None:
+        with benchmark_database():
+            user = User.objects.create_user(username="bench", password="bench")
+            store = seed_store(
+                user,
+                "Benchmark Store",
+                dishes=options["dishes"],
+                modifiers=3,
+                orders=options["orders"],
+                lines=3,
+            )
+            order = Order.objects.filter(store=store).first()
+            endpoints = {
+                "stores": "/api/stores/",
+                "orders": f"/api/stores/{store.id}/orders/",
+                "order_by_id": f"/api/stores/{store.id}/orders/{order.id}/",
+                "get_dishes": f"/api/stores/{store.id}/dishes/",
+            }
+            results = {
+                name: self.compare(user, url, options)
+                for name, url in endpoints.items()
+            }
+
+        self.stdout.write(
+            f"{'endpoint':<14}{'mode':<7}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+        )
+        for name, modes in results.items():
+            for mode, summary in modes.items():
+                self.stdout.write(
+                    f"{name:<14}{mode:<7}{summary['throughput']:>10}"
+                    f"{summary['p50_ms']:>10}{summary['p99_ms']:>10}"
+                )
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+
+    def compare(
+        self: "Command", user: User, url: str, options: Dict[str, Any]
+    ) -> Dict[str, Dict[str, float]]:
+        """Benchmark one endpoint on both request paths"""
+        total, concurrency = options["requests"], options["concurrency"]
+
+        clients = []
+        for _ in range(concurrency):
+            clients.append(Client())
+            clients[-1].force_login(user)
+        wsgi = summarize(
+            *run_threaded(clients, lambda client: check(client.get(url)), total)
+        )
+
+        with override_settings(ROOT_URLCONF=async_urlconf()):
+            client = AsyncClient()
+            client.force_login(user)
+
+            async def request(client: AsyncClient) -> None:
+                check(await client.get(url))
+
+            asgi = summarize(*run_async(client, request, total, concurrency))
+        return {"wsgi": wsgi, "asgi": asgi}
@@ -0,0 +1,139 @@
+import json
+import platform
+from typing import Any, Dict
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from django.utils.timezone import now
+
+from ...benchmarks import (
+    SCALES,
+    benchmark_database,
+    compare_results,
+    endpoint_suite,
+    measure_endpoint,
+    route_labels,
+    seed_store,
+)
+from ...rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every route of api.urls and auth.urls at several data scales, "
+        "optionally comparing with a baseline from an earlier run"
+    )
+
+    def add_arguments(self: "Command", parser: Any) -> None:
+        parser.add_argument(
+            "--scales",
+            default="small,medium",
+            help=f"Comma separated, from {', '.join(SCALES)}",
+        )
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument("--routes", help="Comma separated subset of routes")
+        parser.add_argument("--output", help="Write the results as JSON to a file")
+        parser.add_argument("--baseline", help="Results JSON to compare against")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed relative growth of p95 latency before it is a regression",
+        )
+        parser.add_argument(
+            "--min-delta",
+            type=float,
+            default=5.0,
+            help="Milliseconds p95 latency must grow by to count as a regression",
+        )
+
+    def handle(self: "Command", *args: Any, **options: Any) -> None:
+        scales = options["scales"].split(",")
+        unknown = [scale for scale in scales if scale not in SCALES]
+        if unknown:
+            raise CommandError(f"Unknown scales: {', '.join(unknown)}")
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                baseline = json.load(file)
+
+        results: Dict[str, Any] = {
+            "meta": {
+                "date": now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "requests": options["requests"],
+            },
+            "scales": {},
+        }
+        for scale in scales:
+            self.stderr.write(f"Seeding {scale}: {SCALES[scale]}")
+            results["scales"][scale] = self.run_scale(SCALES[scale], options)
+
+        self.report(results)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+        if baseline is not None:
+            regressions = compare_results(
+                results, baseline, options["tolerance"], options["min_delta"]
+            )
+            for regression in regressions:
+                self.stderr.write(f"Regression: {regression}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} regressions")
+            self.stderr.write("No regressions against the baseline")
+
+    def run_scale(
+        self: "Command", scale: Dict[str, int], options: Dict[str, Any]
+    ) -> Dict[str, Dict[str, Any]]:
+        """Seed a fresh database and benchmark each route against it"""
+        password = "bench-password"
+        with benchmark_database():
+            user = User.objects.create_user(username="bench", password=password)
+            stores = [
+                seed_store(
+                    user,
+                    f"Benchmark Store {i}",
+                    dishes=scale["dishes"],
+                    modifiers=3,
+                    orders=scale["orders"],
+                    lines=3,
+                    days=scale["days"],
+                )
+                for i in range(scale["stores"])
+            ]
+            rebuild_rollups(stores[0])
+
+            suite = endpoint_suite(user, password, stores[0])
+            missing = set(route_labels()) - set(suite)
+            if missing:
+                raise CommandError(f"No benchmark for: {', '.join(sorted(missing))}")
+            if options["routes"]:
+                wanted = options["routes"].split(",")
+                suite = {name: suite[name] for name in wanted if name in suite}
+
+            client, async_client = Client(), AsyncClient()
+            client.force_login(user)
+            async_client.force_login(user)
+            return {
+                name: measure_endpoint(
+                    client, async_client, endpoint, options["requests"]
+                )
+                for name, endpoint in suite.items()
+            }
+
+    def report(self: "Command", results: Dict[str, Any]) -> None:
+        self.stdout.write(
+            f"{'scale':<8}{'route':<24}{'req/s':>10}{'p50 ms':>10}"
+            f"{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}"
+        )
+        for scale, routes in results["scales"].items():
+            for route, summary in routes.items():
+                queries = summary["queries_max"]
+                self.stdout.write(
+                    f"{scale:<8}{route:<24}{summary['throughput']:>10}"
+                    f"{summary['p50_ms']:>10}{summary['p95_ms']:>10}"
+                    f"{summary['p99_ms']:>10}{'-' if queries is None else queries:>9}"
+                )
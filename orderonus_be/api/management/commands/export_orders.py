@@ -0,0 +1,38 @@
+from typing import Any
+from django.core.management.base import BaseCommand, CommandError
+
+from ...dates import parse_range
+from ...export import CONTENT_TYPES, stream_export
+from ...models import Store
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream the orders of a store with their lines and modifiers as NDJSON "
+        "or CSV. Dates are in the store's timezone, the range defaults to today."
+    )
+
+    def add_arguments(self: "Command", parser: Any) -> None:
+        parser.add_argument("store_id", type=int)
+        parser.add_argument("--from", dest="start", help="First date or datetime")
+        parser.add_argument("--to", dest="end", help="Last date, or end datetime")
+        parser.add_argument("--format", choices=CONTENT_TYPES, default="ndjson")
+        parser.add_argument("--output", help="File to write to instead of stdout")
+
+    def handle(self: "Command", *args: Any, **options: Any) -> None:
+        try:
+            store = Store.objects.get(id=options["store_id"])
+        except Store.DoesNotExist:
+            raise CommandError("Store not found")
+        try:
+            start, end = parse_range(store, options["start"], options["end"])
+        except ValueError:
+            raise CommandError("Invalid date range")
+
+        chunks = stream_export(store, start, end, options["format"])
+        if not options["output"]:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            return
+        with open(options["output"], "w", newline="") as output:
+            output.writelines(chunks)
@@ -0,0 +1,11 @@
+from typing import Any
+from django.core.management.base import BaseCommand
+
+from ...idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete the idempotency keys of orders that have expired."
+
+    def handle(self: "Command", *args: Any, **options: Any) -> None:
+        self.stdout.write(f"Deleted {purge_expired()} expired idempotency keys")
@@ -0,0 +1,101 @@
+import time
+from datetime import date
+from typing import Any
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Store
+from ...seeding import ScalePlan, seed_scale
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with users, stores, menus and orders for load "
+        "testing. The same seed and --until always generate the same data."
+    )
+
+    def add_arguments(self: "Command", parser: Any) -> None:
+        defaults = ScalePlan()
+        parser.add_argument("--users", type=int, default=defaults.users)
+        parser.add_argument("--stores", type=int, default=defaults.stores)
+        parser.add_argument(
+            "--dishes", type=int, default=defaults.dishes, help="Dishes per store"
+        )
+        parser.add_argument(
+            "--modifiers",
+            type=int,
+            default=defaults.modifiers,
+            help="Modifiers per dish",
+        )
+        parser.add_argument(
+            "--days", type=int, default=defaults.days, help="Days of orders"
+        )
+        parser.add_argument(
+            "--orders-per-day",
+            type=int,
+            default=defaults.orders_per_day,
+            help="Average orders per store per day",
+        )
+        parser.add_argument(
+            "--lines", type=int, default=defaults.lines, help="Most lines per order"
+        )
+        parser.add_argument("--seed", type=int, default=defaults.seed)
+        parser.add_argument(
+            "--until", help="Last day with orders, YYYY-MM-DD, yesterday by default"
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=defaults.batch_size,
+            help="Orders inserted at a time",
+        )
+        parser.add_argument(
+            "--prefix", default="seed", help="Usernames are <prefix>-<n>"
+        )
+        parser.add_argument("--password", default="password")
+
+    def handle(self: "Command", *args: Any, **options: Any) -> None:
+        try:
+            until = options["until"] and date.fromisoformat(options["until"])
+        except ValueError:
+            raise CommandError("Invalid date")
+        counts = [
+            "users",
+            "stores",
+            "dishes",
+            "days",
+            "orders_per_day",
+            "lines",
+            "batch_size",
+        ]
+        if any(options[name] < 1 for name in counts) or options["modifiers"] < 0:
+            raise CommandError("Counts must be positive")
+        if User.objects.filter(username__startswith=f"{options['prefix']}-").exists():
+            raise CommandError(f"Users named {options['prefix']}-<n> already exist")
+
+        plan = ScalePlan(
+            users=options["users"],
+            stores=options["stores"],
+            dishes=options["dishes"],
+            modifiers=options["modifiers"],
+            days=options["days"],
+            orders_per_day=options["orders_per_day"],
+            lines=options["lines"],
+            seed=options["seed"],
+            until=until or None,
+            batch_size=options["batch_size"],
+        )
+        start = time.perf_counter()
+
+        def progress(store: Store, orders: int, lines: int) -> None:
+            self.stdout.write(
+                f"Store {store.id}: {orders} orders, {lines} lines "
+                f"({time.perf_counter() - start:.0f}s)"
+            )
+
+        totals = seed_scale(plan, options["prefix"], options["password"], progress)
+        self.stdout.write(
+            f"Created {totals['users']} users, {totals['stores']} stores, "
+            f"{totals['orders']} orders and {totals['lines']} lines in "
+            f"{time.perf_counter() - start:.1f}s"
+        )
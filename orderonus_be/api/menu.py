@@ -0,0 +1,325 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Set
+from django.db import transaction
+from django.db.models import Q, QuerySet
+
+from .images import queue_variants
+from .models import Dish, DishModifier, Store
+
+DISH_FIELDS = {
+    "name": (str, 100),
+    "price": (int, None),
+    "description": (str, 1000),
+    "image": (str, None),
+    "is_available": (bool, None),
+}
+MODIFIER_FIELDS = {
+    "name": (str, 100),
+    "price": (int, None),
+    "is_available": (bool, None),
+}
+OPERATIONS = [
+    "create_dish",
+    "update_dish",
+    "delete_dish",
+    "create_modifier",
+    "update_modifier",
+    "delete_modifier",
+]
+
+
+class MenuError(Exception):
+    """Raised when an operation of a bulk menu change is invalid"""
+
+
+def is_id(value: Any) -> bool:
+    """Check that a client supplied id is an integer, booleans excluded"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+@dataclass
+class MenuChanges:
+    """The validated operations of a bulk menu change, grouped for bulk writes"""
+
+    results: List[Dict[str, Any]] = field(default_factory=list)
+    new_dishes: List[Dish] = field(default_factory=list)
+    # Index of the new dish each nested modifier belongs to
+    new_dish_modifiers: List[Any] = field(default_factory=list)
+    new_modifiers: List[DishModifier] = field(default_factory=list)
+    updated_dishes: Dict[int, Dish] = field(default_factory=dict)
+    dish_fields: Set[str] = field(default_factory=set)
+    updated_modifiers: Dict[int, DishModifier] = field(default_factory=dict)
+    modifier_fields: Set[str] = field(default_factory=set)
+    deleted_dishes: Set[int] = field(default_factory=set)
+    deleted_modifiers: Set[int] = field(default_factory=set)
+    # Dishes given a new image, whose derivatives must be generated
+    new_images: List[Dish] = field(default_factory=list)
+
+    @property
+    def failed(self: "MenuChanges") -> bool:
+        return any(result["status"] == "error" for result in self.results)
+
+
+def clean_fields(
+    item: Dict[str, Any], fields: Dict[str, Any], required: List[str]
+) -> Dict[str, Any]:
+    """The known fields of an operation, checked against their types"""
+    values = {}
+    for name, (kind, max_length) in fields.items():
+        if name not in item or item[name] is None:
+            if name in required:
+                raise MenuError(f"Missing parameter: {name}")
+            continue
+        value = item[name]
+        # Booleans are ints in Python but not valid prices
+        if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+            raise MenuError(f"Invalid parameter: {name}")
+        if kind is int and value < 0:
+            raise MenuError(f"Invalid parameter: {name}")
+        if max_length is not None and len(value) > max_length:
+            raise MenuError(f"Invalid parameter: {name}")
+        values[name] = value
+    if values.get("name") == "":
+        raise MenuError("Invalid parameter: name")
+    return values
+
+
+def plan_changes(store: Store, operations: List[Dict[str, Any]]) -> MenuChanges:
+    """Validate the operations together against the store's menu.
+
+    The menu is read with one query per table whatever the number of
+    operations. Dish names must stay unique within the store once every
+    operation has been applied.
+    """
+    changes = MenuChanges()
+    names = dict(Dish.objects.filter(store=store).values_list("id", "name"))
+    dish_ids = {
+        item.get("id")
+        for item in operations
+        if isinstance(item, dict)
+        and item.get("op") == "update_dish"
+        and is_id(item.get("id"))
+    }
+    dishes = Dish.objects.filter(store=store, id__in=dish_ids).in_bulk()
+    modifier_ids = {
+        item.get("id")
+        for item in operations
+        if isinstance(item, dict)
+        and item.get("op") in ["update_modifier", "delete_modifier"]
+        and is_id(item.get("id"))
+    }
+    modifiers = DishModifier.objects.filter(
+        dish__store=store, id__in=modifier_ids
+    ).in_bulk()
+
+    touched: Set[Any] = set()
+    new_names: List[str] = []
+    for index, item in enumerate(operations):
+        try:
+            if not isinstance(item, dict) or item.get("op") not in OPERATIONS:
+                raise MenuError("Invalid operation")
+            op = item["op"]
+            target = item.get("id")
+            if op in [
+                "update_dish",
+                "delete_dish",
+                "update_modifier",
+                "delete_modifier",
+            ]:
+                if not is_id(target):
+                    raise MenuError("Invalid parameter: id")
+                key = (op.split("_")[1], target)
+                if key in touched:
+                    raise MenuError("Conflicting operations")
+                touched.add(key)
+            result = plan_operation(
+                store, changes, op, item, names, dishes, modifiers, new_names
+            )
+        except MenuError as error:
+            result = {"status": "error", "error": str(error)}
+        changes.results.append({"index": index, **result})
+
+    # Modifiers cannot be changed on a dish deleted by the same request
+    for result, item in zip(changes.results, operations):
+        if result["status"] == "error":
+            continue
+        if item["op"] == "create_modifier":
+            dish_id = item["dish_id"]
+        elif item["op"] in ["update_modifier", "delete_modifier"]:
+            dish_id = modifiers[item["id"]].dish_id
+        else:
+            continue
+        if dish_id in changes.deleted_dishes:
+            result.pop("object", None)
+            result.update(status="error", error="Conflicting operations")
+
+    final = list(names.values()) + new_names
+    if len(final) != len(set(final)):
+        seen: Set[str] = set()
+        duplicates = {name for name in final if name in seen or seen.add(name)}
+        for result, item in zip(changes.results, operations):
+            name = item.get("name")
+            if (
+                result["status"] != "error"
+                and isinstance(name, str)
+                and name in duplicates
+            ):
+                result.pop("object", None)
+                result.update(
+                    status="error",
+                    error="Dish already exists, please use a different name",
+                )
+
+    if changes.failed:
+        for result in changes.results:
+            result.pop("object", None)
+    return changes
+
+
+def plan_operation(
+    store: Store,
+    changes: MenuChanges,
+    op: str,
+    item: Dict[str, Any],
+    names: Dict[int, str],
+    dishes: Dict[int, Dish],
+    modifiers: Dict[int, DishModifier],
+    new_names: List[str],
+) -> Dict[str, Any]:
+    """Add one operation to the changes and describe its outcome"""
+    if op == "create_dish":
+        values = clean_fields(item, DISH_FIELDS, ["name", "price"])
+        nested = item.get("modifiers", [])
+        if not isinstance(nested, list):
+            raise MenuError("Invalid parameter: modifiers")
+        nested_values = [
+            (
+                clean_fields(modifier, MODIFIER_FIELDS, ["name", "price"])
+                if isinstance(modifier, dict)
+                else {}
+            )
+            for modifier in nested
+        ]
+        if not all(nested_values):
+            raise MenuError("Invalid parameter: modifiers")
+        dish = Dish(store=store, **{"description": "", **values})
+        changes.new_dishes.append(dish)
+        if values.get("image"):
+            changes.new_images.append(dish)
+        for modifier in nested_values:
+            changes.new_dish_modifiers.append(
+                (len(changes.new_dishes) - 1, DishModifier(**modifier))
+            )
+        new_names.append(values["name"])
+        return {"status": "created", "object": dish}
+
+    if op == "create_modifier":
+        values = clean_fields(item, MODIFIER_FIELDS, ["name", "price"])
+        if not is_id(item.get("dish_id")):
+            raise MenuError("Invalid parameter: dish_id")
+        if item["dish_id"] not in names:
+            raise MenuError("Dish not found")
+        modifier = DishModifier(dish_id=item["dish_id"], **values)
+        changes.new_modifiers.append(modifier)
+        return {"status": "created", "object": modifier}
+
+    if op == "update_dish":
+        dish = dishes.get(item.get("id"))
+        if dish is None:
+            raise MenuError("Dish not found")
+        values = clean_fields(item, DISH_FIELDS, [])
+        for name, value in values.items():
+            setattr(dish, name, value)
+        if "name" in values:
+            names[dish.id] = values["name"]
+        changes.updated_dishes[dish.id] = dish
+        changes.dish_fields.update(values)
+        if "image" in values:
+            changes.new_images.append(dish)
+        return {"status": "updated", "id": dish.id}
+
+    if op == "delete_dish":
+        if item.get("id") not in names:
+            raise MenuError("Dish not found")
+        del names[item["id"]]
+        changes.deleted_dishes.add(item["id"])
+        return {"status": "deleted", "id": item["id"]}
+
+    modifier = modifiers.get(item.get("id"))
+    if modifier is None:
+        raise MenuError("Modifier not found")
+    if op == "update_modifier":
+        values = clean_fields(item, MODIFIER_FIELDS, [])
+        for name, value in values.items():
+            setattr(modifier, name, value)
+        changes.updated_modifiers[modifier.id] = modifier
+        changes.modifier_fields.update(values)
+        return {"status": "updated", "id": modifier.id}
+    changes.deleted_modifiers.add(modifier.id)
+    return {"status": "deleted", "id": modifier.id}
+
+
+def apply_changes(changes: MenuChanges) -> None:
+    """Write the validated changes with bulk queries in one transaction"""
+    with transaction.atomic():
+        if changes.deleted_modifiers:
+            DishModifier.objects.filter(id__in=changes.deleted_modifiers).delete()
+        if changes.deleted_dishes:
+            Dish.objects.filter(id__in=changes.deleted_dishes).delete()
+
+        if changes.updated_dishes and changes.dish_fields:
+            Dish.objects.bulk_update(
+                list(changes.updated_dishes.values()), list(changes.dish_fields)
+            )
+        if changes.updated_modifiers and changes.modifier_fields:
+            DishModifier.objects.bulk_update(
+                list(changes.updated_modifiers.values()), list(changes.modifier_fields)
+            )
+
+        created = Dish.objects.bulk_create(changes.new_dishes)
+        for index, modifier in changes.new_dish_modifiers:
+            modifier.dish = created[index]
+        DishModifier.objects.bulk_create(
+            [modifier for _, modifier in changes.new_dish_modifiers]
+            + changes.new_modifiers
+        )
+        # bulk_create and bulk_update do not send the signals that do this
+        for dish in changes.new_images:
+            queue_variants(Dish, dish)
+
+    for result in changes.results:
+        created_object = result.pop("object", None)
+        if created_object is not None:
+            result["id"] = created_object.id
+
+
+def availability_filter(selector: Any) -> Q:
+    """The rows picked by ``{"ids": [...], "match": "..."}``, either may be omitted"""
+    if not isinstance(selector, dict):
+        raise MenuError("Invalid parameter")
+    ids = selector.get("ids", [])
+    match = selector.get("match", "")
+    if not isinstance(ids, list) or not all(map(is_id, ids)):
+        raise MenuError("Invalid parameter: ids")
+    if not isinstance(match, str):
+        raise MenuError("Invalid parameter: match")
+    condition = Q(id__in=ids) if ids else Q(pk__in=[])
+    if match:
+        condition |= Q(name__icontains=match)
+    return condition
+
+
+def set_availability(queryset: QuerySet, condition: Q, is_available: bool) -> List[int]:
+    """Flip the rows that are not already in the wanted state and return their ids.
+
+    Only the ids are read, then a single UPDATE restricted to the rows still
+    in the other state writes the one column.
+    """
+    with transaction.atomic():
+        rows = queryset.filter(condition, is_available=not is_available)
+        ids = list(rows.order_by("id").values_list("id", flat=True))
+        if ids:
+            queryset.filter(id__in=ids, is_available=not is_available).update(
+                is_available=is_available
+            )
+    return ids
@@ -0,0 +1,111 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Dish",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=100)),
+                ("price", models.BigIntegerField()),
+                ("description", models.CharField(max_length=1000)),
+                ("image", models.ImageField(blank=True, upload_to="dishes")),
+                ("is_available", models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="Order",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("created_at", models.DateTimeField()),
+                ("is_online", models.BooleanField()),
+                ("is_completed", models.BooleanField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name="DishModifier",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=100)),
+                ("price", models.BigIntegerField()),
+                ("is_available", models.BooleanField(default=True)),
+                (
+                    "dish",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="api.dish"
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="OrderDishRelation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("quantity", models.PositiveBigIntegerField()),
+                ("other_comments", models.CharField(max_length=1000)),
+                (
+                    "dish",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="api.dish"
+                    ),
+                ),
+                ("modifiers", models.ManyToManyField(to="api.dishmodifier")),
+                (
+                    "order",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="api.order"
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="Store",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                ("name", models.CharField(max_length=100)),
+                ("description", models.CharField(max_length=1000)),
+                ("image", models.ImageField(blank=True, upload_to="stores")),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="store",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="api.store"
+            ),
+        ),
+        migrations.AddField(
+            model_name="dish",
+            name="store",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="api.store"
+            ),
+        ),
+    ]
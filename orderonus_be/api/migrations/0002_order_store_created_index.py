@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="store",
+            name="timezone",
+            field=models.CharField(default=settings.TIME_ZONE, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["store", "created_at"], name="order_store_created_idx"
+            ),
+        ),
+    ]
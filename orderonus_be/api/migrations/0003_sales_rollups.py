@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0002_order_store_created_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyDishSales",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("order_count", models.PositiveBigIntegerField(default=0)),
+                ("quantity", models.PositiveBigIntegerField(default=0)),
+                ("revenue", models.BigIntegerField(default=0)),
+                (
+                    "dish",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="api.dish"
+                    ),
+                ),
+                (
+                    "store",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="api.store"
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("store", "day", "dish"),
+                        name="daily_dish_sales_store_day_dish_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="DailySales",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("order_count", models.PositiveBigIntegerField(default=0)),
+                ("completed_count", models.PositiveBigIntegerField(default=0)),
+                ("revenue", models.BigIntegerField(default=0)),
+                (
+                    "store",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="api.store"
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("store", "day"), name="daily_sales_store_day_unique"
+                    )
+                ],
+            },
+        ),
+    ]
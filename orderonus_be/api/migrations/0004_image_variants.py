@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_sales_rollups"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="dish",
+            name="image_variants",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="store",
+            name="image_variants",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
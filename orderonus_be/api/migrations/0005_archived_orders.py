@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_image_variants"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedOrder",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("created_at", models.DateTimeField()),
+                ("is_online", models.BooleanField()),
+                ("is_completed", models.BooleanField()),
+                ("archived_at", models.DateTimeField()),
+                ("lines", models.JSONField(default=list)),
+                (
+                    "store",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="api.store"
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["store", "created_at"],
+                        name="archived_store_created_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_at(apps, schema_editor):
+    """Existing orders were last changed, as far as we know, when created"""
+    Order = apps.get_model("api", "Order")
+    Order.objects.update(updated_at=F("created_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_archived_orders"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeSequence",
+            fields=[
+                (
+                    "store",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="api.store",
+                    ),
+                ),
+                ("value", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="change_seq",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="updated_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["store", "change_seq"], name="order_store_change_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_idempotency_records"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedorder",
+            name="change_seq",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="archivedorder",
+            index=models.Index(
+                fields=["store", "change_seq"], name="archived_store_change_idx"
+            ),
+        ),
+    ]
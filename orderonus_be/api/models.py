@@ -1,6 +1,19 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
 from django.db import models
 from django.contrib.auth.models import User
-from typing import Dict, Any
+from django.utils import timezone
+from typing import Dict, Any, List
+
+
+def variant_urls(variants: Dict[str, Dict[str, str]]) -> Dict[str, Dict[str, str]]:
+    """The URLs of the image derivatives named in ``image_variants``"""
+    return {
+        variant: {
+            extension: default_storage.url(name) for extension, name in files.items()
+        }
+        for variant, files in variants.items()
+    }
 
 
 class Store(models.Model):
@@ -8,7 +21,9 @@ class Store(models.Model):
     name = models.CharField(max_length=100)
     description = models.CharField(max_length=1000)
     image = models.ImageField(upload_to="stores", blank=True)
+    image_variants = models.JSONField(default=dict, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    timezone = models.CharField(max_length=64, default=settings.TIME_ZONE)
 
     def to_dict(self: "Store") -> Dict[str, Any]:
         """Serialize the store to a dictionary"""
@@ -17,6 +32,7 @@ class Store(models.Model):
             "name": self.name,
             "description": self.description,
             "image": self.image.url if self.image else None,
+            "image_variants": variant_urls(self.image_variants),
         }
 
     def __str__(self: "Store") -> str:
@@ -31,6 +47,7 @@ class Dish(models.Model):
     price = models.BigIntegerField()
     description = models.CharField(max_length=1000)
     image = models.ImageField(upload_to="dishes", blank=True)
+    image_variants = models.JSONField(default=dict, blank=True)
     is_available = models.BooleanField(default=True)
 
     def to_dict(self: "Dish") -> Dict[str, Any]:
@@ -41,13 +58,18 @@ class Dish(models.Model):
             "price": self.price,
             "description": self.description,
             "image": self.image.url if self.image else None,
+            "image_variants": variant_urls(self.image_variants),
             "is_available": self.is_available,
-            "modifiers": [
-                modifier.to_dict()
-                for modifier in DishModifier.objects.filter(dish=self).all()
-            ],
+            "modifiers": [modifier.to_dict() for modifier in self.get_modifiers()],
         }
 
+    def get_modifiers(self: "Dish") -> List["DishModifier"]:
+        """The modifiers of the dish, using the prefetched list when available"""
+        prefetched = getattr(self, "prefetched_modifiers", None)
+        if prefetched is not None:
+            return prefetched
+        return list(DishModifier.objects.filter(dish=self).all())
+
     def __str__(self: "Dish") -> str:
         return f"Dish: {self.name} ({self.store})"
 
@@ -78,6 +100,17 @@ class Order(models.Model):
     store = models.ForeignKey(Store, on_delete=models.CASCADE)
     is_online = models.BooleanField()
     is_completed = models.BooleanField()
+    updated_at = models.DateTimeField(default=timezone.now)
+    # Position of the order's last change in the store's change sequence
+    change_seq = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["store", "created_at"], name="order_store_created_idx"
+            ),
+            models.Index(fields=["store", "change_seq"], name="order_store_change_idx"),
+        ]
 
     def to_dict(self: "Order") -> Dict[str, Any]:
         """Serialize the order to a dictionary"""
@@ -86,14 +119,17 @@ class Order(models.Model):
             "created_at": self.created_at.astimezone().isoformat(),
             "is_online": self.is_online,
             "is_completed": self.is_completed,
-            "dishes": list(
-                map(
-                    lambda x: x.to_dict(),
-                    OrderDishRelation.objects.filter(order=self).all(),
-                )
-            ),
+            "updated_at": self.updated_at.astimezone().isoformat(),
+            "dishes": list(map(lambda x: x.to_dict(), self.get_lines())),
         }
 
+    def get_lines(self: "Order") -> List["OrderDishRelation"]:
+        """The lines of the order, using the prefetched list when available"""
+        prefetched = getattr(self, "prefetched_lines", None)
+        if prefetched is not None:
+            return prefetched
+        return list(OrderDishRelation.objects.filter(order=self).all())
+
     def __str__(self: "Order") -> str:
         return f"Order: {self.id} ({self.store})"
 
@@ -110,8 +146,146 @@ class OrderDishRelation(models.Model):
         return {
             "dish": self.dish.to_dict(),
             "quantity": self.quantity,
-            "dish_modifiers": list(map(lambda x: x.to_dict(), self.modifiers.all())),
+            "dish_modifiers": list(map(lambda x: x.to_dict(), self.get_modifiers())),
         }
 
+    def get_modifiers(self: "OrderDishRelation") -> List[DishModifier]:
+        """The chosen modifiers, using the prefetched list when available"""
+        prefetched = getattr(self, "prefetched_modifiers", None)
+        if prefetched is not None:
+            return prefetched
+        return list(self.modifiers.all())
+
     def __str__(self: "OrderDishRelation") -> str:
         return f"OrderDishRelation: {self.dish} ({self.order})"
+
+
+class ChangeSequence(models.Model):
+    """The last change sequence number handed out for a store's orders"""
+
+    store = models.OneToOneField(Store, on_delete=models.CASCADE, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self: "ChangeSequence") -> str:
+        return f"ChangeSequence: {self.value} ({self.store})"
+
+
+class IdempotencyRecord(models.Model):
+    """The response to an order request made with an idempotency key.
+
+    Retries with the same key get the stored response back instead of
+    creating the order again. Records expire after ``IDEMPOTENCY_KEY_TTL``
+    seconds.
+    """
+
+    store = models.ForeignKey(Store, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # Digest of the request body, to refuse a key reused for another request
+    fingerprint = models.CharField(max_length=64)
+    order_id = models.IntegerField(null=True)
+    status = models.PositiveSmallIntegerField()
+    response = models.JSONField()
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["store", "key"], name="idempotency_store_key_unique"
+            )
+        ]
+
+    def __str__(self: "IdempotencyRecord") -> str:
+        return f"IdempotencyRecord: {self.key} ({self.store})"
+
+
+class DailySales(models.Model):
+    """Orders and revenue of a store on a day in the store's timezone"""
+
+    store = models.ForeignKey(Store, on_delete=models.CASCADE)
+    day = models.DateField()
+    order_count = models.PositiveBigIntegerField(default=0)
+    completed_count = models.PositiveBigIntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["store", "day"], name="daily_sales_store_day_unique"
+            )
+        ]
+
+    def to_dict(self: "DailySales") -> Dict[str, Any]:
+        """Serialize the day to a dictionary"""
+        return {
+            "day": self.day.isoformat(),
+            "orders": self.order_count,
+            "completed": self.completed_count,
+            "revenue": self.revenue,
+        }
+
+    def __str__(self: "DailySales") -> str:
+        return f"DailySales: {self.day} ({self.store})"
+
+
+class DailyDishSales(models.Model):
+    """Quantity and revenue of a dish on a day in the store's timezone"""
+
+    store = models.ForeignKey(Store, on_delete=models.CASCADE)
+    day = models.DateField()
+    dish = models.ForeignKey(Dish, on_delete=models.CASCADE)
+    order_count = models.PositiveBigIntegerField(default=0)
+    quantity = models.PositiveBigIntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["store", "day", "dish"],
+                name="daily_dish_sales_store_day_dish_unique",
+            )
+        ]
+
+    def __str__(self: "DailyDishSales") -> str:
+        return f"DailyDishSales: {self.dish} on {self.day}"
+
+
+class ArchivedOrder(models.Model):
+    """A completed order moved out of ``Order`` by ``archive_orders``.
+
+    The order keeps its id. Its lines and chosen modifiers are stored in
+    ``lines`` as they are exported, with the names and prices they had when
+    the order was archived.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    store = models.ForeignKey(Store, on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+    is_online = models.BooleanField()
+    is_completed = models.BooleanField()
+    archived_at = models.DateTimeField()
+    lines = models.JSONField(default=list)
+    # Position of the removal from ``Order`` in the store's change sequence
+    change_seq = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["store", "created_at"], name="archived_store_created_idx"
+            ),
+            models.Index(
+                fields=["store", "change_seq"], name="archived_store_change_idx"
+            ),
+        ]
+
+    def to_record(self: "ArchivedOrder") -> Dict[str, Any]:
+        """The order as ``export_record`` serializes orders"""
+        return {
+            "id": self.id,
+            "created_at": self.created_at.isoformat(),
+            "is_online": self.is_online,
+            "is_completed": self.is_completed,
+            "lines": self.lines,
+        }
+
+    def __str__(self: "ArchivedOrder") -> str:
+        return f"ArchivedOrder: {self.id} ({self.store})"
@@ -0,0 +1,130 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from django.db import transaction
+from django.utils.timezone import now
+
+from .changes import allocate_changes
+from .models import Dish, DishModifier, Order, OrderDishRelation, Store
+from .rollups import Sale, SaleLine, record_orders
+
+
+class CartError(Exception):
+    """Raised when an order cannot be accepted as submitted"""
+
+    def __init__(self: "CartError", message: str, status: int) -> None:
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+@dataclass
+class CartLine:
+    """A validated line of an order, ready to be written"""
+
+    dish: Dish
+    quantity: int
+    other_comments: str
+    modifiers: List[DishModifier] = field(default_factory=list)
+
+
+def load_menu(
+    store: Store, dishes: List[Dict[str, Any]]
+) -> Tuple[Dict[int, Dish], Dict[int, DishModifier]]:
+    """The store's dishes and modifiers named by cart entries, one query per table"""
+    dish_ids = {item.get("id") for item in dishes if item.get("id") is not None}
+    modifier_ids = {
+        modifier_id for item in dishes for modifier_id in item.get("modifier", [])
+    }
+    dish_map = Dish.objects.filter(store=store, id__in=dish_ids).in_bulk()
+    modifier_map = (
+        DishModifier.objects.filter(
+            dish__in=dish_map.keys(), id__in=modifier_ids
+        ).in_bulk()
+        if modifier_ids
+        else {}
+    )
+    return dish_map, modifier_map
+
+
+def resolve_cart(store: Store, dishes: List[Dict[str, Any]]) -> List[CartLine]:
+    """Validate a cart against the store's menu using one query per table"""
+    dish_map, modifier_map = load_menu(store, dishes)
+    return [build_line(item, dish_map, modifier_map) for item in dishes]
+
+
+def build_line(
+    item: Dict[str, Any],
+    dish_map: Dict[int, Dish],
+    modifier_map: Dict[int, DishModifier],
+) -> CartLine:
+    """Validate one cart entry against already loaded dishes and modifiers"""
+    dish = dish_map.get(item.get("id"))
+    if dish is None:
+        raise CartError("Dish not found", 404)
+
+    modifiers: List[DishModifier] = []
+    for modifier_id in dict.fromkeys(item.get("modifier", [])):
+        modifier = modifier_map.get(modifier_id)
+        if modifier is None or modifier.dish_id != dish.id:
+            raise CartError("Modifier not found", 404)
+        modifiers.append(modifier)
+
+    quantity = item.get("quantity", None)
+    if quantity is None:
+        raise CartError("Missing parameter", 400)
+    return CartLine(
+        dish=dish,
+        quantity=quantity,
+        other_comments=item.get("other_comments", ""),
+        modifiers=modifiers,
+    )
+
+
+def create_order(
+    store: Store,
+    lines: List[CartLine],
+    is_online: bool,
+    is_completed: bool,
+    created_at: Optional[datetime] = None,
+) -> Order:
+    """Write the order, its lines, their modifiers and its rollups in one transaction"""
+    through = OrderDishRelation.modifiers.through
+    with transaction.atomic():
+        order = Order.objects.create(
+            is_online=is_online,
+            is_completed=is_completed,
+            store=store,
+            created_at=created_at or now(),
+            updated_at=now(),
+            change_seq=allocate_changes(store.id),
+        )
+        relations = OrderDishRelation.objects.bulk_create(
+            [
+                OrderDishRelation(
+                    order=order,
+                    dish=line.dish,
+                    quantity=line.quantity,
+                    other_comments=line.other_comments,
+                )
+                for line in lines
+            ]
+        )
+        through.objects.bulk_create(
+            [
+                through(orderdishrelation_id=relation.id, dishmodifier_id=modifier.id)
+                for relation, line in zip(relations, lines)
+                for modifier in line.modifiers
+            ]
+        )
+        record_orders(
+            store,
+            [
+                Sale(
+                    created_at=order.created_at,
+                    is_completed=order.is_completed,
+                    lines=[SaleLine.from_cart(line) for line in lines],
+                )
+            ],
+        )
+    return order
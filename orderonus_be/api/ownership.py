@@ -0,0 +1,168 @@
+"""Cache of which user owns which store.
+
+Every store-scoped endpoint checks that the logged in user owns the store.
+Positive answers are kept per ``(user_id, store_id)`` in a per-process LRU
+with a TTL, or in a shared Django cache when ``STORE_CACHE_ALIAS`` is set so
+that invalidation reaches every worker. Entries are dropped when a store is
+saved or deleted; bulk ``QuerySet.update()`` calls bypass the signals and
+are only caught up with by the TTL.
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Tuple
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .cache import CacheStats
+from .models import Store
+
+ownership_stats = CacheStats("store_ownership")
+
+
+class LocalOwnershipCache:
+    """A thread safe LRU of stores by owner, with entries expiring after a TTL"""
+
+    def __init__(self: "LocalOwnershipCache", size: int, ttl: float) -> None:
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Tuple[int, int], Tuple[float, Store]]" = (
+            OrderedDict()
+        )
+
+    def get(
+        self: "LocalOwnershipCache", user_id: int, store_id: int
+    ) -> Optional[Store]:
+        key = (user_id, store_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        # Handlers get their own copy so they cannot change the cached one
+        return copy.copy(entry[1])
+
+    def set(self: "LocalOwnershipCache", store: Store) -> None:
+        key = (store.user_id, store.id)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, copy.copy(store))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self: "LocalOwnershipCache", user_id: int, store_id: int) -> None:
+        with self.lock:
+            self.entries.pop((user_id, store_id), None)
+
+    def clear(self: "LocalOwnershipCache") -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+class SharedOwnershipCache:
+    """Stores by owner kept in a Django cache shared between processes"""
+
+    def __init__(self: "SharedOwnershipCache", alias: str, ttl: float) -> None:
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    @staticmethod
+    def key(user_id: int, store_id: int) -> str:
+        return f"api:store-owner:{user_id}:{store_id}"
+
+    def get(
+        self: "SharedOwnershipCache", user_id: int, store_id: int
+    ) -> Optional[Store]:
+        return self.cache.get(self.key(user_id, store_id))
+
+    def set(self: "SharedOwnershipCache", store: Store) -> None:
+        self.cache.set(self.key(store.user_id, store.id), store, self.ttl)
+
+    def delete(self: "SharedOwnershipCache", user_id: int, store_id: int) -> None:
+        self.cache.delete(self.key(user_id, store_id))
+
+    def clear(self: "SharedOwnershipCache") -> None:
+        # Shared entries expire on their own, clearing them is the cache's job
+        pass
+
+
+_backend: Any = None
+_backend_lock = threading.Lock()
+
+
+def ownership_cache() -> Any:
+    """The ownership cache configured in the settings"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if settings.STORE_CACHE_ALIAS:
+                    _backend = SharedOwnershipCache(
+                        settings.STORE_CACHE_ALIAS, settings.STORE_CACHE_TTL
+                    )
+                else:
+                    _backend = LocalOwnershipCache(
+                        settings.STORE_CACHE_SIZE, settings.STORE_CACHE_TTL
+                    )
+    return _backend
+
+
+def reset_ownership_cache() -> None:
+    """Drop the cached entries and re-read the settings on next use"""
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            _backend.clear()
+        _backend = None
+
+
+def cached_owned_store(user_id: Optional[int], store_id: int) -> Optional[Store]:
+    """The cached store if the user is known to own it"""
+    if user_id is None:
+        return None
+    store = ownership_cache().get(user_id, store_id)
+    ownership_stats.record(store is not None)
+    return store
+
+
+def remember_owned_store(store: Store) -> None:
+    """Cache that the store's user owns it"""
+    ownership_cache().set(store)
+
+
+def forget_store(store_id: int, user_ids: Iterable[Optional[int]]) -> None:
+    """Drop the cached ownership of the store by each of the users"""
+    for user_id in set(user_ids):
+        if user_id is not None:
+            ownership_cache().delete(user_id, store_id)
+
+
+@receiver(post_init, sender=Store)
+def remember_loaded_owner(instance: Store, **kwargs: Any) -> None:
+    """Note the owner a store was loaded with, to catch re-assignments"""
+    instance.__dict__["_loaded_user_id"] = instance.__dict__.get("user_id")
+
+
+@receiver(post_save, sender=Store)
+def store_saved(instance: Store, **kwargs: Any) -> None:
+    """Forget the store for its previous and current owners"""
+    forget_store(
+        instance.id, [instance.__dict__.get("_loaded_user_id"), instance.user_id]
+    )
+    instance.__dict__["_loaded_user_id"] = instance.user_id
+
+
+@receiver(post_delete, sender=Store)
+def store_deleted(instance: Store, **kwargs: Any) -> None:
+    """Forget a deleted store"""
+    forget_store(
+        instance.id, [instance.__dict__.get("_loaded_user_id"), instance.user_id]
+    )
@@ -0,0 +1,104 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Model, Q, QuerySet
+from django.http.request import HttpRequest
+
+
+class PaginationError(ValueError):
+    """Raised when the cursor or page size in a request is invalid"""
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Pack the sort key of the last row of a page into an opaque cursor"""
+    key = [
+        value.isoformat() if isinstance(value, datetime) else value for value in values
+    ]
+    payload = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, length: int) -> List[Any]:
+    """Unpack a cursor made by ``encode_cursor``"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise PaginationError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != length:
+        raise PaginationError("Invalid cursor")
+    return values
+
+
+def page_size(request: HttpRequest) -> int:
+    """The page size asked for with ?limit=, capped at API_MAX_PAGE_SIZE"""
+    limit = request.GET.get("limit")
+    if limit is None:
+        return settings.API_PAGE_SIZE
+    try:
+        size = int(limit)
+    except ValueError:
+        raise PaginationError("Invalid page size")
+    if size < 1:
+        raise PaginationError("Invalid page size")
+    return min(size, settings.API_MAX_PAGE_SIZE)
+
+
+def after(fields: Sequence[str], values: Sequence[Any]) -> Q:
+    """The condition for rows that sort after ``values`` on ``fields``"""
+    condition = Q()
+    for i in reversed(range(len(fields))):
+        step = Q(**{f"{fields[i]}__gt": values[i]})
+        if condition:
+            step |= Q(**{fields[i]: values[i]}) & condition
+        condition = step
+    return condition
+
+
+def page_queryset(
+    queryset: QuerySet, request: HttpRequest, fields: Sequence[str]
+) -> Tuple[QuerySet, int]:
+    """Narrow the queryset to the requested page plus one row, and the page size"""
+    size = page_size(request)
+    queryset = queryset.order_by(*fields)
+    cursor = request.GET.get("cursor")
+    if cursor:
+        values = decode_cursor(cursor, len(fields))
+        try:
+            queryset = queryset.filter(after(fields, values))
+        except (ValidationError, ValueError, TypeError):
+            raise PaginationError("Invalid cursor")
+    return queryset[: size + 1], size
+
+
+def split_page(
+    rows: List[Model], size: int, fields: Sequence[str]
+) -> Tuple[List[Model], Optional[str]]:
+    """Drop the extra row fetched by ``page_queryset`` and make the next cursor"""
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, encode_cursor([getattr(rows[-1], field) for field in fields])
+
+
+def paginate(
+    queryset: QuerySet, request: HttpRequest, fields: Sequence[str]
+) -> Tuple[List[Model], Optional[str]]:
+    """Get one page of the queryset ordered by ``fields`` and the next cursor.
+
+    The ordering must be unique, so the last field is usually the primary key.
+    Raises ``PaginationError`` for an invalid cursor or page size.
+    """
+    page, size = page_queryset(queryset, request, fields)
+    return split_page(list(page), size, fields)
+
+
+async def apaginate(
+    queryset: QuerySet, request: HttpRequest, fields: Sequence[str]
+) -> Tuple[List[Model], Optional[str]]:
+    """Async version of ``paginate``, prefetches are not applied"""
+    page, size = page_queryset(queryset, request, fields)
+    return split_page([row async for row in page], size, fields)
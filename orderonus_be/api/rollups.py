@@ -0,0 +1,284 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, F, Min, Max, Sum, Value, When
+from django.utils import timezone
+
+from .dates import day_range, store_timezone
+from .export import iter_archived, iter_orders
+from .models import ArchivedOrder, DailyDishSales, DailySales, Dish, Order, Store
+
+
+@dataclass
+class SaleLine:
+    """What an order line contributes to the rollups"""
+
+    dish_id: int
+    quantity: int
+    unit_price: int
+
+    @classmethod
+    def from_cart(cls, line: Any) -> "SaleLine":
+        return cls(
+            dish_id=line.dish.id,
+            quantity=line.quantity,
+            unit_price=line.dish.price + sum(m.price for m in line.modifiers),
+        )
+
+    @classmethod
+    def from_relation(cls, line: Any) -> "SaleLine":
+        return cls(
+            dish_id=line.dish_id,
+            quantity=line.quantity,
+            unit_price=line.dish.price + sum(m.price for m in line.get_modifiers()),
+        )
+
+    @classmethod
+    def from_record(cls, line: Dict[str, Any]) -> "SaleLine":
+        """From a line of an export record, as archived orders keep them"""
+        return cls(
+            dish_id=line["dish_id"],
+            quantity=line["quantity"],
+            unit_price=line["price"] + sum(m["price"] for m in line["modifiers"]),
+        )
+
+    @property
+    def revenue(self: "SaleLine") -> int:
+        return self.quantity * self.unit_price
+
+
+@dataclass
+class Sale:
+    """An order as counted by the rollups"""
+
+    created_at: datetime
+    is_completed: bool
+    lines: List[SaleLine]
+
+
+class Tally:
+    """Rollup increments accumulated in memory before they are written"""
+
+    def __init__(self: "Tally", store: Store) -> None:
+        self.store = store
+        self.tz = store_timezone(store)
+        # day -> [orders, completed, revenue]
+        self.days: Dict[date, List[int]] = defaultdict(lambda: [0, 0, 0])
+        # (day, dish id) -> [orders, quantity, revenue]
+        self.dishes: Dict[Tuple[date, int], List[int]] = defaultdict(lambda: [0, 0, 0])
+
+    def add(self: "Tally", sale: Sale) -> None:
+        """Count an order"""
+        day = timezone.localtime(sale.created_at, self.tz).date()
+        totals = self.days[day]
+        totals[0] += 1
+        totals[1] += int(sale.is_completed)
+        for dish_id in {line.dish_id for line in sale.lines}:
+            self.dishes[(day, dish_id)][0] += 1
+        for line in sale.lines:
+            entry = self.dishes[(day, line.dish_id)]
+            entry[1] += line.quantity
+            entry[2] += line.revenue
+            totals[2] += line.revenue
+
+    def save(self: "Tally") -> None:
+        """Add the increments to the rollup tables, one statement per table and day"""
+        DailySales.objects.bulk_create(
+            [DailySales(store=self.store, day=day) for day in self.days],
+            ignore_conflicts=True,
+        )
+        DailyDishSales.objects.bulk_create(
+            [
+                DailyDishSales(store=self.store, day=day, dish_id=dish_id)
+                for day, dish_id in self.dishes
+            ],
+            ignore_conflicts=True,
+        )
+        for day, (orders, completed, revenue) in self.days.items():
+            DailySales.objects.filter(store=self.store, day=day).update(
+                order_count=F("order_count") + orders,
+                completed_count=F("completed_count") + completed,
+                revenue=F("revenue") + revenue,
+            )
+
+        by_day: Dict[date, Dict[int, List[int]]] = defaultdict(dict)
+        for (day, dish_id), entry in self.dishes.items():
+            by_day[day][dish_id] = entry
+        for day, dishes in by_day.items():
+            DailyDishSales.objects.filter(
+                store=self.store, day=day, dish_id__in=dishes
+            ).update(
+                order_count=F("order_count") + increments(dishes, 0),
+                quantity=F("quantity") + increments(dishes, 1),
+                revenue=F("revenue") + increments(dishes, 2),
+            )
+
+    def create(self: "Tally") -> None:
+        """Insert the totals as new rows, for days that have no rollups yet.
+
+        Archived lines keep the ids of dishes deleted since, which have no
+        dish rollups left to rebuild. They still count in the daily totals.
+        """
+        dish_ids = {dish_id for _, dish_id in self.dishes}
+        existing = set(
+            Dish.objects.filter(id__in=dish_ids).values_list("id", flat=True)
+        )
+        DailySales.objects.bulk_create(
+            [
+                DailySales(
+                    store=self.store,
+                    day=day,
+                    order_count=orders,
+                    completed_count=completed,
+                    revenue=revenue,
+                )
+                for day, (orders, completed, revenue) in self.days.items()
+            ]
+        )
+        DailyDishSales.objects.bulk_create(
+            [
+                DailyDishSales(
+                    store=self.store,
+                    day=day,
+                    dish_id=dish_id,
+                    order_count=orders,
+                    quantity=quantity,
+                    revenue=revenue,
+                )
+                for (day, dish_id), (orders, quantity, revenue) in self.dishes.items()
+                if dish_id in existing
+            ]
+        )
+
+
+def increments(dishes: Dict[int, List[int]], index: int) -> Case:
+    """Pick each dish's increment in a single UPDATE"""
+    return Case(
+        *(
+            When(dish_id=dish_id, then=Value(entry[index]))
+            for dish_id, entry in dishes.items()
+        ),
+        default=Value(0),
+        output_field=BigIntegerField(),
+    )
+
+
+def record_orders(store: Store, sales: Iterable[Sale]) -> None:
+    """Add new orders to the rollups, call inside the transaction creating them"""
+    tally = Tally(store)
+    for sale in sales:
+        tally.add(sale)
+    tally.save()
+
+
+def record_completion(store: Store, order: Order, was_completed: bool) -> None:
+    """Count a change of the completion status of an order"""
+    if bool(order.is_completed) == bool(was_completed):
+        return
+    day = timezone.localtime(order.created_at, store_timezone(store)).date()
+    DailySales.objects.filter(store=store, day=day).update(
+        completed_count=F("completed_count") + (1 if order.is_completed else -1)
+    )
+
+
+def order_sales(store: Store, start: datetime, end: datetime) -> Iterable[Sale]:
+    """The orders and archived orders of the range as counted by the rollups"""
+    for order in iter_orders(store, start, end):
+        yield Sale(
+            created_at=order.created_at,
+            is_completed=order.is_completed,
+            lines=[SaleLine.from_relation(line) for line in order.get_lines()],
+        )
+    for archived in iter_archived(store, start, end):
+        yield Sale(
+            created_at=archived.created_at,
+            is_completed=archived.is_completed,
+            lines=[SaleLine.from_record(line) for line in archived.lines],
+        )
+
+
+def order_bounds(store: Store) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """When the store's first and last orders, archived or not, were created"""
+    bounds = [
+        model.objects.filter(store=store).aggregate(
+            first=Min("created_at"), last=Max("created_at")
+        )
+        for model in [Order, ArchivedOrder]
+    ]
+    firsts = [row["first"] for row in bounds if row["first"] is not None]
+    lasts = [row["last"] for row in bounds if row["last"] is not None]
+    return min(firsts, default=None), max(lasts, default=None)
+
+
+def rebuild_rollups(
+    store: Store, first_day: Optional[date] = None, last_day: Optional[date] = None
+) -> None:
+    """Recompute the rollups of the store's days from the orders.
+
+    Without a range, the days from the first to the last order, archived or
+    not, are rebuilt. A store without any order is left untouched.
+    """
+    tz = store_timezone(store)
+    if first_day is None or last_day is None:
+        first, last = order_bounds(store)
+        if first is None or last is None:
+            return
+        first_day = first_day or timezone.localtime(first, tz).date()
+        last_day = last_day or timezone.localtime(last, tz).date()
+
+    start = day_range(first_day, tz)[0]
+    end = day_range(last_day, tz)[1]
+    with transaction.atomic():
+        days = {"day__gte": first_day, "day__lte": last_day}
+        DailySales.objects.filter(store=store, **days).delete()
+        DailyDishSales.objects.filter(store=store, **days).delete()
+        tally = Tally(store)
+        for sale in order_sales(store, start, end):
+            tally.add(sale)
+        tally.create()
+
+
+def summarize_range(
+    store: Store, first_day: date, last_day: date, top: int
+) -> Dict[str, Any]:
+    """Daily totals and the best selling dishes of a range of days"""
+    days = {"store": store, "day__gte": first_day, "day__lte": last_day}
+    daily = [row.to_dict() for row in DailySales.objects.filter(**days).order_by("day")]
+    top_dishes = (
+        DailyDishSales.objects.filter(**days)
+        .values("dish_id", "dish__name")
+        .annotate(
+            orders=Sum("order_count"),
+            total_quantity=Sum("quantity"),
+            total_revenue=Sum("revenue"),
+        )
+        .order_by("-total_revenue", "dish_id")[:top]
+    )
+    return {
+        "days": daily,
+        "totals": {
+            key: sum(day[key] for day in daily)
+            for key in ["orders", "completed", "revenue"]
+        },
+        "top_dishes": [
+            {
+                "id": row["dish_id"],
+                "name": row["dish__name"],
+                "orders": row["orders"],
+                "quantity": row["total_quantity"],
+                "revenue": row["total_revenue"],
+            }
+            for row in top_dishes
+        ],
+    }
+
+
+def local_days(store: Store, start: datetime, end: datetime) -> Tuple[date, date]:
+    """The first and last local days that a half-open range touches"""
+    tz = store_timezone(store)
+    return (
+        timezone.localtime(start, tz).date(),
+        timezone.localtime(end - timedelta(microseconds=1), tz).date(),
+    )
@@ -0,0 +1,280 @@
+"""Generate large, realistic data sets for load testing.
+
+Menus are written with ``bulk_create`` and orders, their lines and the
+rows of the line to modifier through table with ``executemany``, one store
+and one batch of orders at a time.
+
+Seeding allocates order and line ids itself, so it must not run while the
+server is taking orders. The data only depends on the seed and the last
+day. Each store draws from its own random generator.
+
+Orders follow ``HOURLY_WEIGHTS`` through the day in the store's timezone
+and are busier on weekends. Dishes are ordered with Zipf-like popularity so
+the menu has best sellers and a long tail. The sales rollups are counted
+while the orders are generated and written with them.
+"""
+
+import random
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.db.models import Max
+
+from .dates import start_of_day, store_timezone
+from .models import (
+    ArchivedOrder,
+    ChangeSequence,
+    Dish,
+    DishModifier,
+    Order,
+    OrderDishRelation,
+    Store,
+)
+from .rollups import Sale, SaleLine, Tally
+
+# Relative number of orders placed in each hour of the day, local time
+HOURLY_WEIGHTS = [
+    0, 0, 0, 0, 0, 0, 1, 3, 6, 5, 4, 8,
+    14, 12, 6, 4, 4, 7, 12, 13, 9, 5, 2, 1,
+]  # fmt: skip
+# Relative number of orders on each weekday, Monday first
+WEEKDAY_WEIGHTS = [0.9, 0.9, 0.95, 1.0, 1.2, 1.35, 1.25]
+ONLINE_SHARE = 0.4
+MODIFIER_SHARE = 0.3
+
+# dish id -> (price, [(modifier id, price)])
+Menu = Dict[int, Tuple[int, List[Tuple[int, int]]]]
+
+
+@dataclass
+class ScalePlan:
+    """How much data ``seed_scale`` generates"""
+
+    users: int = 10
+    stores: int = 100
+    dishes: int = 30
+    modifiers: int = 3
+    days: int = 365
+    # Average orders per store per day, before the weekday weights
+    orders_per_day: int = 50
+    # Most lines per order
+    lines: int = 4
+    seed: int = 0
+    # The last day with orders, yesterday by default
+    until: Optional[date] = None
+    batch_size: int = 5000
+
+
+def order_times(
+    rng: random.Random, store: Store, day: date, count: int
+) -> List[datetime]:
+    """When the orders of one day of the store were placed, in order"""
+    start = start_of_day(day, store_timezone(store))
+    hours = rng.choices(range(24), weights=HOURLY_WEIGHTS, k=count)
+    offsets = sorted(hour * 3600 + rng.randrange(3600) for hour in hours)
+    return [start + timedelta(seconds=offset) for offset in offsets]
+
+
+def seed_menu(rng: random.Random, store: Store, plan: ScalePlan) -> Menu:
+    """Create the store's dishes and modifiers"""
+    dishes = Dish.objects.bulk_create(
+        [
+            Dish(
+                store=store,
+                name=f"Dish {index}",
+                price=rng.randrange(500, 3000, 50),
+                description="",
+            )
+            for index in range(plan.dishes)
+        ]
+    )
+    modifiers = DishModifier.objects.bulk_create(
+        [
+            DishModifier(
+                dish=dish, name=f"Option {index}", price=rng.randrange(0, 500, 50)
+            )
+            for dish in dishes
+            for index in range(plan.modifiers)
+        ]
+    )
+    menu: Menu = {dish.id: (dish.price, []) for dish in dishes}
+    for modifier in modifiers:
+        menu[modifier.dish_id][1].append((modifier.id, modifier.price))
+    return menu
+
+
+def insert_rows(
+    model: Type[models.Model], fields: List[str], rows: List[Tuple[Any, ...]]
+) -> None:
+    """INSERT the rows with one ``executemany``.
+
+    Building model instances for ``bulk_create`` costs more than the insert
+    itself at this scale, so the rows are plain tuples of database values.
+    """
+    ops = connection.ops
+    columns = ", ".join(
+        ops.quote_name(model._meta.get_field(name).column) for name in fields
+    )
+    placeholders = ", ".join(["%s"] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {ops.quote_name(model._meta.db_table)} ({columns}) "
+            f"VALUES ({placeholders})",
+            rows,
+        )
+
+
+def next_id(model: Type[models.Model]) -> int:
+    return (model.objects.aggregate(last=Max("id"))["last"] or 0) + 1
+
+
+def seed_orders(
+    rng: random.Random,
+    store: Store,
+    times: List[datetime],
+    menu: Menu,
+    lines: int,
+    tally: Tally,
+    first_seq: int,
+) -> int:
+    """Insert a batch of orders with their lines and chosen modifiers.
+
+    The ids are allocated here so the lines can refer to their orders
+    without reading them back. The orders are numbered in the store's change
+    sequence from ``first_seq`` and added to the tally as they are generated.
+    """
+    dish_ids = list(menu)
+    popularity = [1 / (rank + 1) for rank in range(len(dish_ids))]
+    # Archived orders keep their ids
+    first_order = max(next_id(Order), next_id(ArchivedOrder))
+    first_relation = next_id(OrderDishRelation)
+    orders: List[Tuple[Any, ...]] = []
+    relations: List[Tuple[Any, ...]] = []
+    chosen: List[Tuple[int, int]] = []
+    adapt = connection.ops.adapt_datetimefield_value
+    for created_at in times:
+        order_id = first_order + len(orders)
+        created = adapt(created_at)
+        is_online = rng.random() < ONLINE_SHARE
+        change_seq = first_seq + len(orders)
+        orders.append(
+            (order_id, created, created, change_seq, store.id, is_online, True)
+        )
+        sale = Sale(created_at=created_at, is_completed=True, lines=[])
+        for dish_id in rng.choices(
+            dish_ids, weights=popularity, k=rng.randint(1, lines)
+        ):
+            relation_id = first_relation + len(relations)
+            quantity = rng.choices([1, 2, 3], weights=[80, 15, 5])[0]
+            relations.append((relation_id, dish_id, order_id, quantity, ""))
+            price, options = menu[dish_id]
+            for modifier_id, modifier_price in options:
+                if rng.random() < MODIFIER_SHARE:
+                    chosen.append((relation_id, modifier_id))
+                    price += modifier_price
+            sale.lines.append(SaleLine(dish_id, quantity, price))
+        tally.add(sale)
+
+    insert_rows(
+        Order,
+        [
+            "id",
+            "created_at",
+            "updated_at",
+            "change_seq",
+            "store",
+            "is_online",
+            "is_completed",
+        ],
+        orders,
+    )
+    insert_rows(
+        OrderDishRelation,
+        ["id", "dish", "order", "quantity", "other_comments"],
+        relations,
+    )
+    insert_rows(
+        OrderDishRelation.modifiers.through,
+        ["orderdishrelation", "dishmodifier"],
+        chosen,
+    )
+    return len(relations)
+
+
+def reset_sequences() -> None:
+    """Move the id sequences past the ids allocated by ``seed_orders``"""
+    statements = connection.ops.sequence_reset_sql(
+        no_style(), [Order, OrderDishRelation]
+    )
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def seed_scale(
+    plan: ScalePlan,
+    prefix: str = "seed",
+    password: str = "password",
+    progress: Optional[Callable[[Store, int, int], None]] = None,
+) -> Dict[str, int]:
+    """Create users, their stores and menus, and ``plan.days`` days of orders
+    with their sales rollups.
+
+    Stores are shared out between the users in turn. ``progress`` is called
+    with each finished store and its numbers of orders and lines.
+    """
+    until = plan.until or date.today() - timedelta(days=1)
+    first_day = until - timedelta(days=plan.days - 1)
+    hashed = make_password(password)
+    users = User.objects.bulk_create(
+        [
+            User(username=f"{prefix}-{index}", password=hashed)
+            for index in range(plan.users)
+        ]
+    )
+    stores = Store.objects.bulk_create(
+        [
+            Store(
+                name=f"Store {index}",
+                description="",
+                user=users[index % len(users)],
+            )
+            for index in range(plan.stores)
+        ]
+    )
+    totals = {"users": len(users), "stores": len(stores), "orders": 0, "lines": 0}
+    for index, store in enumerate(stores):
+        rng = random.Random(f"{plan.seed}:{index}")
+        tally = Tally(store)
+        orders = lines = 0
+        with transaction.atomic():
+            menu = seed_menu(rng, store, plan)
+            batch: List[datetime] = []
+            for offset in range(plan.days):
+                day = first_day + timedelta(days=offset)
+                mean = plan.orders_per_day * WEEKDAY_WEIGHTS[day.weekday()]
+                count = max(0, round(rng.gauss(mean, mean**0.5)))
+                batch += order_times(rng, store, day, count)
+                if len(batch) >= plan.batch_size:
+                    lines += seed_orders(
+                        rng, store, batch, menu, plan.lines, tally, orders + 1
+                    )
+                    orders += len(batch)
+                    batch = []
+            if batch:
+                lines += seed_orders(
+                    rng, store, batch, menu, plan.lines, tally, orders + 1
+                )
+                orders += len(batch)
+            tally.create()
+            ChangeSequence.objects.create(store=store, value=orders)
+        totals["orders"] += orders
+        totals["lines"] += lines
+        if progress is not None:
+            progress(store, orders, lines)
+    reset_sequences()
+    return totals
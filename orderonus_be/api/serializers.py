@@ -0,0 +1,120 @@
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List
+from django.db.models import Prefetch, QuerySet
+from orderonus_be.instrumentation import timed
+
+from .models import Dish, DishModifier, Order, OrderDishRelation
+
+# Attribute names the prefetches below cache their results under. The model
+# ``to_dict`` methods read them when present instead of issuing a query.
+MODIFIERS_ATTR = "prefetched_modifiers"
+LINES_ATTR = "prefetched_lines"
+
+
+def prefetch_dishes(queryset: "QuerySet[Dish]") -> "QuerySet[Dish]":
+    """Load the modifiers of every dish in the queryset with one extra query"""
+    return queryset.prefetch_related(
+        Prefetch(
+            "dishmodifier_set",
+            queryset=DishModifier.objects.order_by("id"),
+            to_attr=MODIFIERS_ATTR,
+        )
+    )
+
+
+def prefetch_order_lines(
+    queryset: "QuerySet[OrderDishRelation]",
+) -> "QuerySet[OrderDishRelation]":
+    """Load the dish, the dish's modifiers and the chosen modifiers of every line"""
+    return queryset.select_related("dish").prefetch_related(
+        Prefetch(
+            "modifiers",
+            queryset=DishModifier.objects.order_by("id"),
+            to_attr=MODIFIERS_ATTR,
+        ),
+        Prefetch(
+            "dish__dishmodifier_set",
+            queryset=DishModifier.objects.order_by("id"),
+            to_attr=MODIFIERS_ATTR,
+        ),
+    )
+
+
+def prefetch_orders(queryset: "QuerySet[Order]") -> "QuerySet[Order]":
+    """Load every line of every order in the queryset with a fixed number of queries"""
+    return queryset.prefetch_related(
+        Prefetch(
+            "orderdishrelation_set",
+            queryset=prefetch_order_lines(OrderDishRelation.objects.order_by("id")),
+            to_attr=LINES_ATTR,
+        )
+    )
+
+
+async def aload_dishes(dishes: List[Dish]) -> List[Dish]:
+    """Async version of ``prefetch_dishes`` for already fetched dishes"""
+    grouped: Dict[int, List[DishModifier]] = defaultdict(list)
+    async for modifier in DishModifier.objects.filter(
+        dish_id__in={dish.id for dish in dishes}
+    ).order_by("id"):
+        grouped[modifier.dish_id].append(modifier)
+    for dish in dishes:
+        setattr(dish, MODIFIERS_ATTR, grouped[dish.id])
+    return dishes
+
+
+async def aload_order_lines(
+    lines: List[OrderDishRelation],
+) -> List[OrderDishRelation]:
+    """Async version of ``prefetch_order_lines`` for fetched lines with dishes"""
+    through = OrderDishRelation.modifiers.through
+    chosen: Dict[int, List[DishModifier]] = defaultdict(list)
+    async for row in (
+        through.objects.filter(orderdishrelation_id__in={line.id for line in lines})
+        .select_related("dishmodifier")
+        .order_by("dishmodifier_id")
+    ):
+        chosen[row.orderdishrelation_id].append(row.dishmodifier)
+    for line in lines:
+        setattr(line, MODIFIERS_ATTR, chosen[line.id])
+    await aload_dishes([line.dish for line in lines])
+    return lines
+
+
+async def aload_orders(orders: List[Order]) -> List[Order]:
+    """Async version of ``prefetch_orders`` for already fetched orders"""
+    lines = [
+        line
+        async for line in OrderDishRelation.objects.filter(
+            order_id__in={order.id for order in orders}
+        )
+        .select_related("dish")
+        .order_by("id")
+    ]
+    await aload_order_lines(lines)
+    grouped: Dict[int, List[OrderDishRelation]] = defaultdict(list)
+    for line in lines:
+        grouped[line.order_id].append(line)
+    for order in orders:
+        setattr(order, LINES_ATTR, grouped[order.id])
+    return orders
+
+
+@timed("serialize")
+def serialize_orders(orders: Iterable[Order]) -> List[Dict[str, Any]]:
+    """Serialize orders loaded through ``prefetch_orders``"""
+    return [order.to_dict() for order in orders]
+
+
+@timed("serialize")
+def serialize_order_lines(
+    lines: Iterable[OrderDishRelation],
+) -> List[Dict[str, Any]]:
+    """Serialize order lines loaded through ``prefetch_order_lines``"""
+    return [line.to_dict() for line in lines]
+
+
+@timed("serialize")
+def serialize_dishes(dishes: Iterable[Dish]) -> List[Dict[str, Any]]:
+    """Serialize dishes loaded through ``prefetch_dishes``"""
+    return [dish.to_dict() for dish in dishes]
@@ -1,15 +1,73 @@
-from datetime import timedelta
-from django.test import TestCase
-from django.contrib.auth.models import User
+import asyncio
+import csv
+import json
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from asgiref.sync import sync_to_async
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+from PIL import Image
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import (
+    AsyncRequestFactory,
+    Client,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.contrib.auth.models import AnonymousUser, User
+from django.http.response import HttpResponse
+from django.db import connection, connections, transaction
+from django.db.models import Max, Min
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-
-from .models import Order, Dish, DishModifier, Store, OrderDishRelation
+from orderonus_be.metrics import registry
+
+from . import async_views, batch, images, views
+from .benchmarks import compare_results, endpoint_suite, route_labels, seed_store
+from .archive import archive_cutoff, archive_orders
+from .models import (
+    ArchivedOrder,
+    DailyDishSales,
+    DailySales,
+    IdempotencyRecord,
+    Order,
+    Dish,
+    DishModifier,
+    Store,
+    OrderDishRelation,
+)
+from .cache import get_cache, menu_stats
+from .dates import local_today, store_timezone
+from .events import Event, OrderEventBroker
+from .export import iter_orders
+from .images import variant_files, wait_for_variants
+from .orders import create_order, resolve_cart
+from .ownership import LocalOwnershipCache, reset_ownership_cache
+from .pagination import encode_cursor
+from .rollups import rebuild_rollups
+from .seeding import ScalePlan, seed_scale
+from .serializers import (
+    prefetch_dishes,
+    prefetch_orders,
+    serialize_dishes,
+    serialize_orders,
+)
+from .utils import get_store, request_store
 
 
 # Create your tests here.
 class LoginTestCase(TestCase):
     def setUp(self: "LoginTestCase") -> None:
         super().setUp()
+        get_cache().clear()
+        reset_ownership_cache()
         self.password = "password"
         self.username = "username"
 
@@ -102,6 +160,21 @@ class AddStoreTest(StoreTestCase):
             },
         )
 
+    def test_add_store_fail_invalid_timezone(self) -> None:
+        """Unknown timezones and values that are not names are rejected"""
+        self.assertTrue(self.login(), "Failed to log in")
+        for value in ["Mars/Olympus_Mons", 5, ["UTC"]]:
+            response = self.client.post(
+                "/api/stores/add",
+                {"name": "New Store", "description": "", "timezone": value},
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 400, value)
+            self.assertEqual(response.json(), {"error": "Invalid timezone"})
+        self.assertEqual(
+            store_timezone(Store(timezone=5)), timezone.get_default_timezone()
+        )
+
     def test_add_store_success(self) -> None:
         """Test adding a store"""
         self.assertTrue(self.login(), "Failed to log in")
@@ -154,8 +227,10 @@ class GetStoreTest(StoreTestCase):
                         "name": self.store_name,
                         "description": self.store_description,
                         "image": None,
+                        "image_variants": {},
                     }
-                ]
+                ],
+                "next": None,
             },
         )
 
@@ -460,7 +535,8 @@ class GetOrdersTest(StoreTestCase):
                     self.completed_order.to_dict(),
                     self.physical_order.to_dict(),
                     self.online_order.to_dict(),
-                ]
+                ],
+                "next": None,
             },
         )
 
@@ -632,7 +708,8 @@ class GetDishTest(StoreTestCase):
                 "data": [
                     self.dish.to_dict(),
                     self.dish2.to_dict(),
-                ]
+                ],
+                "next": None,
             },
         )
 
@@ -668,6 +745,7 @@ class AddDishTest(StoreTestCase):
                 "modifiers": [],
                 "is_available": True,
                 "image": None,
+                "image_variants": {},
             },
         )
 
@@ -738,3 +816,2372 @@ class AddDishTest(StoreTestCase):
         self.assertEqual(response.json(), {"data": "Dish created successfully"})
         self.assertEqual(Dish.objects.count(), 2)
         self.assertEqual(DishModifier.objects.count(), 2)
+
+
+class OrderSerializationQueryTest(StoreTestCase):
+    def setUp(self: "OrderSerializationQueryTest") -> None:
+        super().setUp()
+        self.dishes = []
+        for i in range(3):
+            dish = Dish.objects.create(
+                name=f"Dish {i}",
+                description="Test Description",
+                price=100 + i,
+                store=self.store,
+            )
+            for j in range(2):
+                DishModifier.objects.create(
+                    name=f"Mod {i}-{j}", price=10 * j, dish=dish
+                )
+            self.dishes.append(dish)
+
+    def tearDown(self: "OrderSerializationQueryTest") -> None:
+        Order.objects.all().delete()
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def create_orders(self: "OrderSerializationQueryTest", count: int) -> None:
+        """Create orders that contain every dish with all of its modifiers"""
+        for _ in range(count):
+            order = Order.objects.create(
+                is_online=False,
+                is_completed=False,
+                created_at=timezone.now(),
+                store=self.store,
+            )
+            for dish in self.dishes:
+                relation = OrderDishRelation.objects.create(
+                    order=order, dish=dish, quantity=2, other_comments=""
+                )
+                relation.modifiers.set(DishModifier.objects.filter(dish=dish))
+
+    def count_queries(self: "OrderSerializationQueryTest", endpoint: str) -> int:
+        """Count the queries that an endpoint runs"""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(endpoint)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(context.captured_queries)
+
+    def test_serialize_orders_fixed_queries(self) -> None:
+        """Serializing a page of orders takes the same queries for any size"""
+        self.create_orders(5)
+        queryset = prefetch_orders(Order.objects.filter(store=self.store))
+        with self.assertNumQueries(4):
+            data = serialize_orders(queryset)
+        self.assertEqual(len(data), 5)
+        self.assertEqual(
+            data,
+            [order.to_dict() for order in Order.objects.filter(store=self.store)],
+        )
+
+    def test_serialize_dishes_fixed_queries(self) -> None:
+        """Serializing the menu takes two queries"""
+        with self.assertNumQueries(2):
+            data = serialize_dishes(prefetch_dishes(Dish.objects.all()))
+        self.assertEqual(len(data), 3)
+        self.assertEqual(len(data[0]["modifiers"]), 2)
+
+    def test_orders_endpoint_query_count_independent_of_size(self) -> None:
+        """The orders feed does not run more queries when there are more orders"""
+        self.assertTrue(self.login(), "Login failed")
+        endpoint = f"/api/stores/{self.store.id}/orders/"
+        self.create_orders(1)
+        # Warm the store ownership cache
+        self.count_queries(endpoint)
+        small = self.count_queries(endpoint)
+        self.create_orders(10)
+        large = self.count_queries(endpoint)
+        self.assertEqual(small, large)
+
+    def test_order_by_id_success(self) -> None:
+        """Retrieving a single order returns the order and its lines"""
+        self.create_orders(1)
+        order = Order.objects.get()
+        self.assertTrue(self.login(), "Login failed")
+        response = self.client.get(f"/api/stores/{self.store.id}/orders/{order.id}/")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            response.json(),
+            {
+                "data": {
+                    "order": order.to_dict(),
+                    "dishes": [
+                        line.to_dict()
+                        for line in OrderDishRelation.objects.filter(order=order)
+                    ],
+                }
+            },
+        )
+
+    def test_order_by_id_fail_not_found(self) -> None:
+        """Retrieving an order that does not exist returns 404"""
+        self.assertTrue(self.login(), "Login failed")
+        response = self.client.get(f"/api/stores/{self.store.id}/orders/999/")
+        self.assertEqual(response.status_code, 404, response.content)
+        self.assertEqual(response.json(), {"error": "Order not found"})
+
+
+class BulkAddOrderTest(StoreTestCase):
+    def setUp(self: "BulkAddOrderTest") -> None:
+        super().setUp()
+        self.endpoint = f"/api/stores/{self.store.id}/orders/add"
+        self.dishes = []
+        self.modifiers = []
+        for i in range(5):
+            dish = Dish.objects.create(
+                name=f"Dish {i}", description="", price=100, store=self.store
+            )
+            self.dishes.append(dish)
+            self.modifiers.append(
+                DishModifier.objects.create(name=f"Mod {i}", price=10, dish=dish)
+            )
+
+    def tearDown(self: "BulkAddOrderTest") -> None:
+        Order.objects.all().delete()
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def cart(self: "BulkAddOrderTest", size: int) -> dict:
+        """Build a cart with one line per dish and its modifier"""
+        return {
+            "isOnline": True,
+            "dishes": [
+                {
+                    "id": self.dishes[i].id,
+                    "quantity": 1,
+                    "modifier": [self.modifiers[i].id],
+                    "other_comments": "No onions",
+                }
+                for i in range(size)
+            ],
+        }
+
+    def post_cart(self: "BulkAddOrderTest", cart: dict) -> int:
+        """Submit the cart and return the number of queries it took"""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                self.endpoint, cart, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(context.captured_queries)
+
+    def test_add_order_query_count_independent_of_cart_size(self) -> None:
+        """Submitting a bigger cart does not run more queries"""
+        self.assertTrue(self.login(), "Login failed")
+        # Warm the store ownership cache
+        self.post_cart(self.cart(1))
+        small = self.post_cart(self.cart(1))
+        large = self.post_cart(self.cart(5))
+        self.assertEqual(small, large)
+
+    def test_add_order_writes_lines_and_modifiers(self) -> None:
+        """The lines and their modifiers are stored"""
+        self.assertTrue(self.login(), "Login failed")
+        self.post_cart(self.cart(3))
+        order = Order.objects.get()
+        relations = OrderDishRelation.objects.filter(order=order).order_by("id")
+        self.assertEqual(
+            [relation.dish_id for relation in relations],
+            [dish.id for dish in self.dishes[:3]],
+        )
+        self.assertEqual(
+            [list(relation.modifiers.all()) for relation in relations],
+            [[modifier] for modifier in self.modifiers[:3]],
+        )
+        self.assertEqual(relations[0].other_comments, "No onions")
+
+    def test_add_order_fail_leaves_nothing_behind(self) -> None:
+        """An invalid line anywhere in the cart rejects the whole order"""
+        self.assertTrue(self.login(), "Login failed")
+        cart = self.cart(3)
+        cart["dishes"].append({"id": self.dishes[0].id, "quantity": 1})
+        cart["dishes"][1]["modifier"] = [self.modifiers[0].id]
+        response = self.client.post(
+            self.endpoint, cart, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 404, response.content)
+        self.assertEqual(response.json(), {"error": "Modifier not found"})
+        self.assertEqual(Order.objects.count(), 0)
+        self.assertEqual(OrderDishRelation.objects.count(), 0)
+
+    def test_add_order_fail_dish_from_other_store(self) -> None:
+        """Dishes of another store cannot be ordered"""
+        other_store = Store.objects.create(
+            name="Other Store", description="", user=self.user1
+        )
+        other_dish = Dish.objects.create(
+            name="Other Dish", description="", price=100, store=other_store
+        )
+        self.assertTrue(self.login(), "Login failed")
+        response = self.client.post(
+            self.endpoint,
+            {"dishes": [{"id": other_dish.id, "quantity": 1}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 404, response.content)
+        self.assertEqual(response.json(), {"error": "Dish not found"})
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class OrderDateRangeTest(StoreTestCase):
+    def setUp(self: "OrderDateRangeTest") -> None:
+        super().setUp()
+        # 23:30 in Singapore on the 1st is 15:30 UTC on the 1st, while
+        # 00:30 in Singapore on the 2nd is 16:30 UTC on the 1st
+        self.store.timezone = "Asia/Singapore"
+        self.store.save()
+        self.endpoint = f"/api/stores/{self.store.id}/orders/"
+        self.late_order = Order.objects.create(
+            is_online=False,
+            is_completed=False,
+            created_at=datetime(2024, 3, 1, 15, 30, tzinfo=dt_timezone.utc),
+            store=self.store,
+        )
+        self.next_day_order = Order.objects.create(
+            is_online=False,
+            is_completed=False,
+            created_at=datetime(2024, 3, 1, 16, 30, tzinfo=dt_timezone.utc),
+            store=self.store,
+        )
+
+    def tearDown(self: "OrderDateRangeTest") -> None:
+        Order.objects.all().delete()
+        return super().tearDown()
+
+    def get_ids(self: "OrderDateRangeTest", query: str) -> list:
+        """Get the ids of the orders returned for the query string"""
+        response = self.client.get(f"{self.endpoint}?{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return [order["id"] for order in response.json()["data"]]
+
+    def test_day_is_counted_in_store_timezone(self) -> None:
+        """A date range covers the store's local day, not the UTC day"""
+        self.assertTrue(self.login(), "Login failed")
+        self.assertEqual(
+            self.get_ids("from=2024-03-01&to=2024-03-01"), [self.late_order.id]
+        )
+        self.assertEqual(
+            self.get_ids("from=2024-03-02&to=2024-03-02"), [self.next_day_order.id]
+        )
+
+    def test_datetime_bounds_are_half_open(self) -> None:
+        """The end of a datetime range is excluded"""
+        self.assertTrue(self.login(), "Login failed")
+        self.assertEqual(
+            self.get_ids("from=2024-03-01T23:30:00&to=2024-03-02T00:30:00"),
+            [self.late_order.id],
+        )
+
+    def test_from_without_to_runs_until_today(self) -> None:
+        """Leaving out the end of the range includes everything up to today"""
+        self.assertTrue(self.login(), "Login failed")
+        self.assertEqual(
+            self.get_ids("from=2024-03-01"),
+            [self.late_order.id, self.next_day_order.id],
+        )
+
+    def test_invalid_range(self) -> None:
+        """Unparseable or reversed ranges are rejected"""
+        self.assertTrue(self.login(), "Login failed")
+        for query in ["from=yesterday", "from=2024-03-02&to=2024-03-01"]:
+            response = self.client.get(f"{self.endpoint}?{query}")
+            self.assertEqual(response.status_code, 400, response.content)
+            self.assertEqual(response.json(), {"error": "Invalid date range"})
+
+    def test_default_is_today_in_store_timezone(self) -> None:
+        """Without a range only the orders of the store's current day are returned"""
+        today = Order.objects.create(
+            is_online=False,
+            is_completed=False,
+            created_at=timezone.now(),
+            store=self.store,
+        )
+        self.assertTrue(self.login(), "Login failed")
+        self.assertEqual(self.get_ids(""), [today.id])
+
+
+class PaginationTest(StoreTestCase):
+    def setUp(self: "PaginationTest") -> None:
+        super().setUp()
+        created_at = timezone.now().replace(microsecond=123456)
+        self.orders = [
+            Order.objects.create(
+                is_online=False,
+                is_completed=False,
+                # Two orders share each timestamp so the id breaks ties
+                created_at=created_at - timedelta(seconds=5 - i // 2),
+                store=self.store,
+            )
+            for i in range(5)
+        ]
+        self.dishes = [
+            Dish.objects.create(
+                name=f"Dish {i}", description="", price=100, store=self.store
+            )
+            for i in range(3)
+        ]
+
+    def tearDown(self: "PaginationTest") -> None:
+        Order.objects.all().delete()
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def collect(self: "PaginationTest", endpoint: str, limit: int) -> list:
+        """Walk every page of a listing and collect the ids"""
+        ids = []
+        url = f"{endpoint}?limit={limit}"
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            body = response.json()
+            self.assertLessEqual(len(body["data"]), limit)
+            ids.extend(item["id"] for item in body["data"])
+            url = (
+                None
+                if body["next"] is None
+                else f"{endpoint}?limit={limit}&cursor={body['next']}"
+            )
+        return ids
+
+    def test_orders_pages(self) -> None:
+        """Walking the order pages returns every order once, in order"""
+        self.assertTrue(self.login(), "Login failed")
+        ids = self.collect(f"/api/stores/{self.store.id}/orders/", 2)
+        self.assertEqual(ids, [order.id for order in self.orders])
+
+    def test_dishes_pages(self) -> None:
+        """Walking the dish pages returns every dish once"""
+        self.assertTrue(self.login(), "Login failed")
+        ids = self.collect(f"/api/stores/{self.store.id}/dishes/", 2)
+        self.assertEqual(ids, [dish.id for dish in self.dishes])
+
+    def test_stores_pages(self) -> None:
+        """Walking the store pages returns every store once"""
+        other = Store.objects.create(name="Other", description="", user=self.user1)
+        self.assertTrue(self.login(), "Login failed")
+        self.assertEqual(self.collect("/api/stores/", 1), [self.store.id, other.id])
+
+    def test_invalid_cursor_and_limit(self) -> None:
+        """Malformed cursors and page sizes are rejected"""
+        self.assertTrue(self.login(), "Login failed")
+        endpoint = f"/api/stores/{self.store.id}/orders/"
+        for query, error in [
+            ("cursor=not-a-cursor", "Invalid cursor"),
+            (f"cursor={encode_cursor(['yesterday', 1])}", "Invalid cursor"),
+            ("limit=0", "Invalid page size"),
+            ("limit=ten", "Invalid page size"),
+        ]:
+            response = self.client.get(f"{endpoint}?{query}")
+            self.assertEqual(response.status_code, 400, response.content)
+            self.assertEqual(response.json(), {"error": error})
+
+    @override_settings(API_MAX_PAGE_SIZE=3)
+    def test_limit_is_capped(self) -> None:
+        """Clients cannot ask for pages larger than the maximum"""
+        self.assertTrue(self.login(), "Login failed")
+        response = self.client.get(f"/api/stores/{self.store.id}/orders/?limit=100")
+        self.assertEqual(len(response.json()["data"]), 3)
+        self.assertIsNotNone(response.json()["next"])
+
+
+class MenuCacheTest(StoreTestCase):
+    def setUp(self: "MenuCacheTest") -> None:
+        super().setUp()
+        self.endpoint = f"/api/stores/{self.store.id}/dishes/"
+        self.dish = Dish.objects.create(
+            name="Ramen", description="", price=100, store=self.store
+        )
+
+    def tearDown(self: "MenuCacheTest") -> None:
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def get_menu(self: "MenuCacheTest", expected: str) -> dict:
+        """Get the menu and check if it was served from the cache"""
+        response = self.client.get(self.endpoint)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response["X-Menu-Cache"], expected)
+        return response.json()
+
+    def test_menu_is_cached(self) -> None:
+        """The second request is served from the cache without reading dishes"""
+        self.assertTrue(self.login(), "Login failed")
+        registry.clear()
+        before = menu_stats.to_dict()
+        first = self.get_menu("miss")
+        with CaptureQueriesContext(connection) as context:
+            second = self.get_menu("hit")
+        self.assertEqual(first, second)
+        self.assertFalse(
+            any("api_dish" in query["sql"] for query in context.captured_queries)
+        )
+        after = menu_stats.to_dict()
+        self.assertEqual(after["hits"] - before["hits"], 1)
+        self.assertEqual(after["misses"] - before["misses"], 1)
+
+        # Exposed to Prometheus
+        text = self.client.get("/metrics").content.decode()
+        self.assertIn(
+            'orderonus_cache_lookups_total{cache="menu",result="hit"} 1', text
+        )
+        self.assertIn(
+            'orderonus_cache_lookups_total{cache="menu",result="miss"} 1', text
+        )
+
+    def test_pages_are_cached_separately(self) -> None:
+        """Each page size gets its own cache entry"""
+        self.assertTrue(self.login(), "Login failed")
+        self.get_menu("miss")
+        response = self.client.get(f"{self.endpoint}?limit=1")
+        self.assertEqual(response["X-Menu-Cache"], "miss")
+
+    def test_menu_changes_invalidate_cache(self) -> None:
+        """Every endpoint that changes the menu invalidates the cached menu"""
+        self.assertTrue(self.login(), "Login failed")
+        base = f"/api/stores/{self.store.id}/dishes"
+        changes = [
+            (f"{base}/add", {"name": "Udon", "price": 100}),
+            (f"{base}/{self.dish.id}/edit", {"price": 200}),
+            (f"{base}/{self.dish.id}/available", {"is_available": False}),
+            (f"{base}/{self.dish.id}/modifier/add", {"name": "Egg", "price": 50}),
+            (f"{base}/{self.dish.id}/delete", {}),
+        ]
+        self.get_menu("miss")
+        for endpoint, body in changes:
+            self.get_menu("hit")
+            response = self.client.post(endpoint, body, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+            menu = self.get_menu("miss")
+            self.assertEqual(
+                menu["data"],
+                serialize_dishes(prefetch_dishes(Dish.objects.order_by("id"))),
+            )
+
+
+class ConditionalGetTest(StoreTestCase):
+    def setUp(self: "ConditionalGetTest") -> None:
+        super().setUp()
+        self.dish = Dish.objects.create(
+            name="Ramen", description="", price=100, store=self.store
+        )
+        self.order = Order.objects.create(
+            is_online=False,
+            is_completed=False,
+            created_at=timezone.now(),
+            store=self.store,
+        )
+        self.endpoints = [
+            f"/api/stores/{self.store.id}/dishes/",
+            f"/api/stores/{self.store.id}/orders/",
+            f"/api/stores/{self.store.id}/orders/{self.order.id}/",
+        ]
+
+    def tearDown(self: "ConditionalGetTest") -> None:
+        Order.objects.all().delete()
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def test_not_modified_without_loading_data(self) -> None:
+        """A matching If-None-Match is answered with 304 before any data is read"""
+        self.assertTrue(self.login(), "Login failed")
+        for endpoint in self.endpoints:
+            response = self.client.get(endpoint)
+            self.assertEqual(response.status_code, 200, response.content)
+            etag = response["ETag"]
+            self.assertFalse(etag.startswith("W/"))
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(endpoint, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, endpoint)
+            self.assertEqual(response.content, b"")
+            for query in context.captured_queries:
+                self.assertNotIn("api_order", query["sql"])
+                self.assertNotIn("api_dish", query["sql"])
+
+    def test_no_last_modified(self) -> None:
+        """Changes are only validated by ETag, If-Modified-Since is ignored"""
+        self.assertTrue(self.login(), "Login failed")
+        for endpoint in self.endpoints:
+            response = self.client.get(endpoint)
+            self.assertFalse(response.has_header("Last-Modified"), endpoint)
+            response = self.client.get(
+                endpoint, HTTP_IF_MODIFIED_SINCE="Fri, 01 Jan 2100 00:00:00 GMT"
+            )
+            self.assertEqual(response.status_code, 200, endpoint)
+
+    def test_pages_have_different_etags(self) -> None:
+        """Different pages and ranges of a listing do not share an ETag"""
+        self.assertTrue(self.login(), "Login failed")
+        endpoint = self.endpoints[1]
+        etags = {
+            self.client.get(f"{endpoint}?{query}")["ETag"]
+            for query in ["", "limit=1", "from=2024-01-01"]
+        }
+        self.assertEqual(len(etags), 3)
+
+    def test_changes_change_etag(self) -> None:
+        """Adding or completing an order and editing the menu change the ETags"""
+        self.assertTrue(self.login(), "Login failed")
+        base = f"/api/stores/{self.store.id}"
+        changes = [
+            (
+                f"{base}/orders/add",
+                {"dishes": [{"id": self.dish.id, "quantity": 1}]},
+                self.endpoints[1:],
+            ),
+            (
+                f"{base}/orders/{self.order.id}/complete",
+                {"is_completed": True},
+                self.endpoints[1:],
+            ),
+            # Orders show the names and prices of their dishes
+            (f"{base}/dishes/{self.dish.id}/edit", {"price": 1}, self.endpoints),
+        ]
+        for endpoint, body, affected in changes:
+            etags = {url: self.client.get(url)["ETag"] for url in affected}
+            response = self.client.post(endpoint, body, content_type="application/json")
+            self.assertEqual(response.status_code, 200, response.content)
+            for url, etag in etags.items():
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200, url)
+                self.assertNotEqual(response["ETag"], etag)
+
+    def test_other_users_store_is_not_found(self) -> None:
+        """Conditional headers do not bypass the ownership check"""
+        other = User.objects.create_user(username="other", password="password")
+        self.client.force_login(other)
+        for endpoint in self.endpoints:
+            response = self.client.get(endpoint, HTTP_IF_NONE_MATCH="*")
+            self.assertEqual(response.status_code, 404, endpoint)
+
+
+class OrderEventBrokerTest(TestCase):
+    async def test_publish_and_resume(self) -> None:
+        """Subscribers get new events and can resume after a reconnect"""
+        broker = OrderEventBroker()
+        self.assertIsNone(broker.publish(1, "order.created", {"id": 1}))
+
+        subscriber = broker.subscribe(1)
+        first = broker.publish(1, "order.created", {"id": 1})
+        self.assertEqual(await subscriber.queue.get(), first)
+        broker.unsubscribe(subscriber)
+
+        # Events are kept while the client reconnects
+        second = broker.publish(1, "order.completed", {"id": 1})
+        resumed = broker.subscribe(1, first.id)
+        self.assertEqual(resumed.backlog, [second])
+        self.assertEqual(broker.subscribe(1, second.id).backlog, [])
+
+    async def test_resume_from_unknown_event(self) -> None:
+        """Resuming from an event that is no longer kept asks for a refetch"""
+        broker = OrderEventBroker()
+        subscriber = broker.subscribe(1, broker.last_id - 10)
+        self.assertEqual([event.name for event in subscriber.backlog], ["reset"])
+
+    @override_settings(ORDER_STREAM_QUEUE_SIZE=2)
+    async def test_slow_subscriber_is_closed(self) -> None:
+        """A client that does not keep up is disconnected"""
+        broker = OrderEventBroker()
+        subscriber = broker.subscribe(1)
+        for i in range(3):
+            broker.publish(1, "order.created", {"id": i})
+        await asyncio.sleep(0)
+        self.assertIsNone(await subscriber.queue.get())
+        self.assertTrue(subscriber.closed)
+
+    def test_event_encoding(self) -> None:
+        """Events are formatted as Server-Sent Events messages"""
+        self.assertEqual(
+            Event(7, "order.completed", {"id": 1}).encode(),
+            b'id: 7\nevent: order.completed\ndata: {"id": 1}\n\n',
+        )
+
+
+class OrderStreamTest(StoreTestCase):
+    def setUp(self: "OrderStreamTest") -> None:
+        super().setUp()
+        self.endpoint = f"/api/stores/{self.store.id}/orders/stream"
+        self.dish = Dish.objects.create(
+            name="Ramen", description="", price=100, store=self.store
+        )
+
+    def tearDown(self: "OrderStreamTest") -> None:
+        Order.objects.all().delete()
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def test_stream_fail_no_login(self) -> None:
+        """Users who are not logged in cannot open the stream"""
+        response = self.client.get(self.endpoint)
+        self.assertEqual(response.status_code, 302)
+
+    def test_stream_fail_wsgi(self) -> None:
+        """The stream is refused instead of hanging a WSGI worker"""
+        self.assertTrue(self.login(), "Login failed")
+        response = self.client.get(self.endpoint)
+        self.assertEqual(response.status_code, 501)
+
+    async def test_stream_receives_orders(self) -> None:
+        """New and completed orders are pushed to the open stream"""
+        await sync_to_async(self.async_client.force_login)(self.user1)
+        response = await self.async_client.get(self.endpoint)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        chunks = response.streaming_content
+        self.assertTrue((await chunks.__anext__()).startswith(b"retry:"))
+
+        response = await self.async_client.post(
+            f"/api/stores/{self.store.id}/orders/add",
+            {"dishes": [{"id": self.dish.id, "quantity": 1}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        order = await Order.objects.aget()
+        created = await asyncio.wait_for(chunks.__anext__(), 5)
+        self.assertIn(b"event: order.created", created)
+        self.assertIn(f'"id": {order.id}'.encode(), created)
+
+        response = await self.async_client.post(
+            f"/api/stores/{self.store.id}/orders/{order.id}/complete",
+            {"is_completed": True},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        completed = await asyncio.wait_for(chunks.__anext__(), 5)
+        self.assertIn(b"event: order.completed", completed)
+        await chunks.aclose()
+
+
+class AsyncViewsTest(StoreTestCase):
+    def setUp(self: "AsyncViewsTest") -> None:
+        super().setUp()
+        self.factory = RequestFactory()
+        self.async_factory = AsyncRequestFactory()
+        dishes = []
+        for i in range(3):
+            dish = Dish.objects.create(
+                name=f"Dish {i}", description="", price=100, store=self.store
+            )
+            DishModifier.objects.create(name=f"Mod {i}", price=10, dish=dish)
+            dishes.append(dish)
+        for _ in range(3):
+            order = Order.objects.create(
+                is_online=False,
+                is_completed=False,
+                created_at=timezone.now(),
+                store=self.store,
+            )
+            for dish in dishes:
+                relation = OrderDishRelation.objects.create(
+                    order=order, dish=dish, quantity=1, other_comments=""
+                )
+                relation.modifiers.set(DishModifier.objects.filter(dish=dish))
+        self.order = order
+        base = f"/api/stores/{self.store.id}"
+        self.cases = [
+            (views.orders, async_views.orders, f"{base}/orders/", {}),
+            (
+                views.order_by_id,
+                async_views.order_by_id,
+                f"{base}/orders/{self.order.id}/",
+                {"order_id": self.order.id},
+            ),
+            (views.get_dishes, async_views.get_dishes, f"{base}/dishes/", {}),
+        ]
+
+    def tearDown(self: "AsyncViewsTest") -> None:
+        Order.objects.all().delete()
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def sync_get(self: "AsyncViewsTest", view, path: str, **kwargs) -> HttpResponse:
+        """Call a sync view as the logged in user"""
+        request = self.factory.get(path)
+        request.user = self.user1
+        return view(request, **kwargs)
+
+    async def async_get(
+        self: "AsyncViewsTest", view, path: str, headers: dict = {}, **kwargs
+    ) -> HttpResponse:
+        """Call an async view as the logged in user"""
+        request = self.async_factory.get(path, headers=headers)
+        request.user = self.user1
+        return await view(request, **kwargs)
+
+    async def test_async_views_match_sync_views(self) -> None:
+        """The async views return the same responses as the sync views"""
+        for sync_view, async_view, path, kwargs in self.cases:
+            get_cache().clear()
+            expected = await sync_to_async(self.sync_get)(
+                sync_view, path, store_id=self.store.id, **kwargs
+            )
+            get_cache().clear()
+            response = await self.async_get(
+                async_view, path, store_id=self.store.id, **kwargs
+            )
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(json.loads(response.content), json.loads(expected.content))
+
+        expected = await sync_to_async(self.sync_get)(views.get_stores, "/api/stores/")
+        response = await self.async_get(async_views.get_stores, "/api/stores/")
+        self.assertEqual(json.loads(response.content), json.loads(expected.content))
+
+    async def test_async_views_not_modified(self) -> None:
+        """The async views answer matching conditional requests with 304"""
+        for _, async_view, path, kwargs in self.cases:
+            response = await self.async_get(
+                async_view, path, store_id=self.store.id, **kwargs
+            )
+            response = await self.async_get(
+                async_view,
+                path,
+                headers={"If-None-Match": response["ETag"]},
+                store_id=self.store.id,
+                **kwargs,
+            )
+            self.assertEqual(response.status_code, 304, path)
+
+    async def test_async_views_use_async_cache(self) -> None:
+        """The async views do not call the blocking cache helpers"""
+        blocked = mock.Mock(side_effect=AssertionError("blocking cache call"))
+        with mock.patch("api.cache.get_version", blocked), mock.patch(
+            "api.conditional.get_version", blocked
+        ):
+            for _, async_view, path, kwargs in self.cases:
+                response = await self.async_get(
+                    async_view, path, store_id=self.store.id, **kwargs
+                )
+                self.assertEqual(response.status_code, 200, path)
+        blocked.assert_not_called()
+
+    async def test_async_views_fail(self) -> None:
+        """The async views check the method, the login and the store owner"""
+        path = f"/api/stores/{self.store.id}/orders/"
+        request = self.async_factory.post(path)
+        request.user = self.user1
+        response = await async_views.orders(request, store_id=self.store.id)
+        self.assertEqual(response.status_code, 405)
+
+        request = self.async_factory.get(path)
+        request.user = AnonymousUser()
+        response = await async_views.orders(request, store_id=self.store.id)
+        self.assertEqual(response.status_code, 302)
+
+        response = await self.async_get(
+            async_views.orders, path, store_id=self.store.id + 1
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportOrdersTest(StoreTestCase):
+    def setUp(self: "ExportOrdersTest") -> None:
+        super().setUp()
+        self.endpoint = f"/api/stores/{self.store.id}/orders/export"
+        self.dish = Dish.objects.create(
+            name="Ramen", description="", price=1000, store=self.store
+        )
+        self.modifier = DishModifier.objects.create(
+            name="Egg", price=200, dish=self.dish
+        )
+        start = datetime(2024, 3, 1, 12, tzinfo=dt_timezone.utc)
+        self.orders = []
+        for i in range(5):
+            order = Order.objects.create(
+                is_online=False,
+                is_completed=i % 2 == 0,
+                created_at=start + timedelta(days=i),
+                store=self.store,
+            )
+            relation = OrderDishRelation.objects.create(
+                order=order, dish=self.dish, quantity=2, other_comments="Extra hot"
+            )
+            relation.modifiers.set([self.modifier])
+            self.orders.append(order)
+
+    def tearDown(self: "ExportOrdersTest") -> None:
+        Order.objects.all().delete()
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def export(self: "ExportOrdersTest", query: str) -> HttpResponse:
+        """Request an export and check that it is streamed"""
+        response = self.client.get(f"{self.endpoint}?{query}")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response
+
+    def test_export_ndjson(self) -> None:
+        """Orders in the range are exported one JSON object per line"""
+        self.assertTrue(self.login(), "Login failed")
+        response = self.export("from=2024-03-02&to=2024-03-04")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        records = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual(
+            [record["id"] for record in records],
+            [order.id for order in self.orders[1:4]],
+        )
+        self.assertEqual(
+            records[0]["lines"],
+            [
+                {
+                    "dish_id": self.dish.id,
+                    "dish": "Ramen",
+                    "price": 1000,
+                    "quantity": 2,
+                    "other_comments": "Extra hot",
+                    "modifiers": [
+                        {"id": self.modifier.id, "name": "Egg", "price": 200}
+                    ],
+                }
+            ],
+        )
+
+    def test_export_csv(self) -> None:
+        """Orders are exported one CSV row per line"""
+        self.assertTrue(self.login(), "Login failed")
+        response = self.export("from=2024-03-01&to=2024-03-05&format=csv")
+        rows = list(
+            csv.reader(b"".join(response.streaming_content).decode().splitlines())
+        )
+        self.assertEqual(rows[0][0], "order_id")
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(
+            rows[1],
+            [
+                str(self.orders[0].id),
+                self.orders[0].created_at.isoformat(),
+                "False",
+                "True",
+                str(self.dish.id),
+                "Ramen",
+                "1000",
+                "2",
+                "Egg",
+                "200",
+                "2400",
+                "Extra hot",
+            ],
+        )
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_queries_per_chunk(self) -> None:
+        """Orders are fetched a chunk at a time with a fixed number of queries"""
+        store = Store.objects.get(id=self.store.id)
+        start = datetime(2024, 3, 1, tzinfo=dt_timezone.utc)
+        end = datetime(2024, 3, 6, tzinfo=dt_timezone.utc)
+        # Three chunks of orders, lines and modifiers, and the empty last chunk
+        with self.assertNumQueries(10):
+            orders = list(iter_orders(store, start, end))
+        self.assertEqual(orders, self.orders)
+
+    def test_export_fail_invalid_format(self) -> None:
+        """Unknown formats are rejected"""
+        self.assertTrue(self.login(), "Login failed")
+        response = self.client.get(f"{self.endpoint}?format=xml")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "Invalid format"})
+
+    def test_export_command(self) -> None:
+        """The management command writes the same export"""
+        output = StringIO()
+        call_command(
+            "export_orders",
+            self.store.id,
+            "--from=2024-03-01",
+            "--to=2024-03-05",
+            stdout=output,
+        )
+        self.assertEqual(len(output.getvalue().splitlines()), 5)
+
+
+class SalesRollupTest(StoreTestCase):
+    def setUp(self: "SalesRollupTest") -> None:
+        super().setUp()
+        self.store.timezone = "Asia/Singapore"
+        self.store.save()
+        self.endpoint = f"/api/stores/{self.store.id}/analytics"
+        self.ramen = Dish.objects.create(
+            name="Ramen", description="", price=1000, store=self.store
+        )
+        self.gyoza = Dish.objects.create(
+            name="Gyoza", description="", price=500, store=self.store
+        )
+        self.egg = DishModifier.objects.create(name="Egg", price=200, dish=self.ramen)
+
+    def tearDown(self: "SalesRollupTest") -> None:
+        Order.objects.all().delete()
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def place(
+        self: "SalesRollupTest", created_at: datetime, lines: list, completed=False
+    ) -> Order:
+        """Create an order the way add_order does"""
+        cart = resolve_cart(self.store, lines)
+        return create_order(self.store, cart, False, completed, created_at=created_at)
+
+    def seed(self: "SalesRollupTest") -> None:
+        """Orders on both sides of local midnight over a few days"""
+        # 15:59 UTC is 23:59 in Singapore, 16:01 UTC is the next local day
+        for day, minute in [(1, 0), (1, 59), (1, 61), (2, 30), (3, 0)]:
+            created_at = datetime(2024, 3, day, 15, tzinfo=dt_timezone.utc)
+            self.place(
+                created_at + timedelta(minutes=minute),
+                [
+                    {"id": self.ramen.id, "quantity": day, "modifier": [self.egg.id]},
+                    {"id": self.gyoza.id, "quantity": 2},
+                    {"id": self.gyoza.id, "quantity": 1},
+                ][: 1 + minute % 3],
+                completed=minute == 0,
+            )
+
+    def brute_force(self: "SalesRollupTest", first: str, last: str) -> dict:
+        """Recompute the analytics from the orders"""
+        tz = store_timezone(self.store)
+        days, dishes = {}, {}
+        for order in Order.objects.filter(store=self.store):
+            day = timezone.localtime(order.created_at, tz).date().isoformat()
+            if not first <= day <= last:
+                continue
+            totals = days.setdefault(
+                day, {"day": day, "orders": 0, "completed": 0, "revenue": 0}
+            )
+            totals["orders"] += 1
+            totals["completed"] += int(order.is_completed)
+            seen = set()
+            for line in order.orderdishrelation_set.all():
+                price = line.dish.price + sum(m.price for m in line.modifiers.all())
+                entry = dishes.setdefault(
+                    line.dish_id,
+                    {
+                        "id": line.dish_id,
+                        "name": line.dish.name,
+                        "orders": 0,
+                        "quantity": 0,
+                        "revenue": 0,
+                    },
+                )
+                entry["orders"] += line.dish_id not in seen
+                entry["quantity"] += line.quantity
+                entry["revenue"] += price * line.quantity
+                totals["revenue"] += price * line.quantity
+                seen.add(line.dish_id)
+        daily = sorted(days.values(), key=lambda day: day["day"])
+        return {
+            "from": first,
+            "to": last,
+            "days": daily,
+            "totals": {
+                key: sum(day[key] for day in daily)
+                for key in ["orders", "completed", "revenue"]
+            },
+            "top_dishes": sorted(
+                dishes.values(), key=lambda dish: (-dish["revenue"], dish["id"])
+            ),
+        }
+
+    def analytics(self: "SalesRollupTest", query: str) -> dict:
+        response = self.client.get(f"{self.endpoint}?{query}")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()["data"]
+
+    def test_analytics_matches_brute_force(self) -> None:
+        """The rollups kept by create_order match recomputing from the orders"""
+        self.seed()
+        self.assertTrue(self.login(), "Login failed")
+        for first, last in [
+            ("2024-03-01", "2024-03-04"),
+            ("2024-03-02", "2024-03-02"),
+            ("2024-03-03", "2024-03-04"),
+        ]:
+            self.assertEqual(
+                self.analytics(f"from={first}&to={last}"),
+                self.brute_force(first, last),
+            )
+
+    def test_analytics_does_not_scan_orders(self) -> None:
+        """Range queries are answered from the rollup tables alone"""
+        self.seed()
+        self.assertTrue(self.login(), "Login failed")
+        with CaptureQueriesContext(connection) as context:
+            self.analytics("from=2024-03-01&to=2024-03-04")
+        for query in context.captured_queries:
+            self.assertNotIn('"api_order"', query["sql"])
+            self.assertNotIn('"api_orderdishrelation"', query["sql"])
+
+    def test_analytics_top(self) -> None:
+        """Top dishes are limited to ?top="""
+        self.seed()
+        self.assertTrue(self.login(), "Login failed")
+        data = self.analytics("from=2024-03-01&to=2024-03-04&top=1")
+        self.assertEqual([dish["id"] for dish in data["top_dishes"]], [self.ramen.id])
+        response = self.client.get(f"{self.endpoint}?top=many")
+        self.assertEqual(response.status_code, 400)
+
+    def test_rollups_follow_endpoints(self) -> None:
+        """Orders added and completed through the API update the rollups"""
+        self.assertTrue(self.login(), "Login failed")
+        response = self.client.post(
+            f"/api/stores/{self.store.id}/orders/add",
+            {
+                "isOnline": True,
+                "dishes": [
+                    {"id": self.ramen.id, "quantity": 2, "modifier": [self.egg.id]}
+                ],
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        order = Order.objects.get()
+        complete = f"/api/stores/{self.store.id}/orders/{order.id}/complete"
+        for is_completed in [True, True]:
+            self.client.post(
+                complete, {"is_completed": is_completed}, "application/json"
+            )
+
+        today = local_today(self.store).isoformat()
+        data = self.analytics("")
+        self.assertEqual(data, self.brute_force(today, today))
+        self.assertEqual(data["totals"], {"orders": 1, "completed": 1, "revenue": 2400})
+
+        self.client.post(complete, {"is_completed": False}, "application/json")
+        self.assertEqual(self.analytics("")["totals"]["completed"], 0)
+
+    def test_backfill_command(self) -> None:
+        """The backfill recomputes rollups for orders written without them"""
+        self.seed()
+        self.assertTrue(self.login(), "Login failed")
+        expected = self.brute_force("2024-03-01", "2024-03-04")
+        DailySales.objects.all().delete()
+        DailyDishSales.objects.all().delete()
+        # Orders inserted behind the API's back are picked up too
+        Order.objects.bulk_create(
+            [
+                Order(
+                    store=self.store,
+                    is_online=False,
+                    is_completed=True,
+                    created_at=datetime(2024, 3, 2, tzinfo=dt_timezone.utc),
+                )
+            ]
+        )
+        self.assertEqual(self.analytics("from=2024-03-01&to=2024-03-04")["days"], [])
+
+        call_command("backfill_rollups", f"--store={self.store.id}", stdout=StringIO())
+        data = self.analytics("from=2024-03-01&to=2024-03-04")
+        self.assertNotEqual(data, expected)
+        self.assertEqual(data, self.brute_force("2024-03-01", "2024-03-04"))
+
+        # Rebuilding a range again leaves the totals unchanged
+        call_command(
+            "backfill_rollups",
+            "--from=2024-03-02",
+            "--to=2024-03-02",
+            stdout=StringIO(),
+        )
+        self.assertEqual(self.analytics("from=2024-03-01&to=2024-03-04"), data)
+
+
+class StoreOwnershipCacheTest(StoreTestCase):
+    def setUp(self: "StoreOwnershipCacheTest") -> None:
+        super().setUp()
+        self.user2 = User.objects.create_user(username="other", password="other")
+
+    def test_get_store_cached(self) -> None:
+        """Ownership is checked against the database once"""
+        with self.assertNumQueries(1):
+            self.assertEqual(get_store(self.user1, self.store.id), self.store)
+        with self.assertNumQueries(0):
+            store = get_store(self.user1, self.store.id)
+        self.assertEqual(store.name, self.store_name)
+        with self.assertNumQueries(1):
+            self.assertIsNone(get_store(self.user2, self.store.id))
+
+    def test_request_store_resolved_once(self) -> None:
+        """A request resolves each store at most once"""
+        request = RequestFactory().get("/")
+        request.user = self.user1
+        with self.assertNumQueries(1):
+            request_store(request, self.store.id)
+            reset_ownership_cache()
+            self.assertEqual(request_store(request, self.store.id), self.store)
+
+    def test_invalidated_on_reassign(self) -> None:
+        """A store given to another user is no longer served to the old owner"""
+        get_store(self.user1, self.store.id)
+        store = Store.objects.get(id=self.store.id)
+        store.user = self.user2
+        store.save()
+        self.assertIsNone(get_store(self.user1, self.store.id))
+        self.assertEqual(get_store(self.user2, self.store.id), self.store)
+
+    def test_invalidated_on_edit_and_delete(self) -> None:
+        """Edited stores are reloaded and deleted stores are forgotten"""
+        get_store(self.user1, self.store.id)
+        Store.objects.filter(id=self.store.id).get().delete()
+        self.assertIsNone(get_store(self.user1, self.store.id))
+
+        store = Store.objects.create(name="New", description="", user=self.user1)
+        get_store(self.user1, store.id)
+        store.name = "Renamed"
+        store.save()
+        self.assertEqual(get_store(self.user1, store.id).name, "Renamed")
+
+    def test_endpoint_skips_store_query(self) -> None:
+        """Repeated API requests do not look the store up again"""
+        self.assertTrue(self.login(), "Login failed")
+        endpoint = f"/api/stores/{self.store.id}/dishes/"
+        self.client.get(endpoint)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(endpoint)
+        self.assertEqual(response.status_code, 200)
+        for query in context.captured_queries:
+            self.assertNotIn('FROM "api_store"', query["sql"])
+
+    @override_settings(STORE_CACHE_ALIAS="default")
+    def test_shared_backend(self) -> None:
+        """Entries can be kept in a shared cache instead"""
+        reset_ownership_cache()
+        get_store(self.user1, self.store.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_store(self.user1, self.store.id), self.store)
+        self.store.user = self.user2
+        self.store.save()
+        self.assertIsNone(get_store(self.user1, self.store.id))
+        reset_ownership_cache()
+
+    def test_local_lru_and_ttl(self) -> None:
+        """The local cache evicts the least recently used and expired entries"""
+        cache = LocalOwnershipCache(size=2, ttl=60)
+        stores = [
+            Store(id=i, name=f"Store {i}", description="", user=self.user1)
+            for i in range(3)
+        ]
+        cache.set(stores[0])
+        cache.set(stores[1])
+        cache.get(self.user1.id, 0)
+        cache.set(stores[2])
+        self.assertIsNotNone(cache.get(self.user1.id, 0))
+        self.assertIsNone(cache.get(self.user1.id, 1))
+        self.assertIsNotNone(cache.get(self.user1.id, 2))
+
+        expired = LocalOwnershipCache(size=2, ttl=0)
+        expired.set(stores[0])
+        self.assertIsNone(expired.get(self.user1.id, 0))
+
+
+class BulkMenuTest(StoreTestCase):
+    def setUp(self: "BulkMenuTest") -> None:
+        super().setUp()
+        self.endpoint = f"/api/stores/{self.store.id}/dishes/bulk"
+        self.ramen = Dish.objects.create(
+            name="Ramen", description="", price=1000, store=self.store
+        )
+        self.egg = DishModifier.objects.create(name="Egg", price=200, dish=self.ramen)
+        self.nori = DishModifier.objects.create(name="Nori", price=50, dish=self.ramen)
+
+    def tearDown(self: "BulkMenuTest") -> None:
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def post(self: "BulkMenuTest", operations: list, status: int = 200) -> list:
+        response = self.client.post(
+            self.endpoint, {"operations": operations}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()["data" if status == 200 else "results"]
+
+    def creates(self: "BulkMenuTest", count: int, prefix: str) -> list:
+        return [
+            {
+                "op": "create_dish",
+                "name": f"{prefix} {i}",
+                "price": 100 + i,
+                "modifiers": [{"name": "Large", "price": 50}],
+            }
+            for i in range(count)
+        ]
+
+    def test_bulk_create_query_count_independent_of_size(self) -> None:
+        """Creating a whole menu takes as many queries as creating one dish"""
+        self.assertTrue(self.login(), "Login failed")
+        self.post(self.creates(1, "Warm"))
+        with CaptureQueriesContext(connection) as small:
+            self.post(self.creates(3, "Small"))
+        # Large enough to matter while fitting in one batch of SQLite parameters
+        with CaptureQueriesContext(connection) as large:
+            results = self.post(self.creates(100, "Large"))
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(Dish.objects.filter(name__startswith="Large").count(), 100)
+        self.assertEqual(
+            DishModifier.objects.filter(dish__name__startswith="Large").count(), 100
+        )
+        self.assertEqual(
+            sorted(result["id"] for result in results),
+            sorted(
+                Dish.objects.filter(name__startswith="Large").values_list(
+                    "id", flat=True
+                )
+            ),
+        )
+
+    def test_bulk_mixed_operations(self) -> None:
+        """Updates, deletes and modifier changes are applied together"""
+        gyoza = Dish.objects.create(
+            name="Gyoza", description="", price=500, store=self.store
+        )
+        self.assertTrue(self.login(), "Login failed")
+        results = self.post(
+            [
+                {"op": "update_dish", "id": self.ramen.id, "price": 1100},
+                {"op": "delete_dish", "id": gyoza.id},
+                {
+                    "op": "create_modifier",
+                    "dish_id": self.ramen.id,
+                    "name": "Chili",
+                    "price": 0,
+                },
+                {"op": "update_modifier", "id": self.egg.id, "is_available": False},
+                {"op": "delete_modifier", "id": self.nori.id},
+                {"op": "create_dish", "name": "Tonkotsu", "price": 1200},
+            ]
+        )
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["updated", "deleted", "created", "updated", "deleted", "created"],
+        )
+        self.ramen.refresh_from_db()
+        self.assertEqual(self.ramen.price, 1100)
+        self.assertFalse(Dish.objects.filter(id=gyoza.id).exists())
+        self.assertEqual(
+            sorted(
+                (modifier.name, modifier.is_available)
+                for modifier in self.ramen.get_modifiers()
+            ),
+            [("Chili", True), ("Egg", False)],
+        )
+        self.assertEqual(Dish.objects.get(id=results[5]["id"]).name, "Tonkotsu")
+
+    def test_bulk_fail_rejects_every_operation(self) -> None:
+        """One invalid operation rejects the request with a result per item"""
+        other_store = Store.objects.create(
+            name="Other", description="", user=self.user1
+        )
+        other_dish = Dish.objects.create(
+            name="Other", description="", price=1, store=other_store
+        )
+        self.assertTrue(self.login(), "Login failed")
+        results = self.post(
+            [
+                {"op": "create_dish", "name": "Udon", "price": 900},
+                {"op": "create_dish", "name": "Soba"},
+                {"op": "update_dish", "id": other_dish.id, "price": 2},
+                {"op": "create_dish", "name": "Ramen", "price": 1},
+                {"op": "delete_dish", "id": self.ramen.id},
+                {"op": "update_dish", "id": self.ramen.id, "price": 1},
+                {"op": "bake"},
+            ],
+            status=400,
+        )
+        self.assertEqual(
+            results,
+            [
+                {"index": 0, "status": "created"},
+                {"index": 1, "status": "error", "error": "Missing parameter: price"},
+                {"index": 2, "status": "error", "error": "Dish not found"},
+                {"index": 3, "status": "created"},
+                {"index": 4, "status": "deleted", "id": self.ramen.id},
+                {"index": 5, "status": "error", "error": "Conflicting operations"},
+                {"index": 6, "status": "error", "error": "Invalid operation"},
+            ],
+        )
+        self.assertFalse(Dish.objects.filter(name="Udon").exists())
+        self.assertTrue(Dish.objects.filter(id=self.ramen.id).exists())
+
+    def test_bulk_fail_invalid_ids(self) -> None:
+        """Ids that are not integers are rejected per operation"""
+        self.assertTrue(self.login(), "Login failed")
+        results = self.post(
+            [
+                {"op": "update_dish", "id": [1], "price": 2},
+                {"op": "delete_dish", "id": "abc"},
+                {"op": "update_modifier", "id": {}, "price": 2},
+                {"op": "delete_modifier", "id": True},
+                {"op": "create_modifier", "dish_id": [], "name": "Nori", "price": 1},
+                {"op": "create_dish", "name": "Udon", "price": 1},
+                {"op": "create_dish", "name": "Udon", "price": 1},
+                {"op": "delete_dish", "id": self.ramen.id, "name": []},
+            ],
+            status=400,
+        )
+        self.assertEqual(
+            [result.get("error") for result in results],
+            ["Invalid parameter: id"] * 4
+            + ["Invalid parameter: dish_id"]
+            + ["Dish already exists, please use a different name"] * 2
+            + [None],
+        )
+
+    def test_bulk_fail_duplicate_names(self) -> None:
+        """Dish names stay unique within the store"""
+        self.assertTrue(self.login(), "Login failed")
+        results = self.post(
+            [
+                {"op": "create_dish", "name": "Ramen", "price": 1},
+                {"op": "create_dish", "name": "Udon", "price": 1},
+                {"op": "create_dish", "name": "Udon", "price": 2},
+            ],
+            status=400,
+        )
+        self.assertEqual(
+            [result["status"] for result in results], ["error", "error", "error"]
+        )
+
+    def test_bulk_invalidates_menu_cache(self) -> None:
+        """The menu is served fresh after a bulk change"""
+        self.assertTrue(self.login(), "Login failed")
+        menu = f"/api/stores/{self.store.id}/dishes/"
+        self.client.get(menu)
+        self.post([{"op": "update_dish", "id": self.ramen.id, "name": "Shoyu"}])
+        response = self.client.get(menu)
+        self.assertEqual(response["X-Menu-Cache"], "miss")
+        self.assertEqual(response.json()["data"][0]["name"], "Shoyu")
+
+
+class BulkAvailabilityTest(StoreTestCase):
+    def setUp(self: "BulkAvailabilityTest") -> None:
+        super().setUp()
+        self.endpoint = f"/api/stores/{self.store.id}/dishes/available"
+        self.dishes = [
+            Dish.objects.create(name=name, description="", price=100, store=self.store)
+            for name in ["Egg Fried Rice", "Ramen", "Gyoza", "Tamago"]
+        ]
+        self.egg = DishModifier.objects.create(
+            name="Extra egg", price=50, dish=self.dishes[1]
+        )
+        self.nori = DishModifier.objects.create(
+            name="Nori", price=50, dish=self.dishes[1]
+        )
+        other_store = Store.objects.create(
+            name="Other", description="", user=self.user1
+        )
+        self.other = Dish.objects.create(
+            name="Egg Tart", description="", price=100, store=other_store
+        )
+
+    def tearDown(self: "BulkAvailabilityTest") -> None:
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def post(self: "BulkAvailabilityTest", body: dict, status: int = 200) -> dict:
+        response = self.client.post(
+            self.endpoint, body, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def test_bulk_available_by_match_and_ids(self) -> None:
+        """Dishes and modifiers are picked by name match and by id"""
+        self.assertTrue(self.login(), "Login failed")
+        data = self.post(
+            {
+                "is_available": False,
+                "dishes": {"ids": [self.dishes[3].id], "match": "egg"},
+                "modifiers": {"match": "EGG"},
+            }
+        )["data"]
+        self.assertEqual(
+            data,
+            {
+                "dishes": [self.dishes[0].id, self.dishes[3].id],
+                "modifiers": [self.egg.id],
+            },
+        )
+        self.assertEqual(
+            list(Dish.objects.filter(is_available=False).values_list("id", flat=True)),
+            [self.dishes[0].id, self.dishes[3].id],
+        )
+        self.nori.refresh_from_db()
+        self.assertTrue(self.nori.is_available)
+
+        # Rows already in the wanted state are not reported again
+        data = self.post({"is_available": False, "dishes": {"match": "egg"}})["data"]
+        self.assertEqual(data, {"dishes": [], "modifiers": []})
+        data = self.post({"is_available": True, "dishes": {"match": "egg"}})["data"]
+        self.assertEqual(data, {"dishes": [self.dishes[0].id], "modifiers": []})
+
+    def test_bulk_available_one_update_per_table(self) -> None:
+        """Each table is written with a single UPDATE"""
+        self.assertTrue(self.login(), "Login failed")
+        self.post({"is_available": True, "dishes": {"match": "x"}})
+        with CaptureQueriesContext(connection) as context:
+            self.post(
+                {
+                    "is_available": False,
+                    "dishes": {"ids": [dish.id for dish in self.dishes]},
+                    "modifiers": {"ids": [self.egg.id, self.nori.id]},
+                }
+            )
+        updates = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith("UPDATE")
+        ]
+        self.assertEqual(len(updates), 2)
+        self.assertTrue(all('SET "is_available"' in sql for sql in updates))
+
+    def test_bulk_available_other_store_untouched(self) -> None:
+        """Dishes of other stores are never changed"""
+        self.assertTrue(self.login(), "Login failed")
+        data = self.post(
+            {"is_available": False, "dishes": {"ids": [self.other.id], "match": "egg"}}
+        )["data"]
+        self.assertNotIn(self.other.id, data["dishes"])
+        self.other.refresh_from_db()
+        self.assertTrue(self.other.is_available)
+
+    def test_bulk_available_fail_invalid(self) -> None:
+        """Requests without a state or a selection are rejected"""
+        self.assertTrue(self.login(), "Login failed")
+        self.post({"dishes": {"match": "egg"}}, status=400)
+        self.post({"is_available": False}, status=400)
+        self.post({"is_available": False, "dishes": {"ids": "1"}}, status=400)
+        for ids in [[[1]], ["abc"], [{}], [True]]:
+            self.post({"is_available": False, "modifiers": {"ids": ids}}, status=400)
+
+
+class ImageVariantTest(StoreTestCase):
+    def setUp(self: "ImageVariantTest") -> None:
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        # Generate the variants inline, worker threads cannot see the test's
+        # uncommitted rows
+        self.media = override_settings(MEDIA_ROOT=self.media_root, IMAGE_WORKERS=0)
+        self.media.enable()
+        buffer = BytesIO()
+        Image.new("RGB", (2000, 1000), (200, 80, 40)).save(buffer, "PNG")
+        self.original = buffer.getvalue()
+        self.image = default_storage.save(
+            "dishes/ramen.png", ContentFile(self.original)
+        )
+
+    def tearDown(self: "ImageVariantTest") -> None:
+        Dish.objects.all().delete()
+        self.media.disable()
+        shutil.rmtree(self.media_root)
+        return super().tearDown()
+
+    def add_dish(self: "ImageVariantTest", image: str) -> Dish:
+        """Add a dish with the image through the API and wait for its variants"""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f"/api/stores/{self.store.id}/dishes/add",
+                {"name": "Ramen", "price": 1000, "image": image},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        wait_for_variants()
+        return Dish.objects.get(name="Ramen")
+
+    def test_variants_generated_on_upload(self) -> None:
+        """Resized WebP and JPEG variants are written next to the original"""
+        self.assertTrue(self.login(), "Login failed")
+        dish = self.add_dish(self.image)
+        self.assertEqual(
+            dish.image_variants,
+            {
+                "thumb": {
+                    "webp": "dishes/ramen.thumb.webp",
+                    "jpeg": "dishes/ramen.thumb.jpeg",
+                },
+                "medium": {
+                    "webp": "dishes/ramen.medium.webp",
+                    "jpeg": "dishes/ramen.medium.jpeg",
+                },
+            },
+        )
+        with default_storage.open("dishes/ramen.thumb.webp") as file:
+            thumb = Image.open(file)
+            self.assertEqual((thumb.format, thumb.size), ("WEBP", (160, 80)))
+        self.assertLess(
+            default_storage.size("dishes/ramen.medium.webp") * 10, len(self.original)
+        )
+
+    def test_variant_urls_in_menu(self) -> None:
+        """The menu lists the URLs of the variants once they are ready"""
+        self.assertTrue(self.login(), "Login failed")
+        self.client.get(f"/api/stores/{self.store.id}/dishes/")
+        self.add_dish(self.image)
+        data = self.client.get(f"/api/stores/{self.store.id}/dishes/").json()["data"]
+        self.assertEqual(
+            data[0]["image_variants"]["thumb"]["webp"],
+            "/media/dishes/ramen.thumb.webp",
+        )
+
+    def test_variants_follow_bulk_image_change(self) -> None:
+        """Images set through the bulk menu endpoint get variants too"""
+        dish = Dish.objects.create(
+            name="Gyoza", description="", price=500, store=self.store
+        )
+        self.assertTrue(self.login(), "Login failed")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                f"/api/stores/{self.store.id}/dishes/bulk",
+                {
+                    "operations": [
+                        {"op": "update_dish", "id": dish.id, "image": self.image}
+                    ]
+                },
+                content_type="application/json",
+            )
+        wait_for_variants()
+        dish.refresh_from_db()
+        self.assertEqual(sorted(dish.to_dict()["image_variants"]), ["medium", "thumb"])
+
+    def test_replaced_variants_are_deleted(self) -> None:
+        """Changing or removing the image deletes the previous variants"""
+        self.assertTrue(self.login(), "Login failed")
+        dish = self.add_dish(self.image)
+        old = list(variant_files(dish.image_variants))
+        self.assertTrue(all(default_storage.exists(name) for name in old))
+
+        dish.image = default_storage.save("dishes/udon.png", ContentFile(self.original))
+        with self.captureOnCommitCallbacks(execute=True):
+            dish.save()
+        dish.refresh_from_db()
+        new = list(variant_files(dish.image_variants))
+        self.assertEqual(len(new), 4)
+        self.assertTrue(all(default_storage.exists(name) for name in new))
+        self.assertFalse(any(default_storage.exists(name) for name in old))
+
+        dish.image = ""
+        with self.captureOnCommitCallbacks(execute=True):
+            dish.save()
+        self.assertFalse(any(default_storage.exists(name) for name in new))
+
+    def test_workers_close_old_connections(self) -> None:
+        """Pool threads drop their connection around each image"""
+        with mock.patch.object(
+            images, "close_old_connections"
+        ) as close, mock.patch.object(images, "generate_variants") as generate:
+            images.generate_in_worker(Dish, 1, self.image)
+        generate.assert_called_once_with(Dish, 1, self.image)
+        self.assertEqual(close.call_count, 2)
+
+    def test_unreadable_image_is_skipped(self) -> None:
+        """Images Pillow cannot open are served without variants"""
+        name = default_storage.save("dishes/broken.png", ContentFile(b"not an image"))
+        self.assertTrue(self.login(), "Login failed")
+        with self.assertLogs("api.images", "ERROR"):
+            dish = self.add_dish(name)
+        self.assertEqual(dish.image_variants, {})
+
+
+class ConcurrentOrderTest(TransactionTestCase):
+    def setUp(self: "ConcurrentOrderTest") -> None:
+        super().setUp()
+        get_cache().clear()
+        reset_ownership_cache()
+        self.user = User.objects.create_user(username="pos", password="pos")
+        self.store = Store.objects.create(name="Store", description="", user=self.user)
+        self.dish = Dish.objects.create(
+            name="Ramen", description="", price=1000, store=self.store
+        )
+
+    def test_sqlite_profile_applied(self) -> None:
+        """Connections use WAL, relaxed syncing and a busy timeout"""
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertGreater(cursor.fetchone()[0], 0)
+
+    def test_transactions_take_write_lock(self) -> None:
+        """Transactions begin IMMEDIATE so that writers cannot deadlock"""
+        with CaptureQueriesContext(connection) as context:
+            with transaction.atomic():
+                Dish.objects.filter(id=self.dish.id).update(price=2000)
+        self.assertEqual(context.captured_queries[0]["sql"], "BEGIN IMMEDIATE")
+
+    def test_parallel_add_order(self) -> None:
+        """Orders posted from many devices at once are all written"""
+        threads, total = 8, 64
+        clients = []
+        for _ in range(threads):
+            clients.append(Client())
+            clients[-1].force_login(self.user)
+
+        def place(client: Client, count: int) -> list:
+            try:
+                return [
+                    client.post(
+                        f"/api/stores/{self.store.id}/orders/add",
+                        {"dishes": [{"id": self.dish.id, "quantity": 1}]},
+                        content_type="application/json",
+                    ).status_code
+                    for _ in range(count)
+                ]
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(threads) as pool:
+            # A "database is locked" error would be raised here
+            results = list(pool.map(place, clients, [total // threads] * threads))
+
+        self.assertEqual(
+            [status for result in results for status in result], [200] * total
+        )
+        self.assertEqual(Order.objects.filter(store=self.store).count(), total)
+        self.assertEqual(DailySales.objects.get(store=self.store).order_count, total)
+
+    def test_parallel_complete_order(self) -> None:
+        """An order completed from many devices at once is counted once"""
+        order = create_order(
+            self.store,
+            resolve_cart(self.store, [{"id": self.dish.id, "quantity": 1}]),
+            is_online=False,
+            is_completed=False,
+        )
+        threads = 8
+        clients = []
+        for _ in range(threads):
+            clients.append(Client())
+            clients[-1].force_login(self.user)
+
+        def complete(client: Client) -> int:
+            try:
+                return client.post(
+                    f"/api/stores/{self.store.id}/orders/{order.id}/complete",
+                    {"is_completed": True},
+                    content_type="application/json",
+                ).status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(threads) as pool:
+            results = list(pool.map(complete, clients))
+
+        self.assertEqual(results, [200] * threads)
+        sales = DailySales.objects.get(store=self.store)
+        self.assertEqual(sales.completed_count, 1)
+        order.refresh_from_db()
+        self.assertTrue(order.is_completed)
+        self.assertEqual(order.change_seq, 2)
+
+
+class EndpointBenchmarkTest(LoginTestCase):
+    def test_suite_covers_every_route(self) -> None:
+        """Every route of api.urls and auth.urls has a benchmark"""
+        store = seed_store(
+            self.user1, "Bench", dishes=10, modifiers=1, orders=5, lines=2, days=3
+        )
+        suite = endpoint_suite(self.user1, self.password, store)
+        self.assertEqual(set(route_labels()) - set(suite), set())
+
+    def test_seed_store_spreads_orders_over_days(self) -> None:
+        """Seeded orders cover the requested number of days"""
+        store = seed_store(
+            self.user1, "Bench", dishes=2, modifiers=1, orders=30, lines=1, days=30
+        )
+        days = {order.created_at.date() for order in Order.objects.filter(store=store)}
+        self.assertGreaterEqual(len(days), 29)
+
+    def test_compare_results(self) -> None:
+        """More queries or a markedly slower p95 are reported as regressions"""
+
+        def run(p95: float, queries: int) -> dict:
+            summary = {"p95_ms": p95, "queries_max": queries}
+            return {"scales": {"small": {"orders": summary}}}
+
+        baseline = run(10.0, 5)
+        self.assertEqual(compare_results(run(12.0, 5), baseline, 0.25), [])
+        self.assertEqual(len(compare_results(run(20.0, 5), baseline, 0.25)), 1)
+        self.assertEqual(len(compare_results(run(10.0, 6), baseline, 0.25)), 1)
+        # Routes missing from the baseline are new, not regressions
+        self.assertEqual(compare_results(run(10.0, 6), {"scales": {}}, 0.25), [])
+
+
+class RequestTimingTest(StoreTestCase):
+    def setUp(self: "RequestTimingTest") -> None:
+        super().setUp()
+        dish = Dish.objects.create(
+            name="Dish", description="", price=100, store=self.store
+        )
+        for _ in range(3):
+            order = Order.objects.create(
+                is_online=False,
+                is_completed=False,
+                created_at=timezone.now(),
+                store=self.store,
+            )
+            OrderDishRelation.objects.create(
+                order=order, dish=dish, quantity=1, other_comments=""
+            )
+        self.url = f"/api/stores/{self.store.id}/orders/"
+
+    def server_timing(self: "RequestTimingTest", response: HttpResponse) -> dict:
+        """The Server-Timing header as {name: {param: value}}"""
+        metrics = {}
+        for metric in response["Server-Timing"].split(", "):
+            name, *params = metric.split(";")
+            metrics[name] = dict(param.split("=", 1) for param in params)
+        return metrics
+
+    def test_server_timing_counts_queries(self: "RequestTimingTest") -> None:
+        """The header reports the queries the request ran"""
+        self.login()
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        metrics = self.server_timing(response)
+        self.assertEqual(metrics["db"]["desc"], f'"{len(queries)} queries"')
+        self.assertGreater(float(metrics["serialize"]["dur"]), 0)
+        self.assertGreaterEqual(
+            float(metrics["total"]["dur"]), float(metrics["db"]["dur"])
+        )
+
+    async def test_async_requests_are_counted(self: "RequestTimingTest") -> None:
+        """Queries run in worker threads under ASGI are counted too"""
+        await sync_to_async(self.async_client.force_login)(self.user1)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.server_timing(response)["db"]["desc"], '"0 queries"')
+
+    @override_settings(SLOW_REQUEST_QUERIES=1)
+    def test_slow_requests_are_logged(self: "RequestTimingTest") -> None:
+        """Requests over a threshold are logged with their route name"""
+        self.login()
+        with self.assertLogs("orderonus_be.instrumentation", "WARNING") as logs:
+            self.client.get(self.url)
+        self.assertIn("(orders)", logs.output[0])
+
+    @override_settings(REQUEST_TIMING=False)
+    def test_disabled(self: "RequestTimingTest") -> None:
+        """The middleware can be turned off"""
+        self.login()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Server-Timing", response)
+
+
+class SeedScaleTest(TestCase):
+    def setUp(self: "SeedScaleTest") -> None:
+        super().setUp()
+        self.plan = ScalePlan(
+            users=2,
+            stores=3,
+            dishes=4,
+            modifiers=2,
+            days=7,
+            orders_per_day=5,
+            lines=3,
+            until=datetime(2024, 3, 7).date(),
+            seed=42,
+        )
+
+    def rollups(self: "SeedScaleTest", store: Store) -> list:
+        return [
+            list(
+                DailySales.objects.filter(store=store)
+                .order_by("day")
+                .values_list("day", "order_count", "completed_count", "revenue")
+            ),
+            list(
+                DailyDishSales.objects.filter(store=store)
+                .order_by("day", "dish_id")
+                .values_list("day", "dish_id", "order_count", "quantity", "revenue")
+            ),
+        ]
+
+    def test_seed_scale(self: "SeedScaleTest") -> None:
+        """The rows are created with their lines, modifiers and rollups"""
+        totals = seed_scale(self.plan)
+        self.assertEqual(User.objects.count(), 2)
+        self.assertEqual(Store.objects.count(), 3)
+        self.assertEqual(Dish.objects.count(), 12)
+        self.assertEqual(totals["orders"], Order.objects.count())
+        self.assertEqual(totals["lines"], OrderDishRelation.objects.count())
+        self.assertTrue(OrderDishRelation.modifiers.through.objects.exists())
+        first, last = Order.objects.aggregate(
+            first=Min("created_at"), last=Max("created_at")
+        ).values()
+        self.assertEqual(first.date(), datetime(2024, 3, 1).date())
+        self.assertEqual(last.date(), datetime(2024, 3, 7).date())
+
+        for store in Store.objects.all():
+            seeded = self.rollups(store)
+            rebuild_rollups(store)
+            self.assertEqual(self.rollups(store), seeded)
+
+        # Ids allocated by the seeding do not clash with new rows
+        store = Store.objects.first()
+        Order.objects.create(
+            store=store, created_at=timezone.now(), is_online=False, is_completed=False
+        )
+
+    def test_seed_scale_deterministic(self: "SeedScaleTest") -> None:
+        """The same seed generates the same orders"""
+
+        def orders(prefix: str) -> list:
+            seed_scale(self.plan, prefix=prefix)
+            stores = Store.objects.filter(user__username__startswith=f"{prefix}-")
+            return [
+                (
+                    order.created_at,
+                    order.is_online,
+                    [
+                        (line.dish.name, line.quantity, len(line.get_modifiers()))
+                        for line in order.get_lines()
+                    ],
+                )
+                for order in prefetch_orders(
+                    Order.objects.filter(store__in=stores).order_by("id")
+                )
+            ]
+
+        self.assertEqual(orders("first"), orders("second"))
+
+    def test_command(self: "SeedScaleTest") -> None:
+        """The command refuses to reuse usernames"""
+        out = StringIO()
+        call_command("seed_scale", stores=1, days=2, orders_per_day=2, stdout=out)
+        self.assertIn("Created 10 users, 1 stores", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("seed_scale", stores=1, days=2, stdout=out)
+
+
+class ArchiveOrdersTest(StoreTestCase):
+    def setUp(self: "ArchiveOrdersTest") -> None:
+        super().setUp()
+        dish = Dish.objects.create(
+            name="Ramen", description="", price=1000, store=self.store
+        )
+        modifier = DishModifier.objects.create(name="Egg", price=200, dish=dish)
+        start = datetime(2024, 3, 1, 12, tzinfo=dt_timezone.utc)
+        for i in range(6):
+            order = create_order(
+                self.store,
+                resolve_cart(
+                    self.store,
+                    [{"id": dish.id, "quantity": 1 + i, "modifier": [modifier.id]}],
+                ),
+                False,
+                i % 2 == 0,
+                created_at=start + timedelta(hours=12 * i),
+            )
+            order.orderdishrelation_set.update(other_comments=f"Note {i}")
+        self.export_url = (
+            f"/api/stores/{self.store.id}/orders/export?from=2024-03-01&to=2024-03-05"
+        )
+        self.analytics_url = (
+            f"/api/stores/{self.store.id}/analytics?from=2024-03-01&to=2024-03-05"
+        )
+
+    def tearDown(self: "ArchiveOrdersTest") -> None:
+        Order.objects.all().delete()
+        ArchivedOrder.objects.all().delete()
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def export(self: "ArchiveOrdersTest") -> bytes:
+        return b"".join(self.client.get(self.export_url).streaming_content)
+
+    def test_archive_keeps_export_and_analytics(self: "ArchiveOrdersTest") -> None:
+        """Archived orders are exported and counted as before"""
+        self.assertTrue(self.login(), "Login failed")
+        exported = self.export()
+        self.assertEqual(len(exported.splitlines()), 6)
+        analytics = self.client.get(self.analytics_url).json()
+
+        self.assertEqual(archive_orders(archive_cutoff(30)), 3)
+        self.assertEqual(ArchivedOrder.objects.count(), 3)
+        self.assertFalse(Order.objects.filter(is_completed=True).exists())
+        self.assertEqual(OrderDishRelation.objects.count(), 3)
+        self.assertEqual(self.export(), exported)
+
+        rebuild_rollups(self.store)
+        self.assertEqual(self.client.get(self.analytics_url).json(), analytics)
+
+    def test_backfill_after_archiving_all(self: "ArchiveOrdersTest") -> None:
+        """Rebuilding without a range counts the archived orders"""
+        self.assertTrue(self.login(), "Login failed")
+        Order.objects.update(is_completed=True)
+        rebuild_rollups(self.store)
+        analytics = self.client.get(self.analytics_url).json()
+        self.assertEqual(archive_orders(archive_cutoff(30)), 6)
+        self.assertFalse(Order.objects.exists())
+
+        call_command("backfill_rollups", f"--store={self.store.id}", stdout=StringIO())
+        self.assertTrue(DailySales.objects.filter(store=self.store).exists())
+        self.assertEqual(self.client.get(self.analytics_url).json(), analytics)
+
+    def test_backfill_deleted_dish(self: "ArchiveOrdersTest") -> None:
+        """Archived lines of deleted dishes only count in the daily totals"""
+        self.assertTrue(self.login(), "Login failed")
+        archive_orders(archive_cutoff(30))
+        Order.objects.all().delete()
+        Dish.objects.all().delete()
+
+        call_command(
+            "backfill_rollups",
+            f"--store={self.store.id}",
+            "--from=2024-03-01",
+            "--to=2024-03-05",
+            stdout=StringIO(),
+        )
+        data = self.client.get(self.analytics_url).json()["data"]
+        self.assertEqual(data["totals"]["orders"], 3)
+        self.assertEqual(data["totals"]["revenue"], 1200 + 3 * 1200 + 5 * 1200)
+        self.assertEqual(data["top_dishes"], [])
+        self.assertFalse(DailyDishSales.objects.exists())
+
+    def test_archive_in_batches(self: "ArchiveOrdersTest") -> None:
+        """Batches are bounded and recent or pending orders are kept"""
+        cutoff = datetime(2024, 3, 3, tzinfo=dt_timezone.utc)
+        self.assertEqual(archive_orders(cutoff, batch_size=1, max_batches=1), 1)
+        self.assertEqual(archive_orders(cutoff, batch_size=1), 1)
+        self.assertEqual(archive_orders(cutoff), 0)
+        self.assertEqual(
+            list(ArchivedOrder.objects.values_list("created_at__day", flat=True)),
+            [1, 2],
+        )
+
+    def test_command(self: "ArchiveOrdersTest") -> None:
+        """The command archives the orders older than the given age"""
+        out = StringIO()
+        call_command("archive_orders", days=30, batch_size=2, stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Archived 3 orders")
+        with self.assertRaises(CommandError):
+            call_command("archive_orders", store=self.store.id + 1, stdout=out)
+
+
+class SyncOrdersTest(StoreTestCase):
+    def setUp(self: "SyncOrdersTest") -> None:
+        super().setUp()
+        self.dish = Dish.objects.create(
+            name="Ramen", description="", price=1000, store=self.store
+        )
+        self.base = f"/api/stores/{self.store.id}/orders"
+        self.assertTrue(self.login(), "Login failed")
+
+    def tearDown(self: "SyncOrdersTest") -> None:
+        Order.objects.all().delete()
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def add_order(self: "SyncOrdersTest") -> None:
+        response = self.client.post(
+            f"{self.base}/add",
+            {
+                "is_online": False,
+                "is_completed": False,
+                "dishes": [{"id": self.dish.id, "quantity": 1}],
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def sync(self: "SyncOrdersTest", cursor: str = "", **params: object) -> dict:
+        if cursor:
+            params["cursor"] = cursor
+        response = self.client.get(f"{self.base}/sync", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_sync_changes(self: "SyncOrdersTest") -> None:
+        """Only orders created or changed after the cursor are returned"""
+        for _ in range(3):
+            self.add_order()
+        first = self.sync()
+        self.assertEqual(len(first["data"]), 3)
+        self.assertFalse(first["more"])
+
+        unchanged = self.sync(first["cursor"])
+        self.assertEqual(unchanged["data"], [])
+        self.assertEqual(unchanged["cursor"], first["cursor"])
+
+        completed = first["data"][0]["id"]
+        self.client.post(
+            f"{self.base}/{completed}/complete",
+            {"is_completed": True},
+            content_type="application/json",
+        )
+        self.add_order()
+        changes = self.sync(first["cursor"])
+        self.assertEqual(len(changes["data"]), 2)
+        self.assertEqual(changes["data"][0]["id"], completed)
+        self.assertTrue(changes["data"][0]["is_completed"])
+        self.assertEqual(
+            list(
+                Order.objects.order_by("change_seq").values_list(
+                    "change_seq", flat=True
+                )
+            ),
+            [2, 3, 4, 5],
+        )
+
+    def test_sync_pages(self: "SyncOrdersTest") -> None:
+        """Changes are paged with ?limit= and the cursor"""
+        for _ in range(3):
+            self.add_order()
+        page = self.sync(limit=2)
+        self.assertEqual(len(page["data"]), 2)
+        self.assertTrue(page["more"])
+        page = self.sync(page["cursor"], limit=2)
+        self.assertEqual(len(page["data"]), 1)
+        self.assertFalse(page["more"])
+
+    def test_sync_not_modified(self: "SyncOrdersTest") -> None:
+        """Polling without changes is answered from the ETag"""
+        self.add_order()
+        response = self.client.get(f"{self.base}/sync")
+        # Only the session and the user are loaded
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                f"{self.base}/sync", HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+        self.assertEqual(response.status_code, 304)
+        self.add_order()
+        response = self.client.get(
+            f"{self.base}/sync", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_sync_archived(self: "SyncOrdersTest") -> None:
+        """Archived orders are reported as removed in sequence with changes"""
+        for _ in range(3):
+            self.add_order()
+        first = self.sync()
+        self.assertEqual(first["removed"], [])
+        ids = [order["id"] for order in first["data"]]
+        Order.objects.filter(id__in=ids[:2]).update(is_completed=True)
+        archive_orders(timezone.now() + timedelta(days=1))
+        self.add_order()
+
+        page = self.sync(first["cursor"], limit=1)
+        self.assertEqual((page["data"], page["removed"]), ([], [ids[0]]))
+        self.assertTrue(page["more"])
+        page = self.sync(page["cursor"])
+        self.assertEqual(page["removed"], [ids[1]])
+        self.assertEqual(len(page["data"]), 1)
+        self.assertFalse(page["more"])
+        self.assertEqual(self.sync(page["cursor"])["removed"], [])
+
+        # A client starting afresh only gets the live orders
+        fresh = self.sync()
+        self.assertEqual(fresh["removed"], [])
+        self.assertEqual(len(fresh["data"]), 2)
+
+    def test_sync_fail_invalid_cursor(self: "SyncOrdersTest") -> None:
+        """A malformed cursor is rejected"""
+        response = self.client.get(f"{self.base}/sync", {"cursor": "nope"})
+        self.assertEqual(response.status_code, 400)
+
+
+class IdempotencyTest(StoreTestCase):
+    def setUp(self: "IdempotencyTest") -> None:
+        super().setUp()
+        self.dish = Dish.objects.create(
+            name="Ramen", description="", price=1000, store=self.store
+        )
+        self.url = f"/api/stores/{self.store.id}/orders/add"
+        self.body = {"dishes": [{"id": self.dish.id, "quantity": 1}]}
+        self.assertTrue(self.login(), "Login failed")
+
+    def tearDown(self: "IdempotencyTest") -> None:
+        IdempotencyRecord.objects.all().delete()
+        Order.objects.all().delete()
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def add_order(
+        self: "IdempotencyTest", key: str = "retry-1", body: object = None
+    ) -> HttpResponse:
+        return self.client.post(
+            self.url,
+            body or self.body,
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_replays_response(self: "IdempotencyTest") -> None:
+        """A retry with the same key gets the first response and no new order"""
+        first = self.add_order()
+        self.assertEqual(first.status_code, 200, first.content)
+        self.assertFalse(first.has_header("Idempotent-Replayed"))
+        retry = self.add_order()
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.count(), 1)
+        record = IdempotencyRecord.objects.get()
+        self.assertEqual(record.order_id, Order.objects.get().id)
+
+        self.add_order(key="retry-2")
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_replay_is_one_lookup(self: "IdempotencyTest") -> None:
+        """A retry only reads the record after the session and the user"""
+        self.add_order()
+        with self.assertNumQueries(3):
+            response = self.add_order()
+        self.assertEqual(response["Idempotent-Replayed"], "true")
+
+    def test_without_key(self: "IdempotencyTest") -> None:
+        """Orders without a key are not remembered"""
+        for _ in range(2):
+            response = self.client.post(
+                self.url, self.body, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+    def test_fail_key_reused_for_other_body(self: "IdempotencyTest") -> None:
+        """A key sent with a different order is refused"""
+        self.add_order()
+        body = {"dishes": [{"id": self.dish.id, "quantity": 2}]}
+        response = self.add_order(body=body)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_fail_racing_key_reused_for_other_body(self: "IdempotencyTest") -> None:
+        """A key stored meanwhile by a different order is refused, not replayed"""
+        self.add_order()
+        record = IdempotencyRecord.objects.get()
+        body = {"dishes": [{"id": self.dish.id, "quantity": 2}]}
+        # The lookup before the order is written misses the record
+        with mock.patch.object(views, "find_record", side_effect=[None, record]):
+            response = self.add_order(body=body)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_racing_retry_replays(self: "IdempotencyTest") -> None:
+        """A retry that loses the race gets the winner's response"""
+        self.add_order()
+        record = IdempotencyRecord.objects.get()
+        with mock.patch.object(views, "find_record", side_effect=[None, record]):
+            response = self.add_order()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Idempotent-Replayed"], "true")
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_fail_invalid_key(self: "IdempotencyTest") -> None:
+        """Blank and overlong keys are rejected"""
+        for key in [" ", "k" * 256]:
+            response = self.add_order(key=key)
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_failed_order_not_remembered(self: "IdempotencyTest") -> None:
+        """A rejected order can be retried with the same key"""
+        response = self.add_order(body={"dishes": [{"id": 0, "quantity": 1}]})
+        self.assertNotEqual(response.status_code, 200)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+    @override_settings(IDEMPOTENCY_KEY_TTL=60)
+    def test_expired_key(self: "IdempotencyTest") -> None:
+        """An expired key creates a new order and is purged by the command"""
+        self.add_order()
+        IdempotencyRecord.objects.update(
+            created_at=timezone.now() - timedelta(minutes=2)
+        )
+        response = self.add_order()
+        self.assertFalse(response.has_header("Idempotent-Replayed"))
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(IdempotencyRecord.objects.count(), 1)
+
+        IdempotencyRecord.objects.update(
+            created_at=timezone.now() - timedelta(minutes=2)
+        )
+        out = StringIO()
+        call_command("purge_idempotency_keys", stdout=out)
+        self.assertIn("Deleted 1 expired idempotency keys", out.getvalue())
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+
+class BatchOrdersTest(StoreTestCase):
+    def setUp(self: "BatchOrdersTest") -> None:
+        super().setUp()
+        self.dish = Dish.objects.create(
+            name="Ramen", description="", price=1000, store=self.store
+        )
+        self.modifier = DishModifier.objects.create(
+            dish=self.dish, name="Egg", price=200
+        )
+        self.url = f"/api/stores/{self.store.id}/orders/batch"
+        self.taken = timezone.now() - timedelta(hours=3)
+        self.assertTrue(self.login(), "Login failed")
+
+    def tearDown(self: "BatchOrdersTest") -> None:
+        IdempotencyRecord.objects.all().delete()
+        Order.objects.all().delete()
+        Dish.objects.all().delete()
+        return super().tearDown()
+
+    def entry(self: "BatchOrdersTest", client_id: str, **fields: object) -> dict:
+        entry = {
+            "client_id": client_id,
+            "created_at": self.taken.isoformat(),
+            "isCompleted": True,
+            "dishes": [
+                {"id": self.dish.id, "quantity": 2, "modifier": [self.modifier.id]}
+            ],
+        }
+        entry.update(fields)
+        return entry
+
+    def upload(self: "BatchOrdersTest", entries: list) -> HttpResponse:
+        return self.client.post(
+            self.url, {"orders": entries}, content_type="application/json"
+        )
+
+    def test_upload_orders(self: "BatchOrdersTest") -> None:
+        """Orders keep their client timestamps and are counted in the rollups"""
+        response = self.upload([self.entry(f"tablet-{i}") for i in range(3)])
+        self.assertEqual(response.status_code, 200, response.content)
+        results = response.json()["data"]
+        self.assertEqual([r["status"] for r in results], ["created"] * 3)
+        self.assertEqual(
+            [r["client_id"] for r in results], ["tablet-0", "tablet-1", "tablet-2"]
+        )
+        orders = list(Order.objects.order_by("id"))
+        self.assertEqual([order.id for order in orders], [r["id"] for r in results])
+        self.assertEqual(orders[0].created_at, self.taken)
+        self.assertTrue(orders[0].is_completed)
+        self.assertEqual([order.change_seq for order in orders], [1, 2, 3])
+        line = orders[0].get_lines()[0]
+        self.assertEqual(list(line.modifiers.all()), [self.modifier])
+        sales = DailySales.objects.get(store=self.store)
+        self.assertEqual(sales.order_count, 3)
+        self.assertEqual(sales.revenue, 3 * 2 * 1200)
+
+    def test_upload_is_idempotent(self: "BatchOrdersTest") -> None:
+        """Orders uploaded before are reported as duplicates and not added again"""
+        first = self.upload([self.entry("tablet-0")]).json()["data"][0]
+        response = self.upload(
+            [self.entry("tablet-0"), self.entry("tablet-1"), self.entry("tablet-1")]
+        )
+        results = response.json()["data"]
+        self.assertEqual(
+            [r["status"] for r in results], ["duplicate", "created", "duplicate"]
+        )
+        self.assertEqual(results[0]["id"], first["id"])
+        self.assertEqual(results[1]["id"], results[2]["id"])
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(DailySales.objects.get(store=self.store).order_count, 2)
+
+    def test_upload_per_order_errors(self: "BatchOrdersTest") -> None:
+        """Invalid orders are rejected one by one and the others are added"""
+        response = self.upload(
+            [
+                self.entry("ok"),
+                self.entry("no-dish", dishes=[{"id": 0, "quantity": 1}]),
+                self.entry("empty", dishes=[]),
+                self.entry("when", created_at="yesterday"),
+                self.entry(
+                    "future",
+                    created_at=(timezone.now() + timedelta(hours=1)).isoformat(),
+                ),
+                self.entry(""),
+                "not an order",
+                self.entry("not-a-dish", dishes=[5]),
+                self.entry(
+                    "bad-quantity", dishes=[{"id": self.dish.id, "quantity": "x"}]
+                ),
+                self.entry("no-quantity", dishes=[{"id": self.dish.id, "quantity": 0}]),
+                self.entry(
+                    "bad-modifier",
+                    dishes=[{"id": self.dish.id, "quantity": 1, "modifier": [[1]]}],
+                ),
+                self.entry("bad-id", dishes=[{"id": {}, "quantity": 1}]),
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["data"]
+        self.assertEqual([r["status"] for r in results], ["created"] + ["error"] * 11)
+        self.assertEqual([r["code"] for r in results[1:]], [404] + [400] * 10)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(IdempotencyRecord.objects.count(), 1)
+
+        # A rejected order may be fixed and uploaded again
+        response = self.upload([self.entry("no-dish")])
+        self.assertEqual(response.json()["data"][0]["status"], "created")
+
+    def test_fail_client_id_reused(self: "BatchOrdersTest") -> None:
+        """A client id sent with a different order is refused"""
+        self.upload([self.entry("tablet-0")])
+        results = self.upload([self.entry("tablet-0", isOnline=True)]).json()["data"]
+        self.assertEqual(results[0]["status"], "error")
+        self.assertEqual(results[0]["code"], 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_upload_shares_keys_with_add_order(self: "BatchOrdersTest") -> None:
+        """An order sent to add_order and in a batch with the same id is added once"""
+        entry = self.entry("tablet-0")
+        order = {"isCompleted": True, "dishes": entry["dishes"]}
+        response = self.client.post(
+            f"/api/stores/{self.store.id}/orders/add",
+            order,
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY="tablet-0",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        result = self.upload([entry]).json()["data"][0]
+        self.assertEqual(result["status"], "duplicate")
+        self.assertEqual(result["id"], Order.objects.get().id)
+
+        self.upload([self.entry("tablet-1")])
+        response = self.client.post(
+            f"/api/stores/{self.store.id}/orders/add",
+            order,
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY="tablet-1",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response["Idempotent-Replayed"], "true")
+        self.assertEqual(response.json(), {"data": "Order added successfully"})
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_upload_query_count(self: "BatchOrdersTest") -> None:
+        """The queries depend on the number of chunks, not of orders"""
+        # Creates the change sequence of the store
+        self.upload([self.entry("first")])
+        with override_settings(ORDER_BATCH_CHUNK_SIZE=40):
+            with CaptureQueriesContext(connection) as large:
+                self.upload([self.entry(f"large-{i}") for i in range(100)])
+        with override_settings(ORDER_BATCH_CHUNK_SIZE=1):
+            with CaptureQueriesContext(connection) as small:
+                self.upload([self.entry(f"small-{i}") for i in range(3)])
+        self.assertEqual(Order.objects.count(), 104)
+        self.assertEqual(len(large), len(small))
+
+    def test_concurrent_upload(self: "BatchOrdersTest") -> None:
+        """Client ids stored by another upload after validation are duplicates"""
+        self.upload([self.entry("tablet-0")])
+        other = Order.objects.get()
+        stale = batch.find_records
+        with mock.patch.object(batch, "find_records") as find_records:
+            find_records.side_effect = [{}, stale(self.store, ["tablet-0"])]
+            response = self.upload([self.entry("tablet-0"), self.entry("tablet-1")])
+        results = response.json()["data"]
+        self.assertEqual([r["status"] for r in results], ["duplicate", "created"])
+        self.assertEqual(results[0]["id"], other.id)
+        self.assertEqual(Order.objects.count(), 2)
+
+    @override_settings(ORDER_BATCH_MAX_ORDERS=2)
+    def test_fail_batch(self: "BatchOrdersTest") -> None:
+        """Missing, empty and oversized batches are rejected"""
+        response = self.client.post(self.url, {}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.upload([]).status_code, 400)
+        response = self.client.post(self.url, [], content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        response = self.upload([self.entry(f"tablet-{i}") for i in range(3)])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
@@ -13,22 +13,35 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+
+from django.conf import settings
 from django.urls import path
+from .async_views import order_stream
 from .views import (
     orders,
     complete_order,
     available,
+    bulk_available,
     add_order,
+    batch_orders,
     get_dishes,
     add_dishes,
+    bulk_menu,
     edit_dish,
     order_by_id,
+    sync_orders,
+    export_orders,
+    sales_analytics,
     delete_dish,
     add_dish_modifier,
     get_stores,
     add_store,
 )
 
+if settings.API_ASYNC_VIEWS:
+    # Serve the read endpoints with the async ORM under ASGI
+    from .async_views import orders, order_by_id, get_dishes, get_stores
+
 urlpatterns = [
     # Stores
     path("stores/", get_stores, name="stores"),
@@ -36,6 +49,10 @@ urlpatterns = [
     # Orders
     path("stores/<int:store_id>/orders/", orders, name="orders"),
     path("stores/<int:store_id>/orders/add", add_order, name="add_order"),
+    path("stores/<int:store_id>/orders/batch", batch_orders, name="batch_orders"),
+    path("stores/<int:store_id>/orders/stream", order_stream, name="order_stream"),
+    path("stores/<int:store_id>/orders/sync", sync_orders, name="sync_orders"),
+    path("stores/<int:store_id>/orders/export", export_orders, name="export_orders"),
     path(
         "stores/<int:store_id>/orders/<int:order_id>/", order_by_id, name="order_by_id"
     ),
@@ -44,9 +61,17 @@ urlpatterns = [
         complete_order,
         name="complete_order",
     ),
+    # Analytics
+    path("stores/<int:store_id>/analytics", sales_analytics, name="sales_analytics"),
     # Dishes
     path("stores/<int:store_id>/dishes/", get_dishes, name="get_dishes"),
     path("stores/<int:store_id>/dishes/add", add_dishes, name="add_dishes"),
+    path("stores/<int:store_id>/dishes/bulk", bulk_menu, name="bulk_menu"),
+    path(
+        "stores/<int:store_id>/dishes/available",
+        bulk_available,
+        name="bulk_available",
+    ),
     path(
         "stores/<int:store_id>/dishes/<int:dish_id>/edit", edit_dish, name="edit_dish"
     ),
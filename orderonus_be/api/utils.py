@@ -1,10 +1,65 @@
-from typing import Optional
-from django.contrib.auth.models import User
+from typing import Optional, Union
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser, User
+from django.conf import settings
+from django.http.request import HttpRequest
 from .models import Store
+from .ownership import cached_owned_store, remember_owned_store
 
 
 def get_store(user: User, store_id: int) -> Optional[Store]:
+    """Get the store if the user owns it, see ``api.ownership``"""
+    store = cached_owned_store(user.pk, store_id)
+    if store is not None:
+        return store
     try:
-        return Store.objects.get(id=store_id, user=user)
+        store = Store.objects.get(id=store_id, user=user)
     except Store.DoesNotExist:
         return None
+    remember_owned_store(store)
+    return store
+
+
+def request_store(request: HttpRequest, store_id: int) -> Optional[Store]:
+    """Get the store of the logged in user, resolving it once per request"""
+    resolved = request.__dict__.setdefault("_resolved_stores", {})
+    if store_id not in resolved:
+        resolved[store_id] = get_store(request.user, store_id)
+    return resolved[store_id]
+
+
+def resolve_user(request: HttpRequest) -> Union[User, AnonymousUser]:
+    """Load the lazily authenticated user of the request"""
+    request.user.is_authenticated
+    return request.user
+
+
+async def get_request_user(request: HttpRequest) -> Union[User, AnonymousUser]:
+    """Get the user of the request without blocking the event loop on its lookup"""
+    auser = getattr(request, "auser", None)
+    if auser is not None:
+        return await auser()
+    return await sync_to_async(resolve_user)(request)
+
+
+async def arequest_store(request: HttpRequest, store_id: int) -> Optional[Store]:
+    """Async version of ``request_store``"""
+    resolved = request.__dict__.setdefault("_resolved_stores", {})
+    if store_id not in resolved:
+        resolved[store_id] = await aget_store(await get_request_user(request), store_id)
+    return resolved[store_id]
+
+
+async def aget_store(user: User, store_id: int) -> Optional[Store]:
+    """Async version of ``get_store``"""
+    if settings.STORE_CACHE_ALIAS:
+        # A shared cache backend may block on the network
+        store = await sync_to_async(cached_owned_store)(user.pk, store_id)
+    else:
+        store = cached_owned_store(user.pk, store_id)
+    if store is not None:
+        return store
+    store = await Store.objects.filter(id=store_id, user_id=user.pk).afirst()
+    if store is not None:
+        await sync_to_async(remember_owned_store)(store)
+    return store
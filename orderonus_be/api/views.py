@@ -1,67 +1,201 @@
 import json
+from typing import List
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.core.serializers.json import DjangoJSONEncoder
 from django.http.request import HttpRequest
-from django.http.response import HttpResponse, JsonResponse
-from django.views.decorators.http import require_GET, require_POST
+from django.http.response import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_GET, require_POST
 from django.contrib.auth.decorators import login_required
-from django.utils.timezone import now
 
-from .models import Order, OrderDishRelation, Dish, DishModifier, Store
-from .utils import get_store
-from typing import List
+from .models import Order, Dish, DishModifier, Store
+from .cache import bump_menu_version, bump_orders_version, cached_menu
+from .changes import changed_orders, mark_changed
+from .batch import upload_orders
+from .conditional import (
+    menu_etag,
+    order_etag,
+    orders_etag,
+    sync_etag,
+)
+from .dates import is_valid_timezone, requested_range
+from .events import (
+    publish_order_completed,
+    publish_order_created,
+    publish_orders_created,
+)
+from .export import CONTENT_TYPES, stream_export
+from .idempotency import (
+    ORDER_ADDED,
+    IdempotencyError,
+    check_record,
+    find_record,
+    idempotency_key,
+    order_fingerprint,
+    remember,
+    replay,
+)
+from .menu import (
+    MenuError,
+    apply_changes,
+    availability_filter,
+    plan_changes,
+    set_availability,
+)
+from .orders import CartError, create_order, resolve_cart
+from .pagination import PaginationError, paginate
+from .rollups import local_days, record_completion, summarize_range
+from .serializers import (
+    prefetch_dishes,
+    prefetch_orders,
+    serialize_dishes,
+    serialize_order_lines,
+    serialize_orders,
+)
+from .utils import request_store
 
 
 # Create your views here.
 @require_GET
 @login_required
+@condition(etag_func=orders_etag)
 def orders(request: HttpRequest, store_id: int) -> HttpResponse:
     """Retrive the orders from the database"""
-    store = get_store(request.user, store_id)
+    store = request_store(request, store_id)
     if store is None:
         return JsonResponse({"error": "Store not found"}, status=404)
 
-    # Gets the orders from the past day
-    pending_orders = (
-        Order.objects.filter(created_at__contains=now().date(), store=store)
-        .order_by("created_at")
-        .all()
-    )
+    # Gets the orders in the requested range, today in the store's timezone
+    # by default
+    try:
+        start, end = requested_range(request, store)
+    except ValueError:
+        return JsonResponse({"error": "Invalid date range"}, status=400)
+
+    try:
+        pending_orders, next_cursor = paginate(
+            prefetch_orders(
+                Order.objects.filter(
+                    store=store, created_at__gte=start, created_at__lt=end
+                )
+            ),
+            request,
+            ("created_at", "id"),
+        )
+    except PaginationError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
     return JsonResponse(
         {
-            "data": list(map(lambda x: x.to_dict(), pending_orders)),
+            "data": serialize_orders(pending_orders),
+            "next": next_cursor,
         }
     )
 
 
 @require_GET
 @login_required
+@condition(etag_func=order_etag)
 def order_by_id(request: HttpRequest, store_id: int, order_id: int) -> HttpResponse:
     """Retrive the order by id from the database"""
-    store = get_store(request.user, store_id)
+    store = request_store(request, store_id)
     if store is None:
         return JsonResponse({"error": "Store not found"}, status=404)
 
-    order_id: int = request.POST.get("order_id")
-    order = Order.objects.filter(id=order_id, store=store).get()
-    if order is None:
+    try:
+        order = prefetch_orders(Order.objects.filter(id=order_id, store=store)).get()
+    except Order.DoesNotExist:
         return JsonResponse({"error": "Order not found"}, status=404)
 
-    # Get the dishes in the order
-    dishes = OrderDishRelation.objects.filter(order=order).all()
+    # The dishes in the order are already loaded by the prefetch
     return JsonResponse(
         {
             "data": {
                 "order": order.to_dict(),
-                "dishes": list(map(lambda x: x.to_dict(), dishes)),
+                "dishes": serialize_order_lines(order.get_lines()),
             }
         }
     )
 
 
+@require_GET
+@login_required
+@condition(etag_func=sync_etag)
+def sync_orders(request: HttpRequest, store_id: int) -> HttpResponse:
+    """Orders changed and ids of orders archived since the client's cursor"""
+    store = request_store(request, store_id)
+    if store is None:
+        return JsonResponse({"error": "Store not found"}, status=404)
+
+    try:
+        changed, removed, cursor, more = changed_orders(store, request)
+    except PaginationError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    return JsonResponse(
+        {
+            "data": serialize_orders(changed),
+            "removed": removed,
+            "cursor": cursor,
+            "more": more,
+        }
+    )
+
+
+@require_GET
+@login_required
+def export_orders(request: HttpRequest, store_id: int) -> HttpResponse:
+    """Stream the orders of a date range as NDJSON or CSV"""
+    store = request_store(request, store_id)
+    if store is None:
+        return JsonResponse({"error": "Store not found"}, status=404)
+
+    export_format = request.GET.get("format", "ndjson")
+    if export_format not in CONTENT_TYPES:
+        return JsonResponse({"error": "Invalid format"}, status=400)
+    try:
+        start, end = requested_range(request, store)
+    except ValueError:
+        return JsonResponse({"error": "Invalid date range"}, status=400)
+
+    response = StreamingHttpResponse(
+        stream_export(store, start, end, export_format),
+        content_type=CONTENT_TYPES[export_format],
+    )
+    filename = f"orders-{store.id}-{start.date()}-{end.date()}.{export_format}"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@require_GET
+@login_required
+def sales_analytics(request: HttpRequest, store_id: int) -> HttpResponse:
+    """Daily sales and top dishes of a range of days, read from the rollups"""
+    store = request_store(request, store_id)
+    if store is None:
+        return JsonResponse({"error": "Store not found"}, status=404)
+
+    try:
+        start, end = requested_range(request, store)
+        top = int(request.GET.get("top", settings.ANALYTICS_TOP_DISHES))
+    except ValueError:
+        return JsonResponse({"error": "Invalid parameter"}, status=400)
+    if top < 0:
+        return JsonResponse({"error": "Invalid parameter"}, status=400)
+
+    first_day, last_day = local_days(store, start, end)
+    summary = summarize_range(store, first_day, last_day, top)
+    return JsonResponse(
+        {"data": {"from": first_day, "to": last_day, **summary}},
+        encoder=DjangoJSONEncoder,
+    )
+
+
 @require_POST
 @login_required
 def complete_order(request: HttpRequest, store_id: int, order_id: int) -> HttpResponse:
     """Mark the order as complete"""
-    store = get_store(request.user, store_id)
+    store = request_store(request, store_id)
     if store is None:
         return JsonResponse({"error": "Store not found"}, status=404)
 
@@ -74,8 +208,22 @@ def complete_order(request: HttpRequest, store_id: int, order_id: int) -> HttpRe
     except Order.DoesNotExist:
         return JsonResponse({"error": "Order not found"}, status=404)
 
-    order.is_completed = is_completed
-    order.save()
+    is_completed = bool(is_completed)
+    with transaction.atomic():
+        # Only the request that flips the status counts it, however many race
+        changed = (
+            Order.objects.filter(id=order.id)
+            .exclude(is_completed=is_completed)
+            .update(is_completed=is_completed)
+        )
+        if not changed:
+            return JsonResponse({"data": "Order updated successfully"})
+        order.is_completed = is_completed
+        mark_changed(order)
+        order.save(update_fields=["change_seq", "updated_at"])
+        record_completion(store, order, not is_completed)
+    bump_orders_version(store.id)
+    publish_order_completed(order)
 
     return JsonResponse({"data": "Order updated successfully"})
 
@@ -84,7 +232,7 @@ def complete_order(request: HttpRequest, store_id: int, order_id: int) -> HttpRe
 @login_required
 def available(request: HttpRequest, store_id: int, dish_id: int) -> HttpResponse:
     """Mark the dish as available / unavailable"""
-    store = get_store(request.user, store_id)
+    store = request_store(request, store_id)
     if store is None:
         return JsonResponse({"error": "Store not found"}, status=404)
 
@@ -101,18 +249,73 @@ def available(request: HttpRequest, store_id: int, dish_id: int) -> HttpResponse
 
     dish.is_available = is_available
     dish.save()
+    bump_menu_version(store.id)
     return JsonResponse({"data": "Dish updated successfully"})
 
 
+@require_POST
+@login_required
+def bulk_available(request: HttpRequest, store_id: int) -> HttpResponse:
+    """Mark the dishes and modifiers picked by id or name as available / unavailable"""
+    store = request_store(request, store_id)
+    if store is None:
+        return JsonResponse({"error": "Store not found"}, status=404)
+
+    post_dict = json.loads(request.body)
+    is_available = post_dict.get("is_available", None)
+    dishes = post_dict.get("dishes", None)
+    modifiers = post_dict.get("modifiers", None)
+    if not isinstance(is_available, bool) or (dishes is None and modifiers is None):
+        return JsonResponse({"error": "Missing parameter"}, status=400)
+    try:
+        dish_filter = availability_filter(dishes) if dishes is not None else None
+        modifier_filter = (
+            availability_filter(modifiers) if modifiers is not None else None
+        )
+    except MenuError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    dish_ids: List[int] = []
+    modifier_ids: List[int] = []
+    with transaction.atomic():
+        if dish_filter is not None:
+            dish_ids = set_availability(
+                Dish.objects.filter(store=store), dish_filter, is_available
+            )
+        if modifier_filter is not None:
+            modifier_ids = set_availability(
+                DishModifier.objects.filter(dish__store=store),
+                modifier_filter,
+                is_available,
+            )
+    if dish_ids or modifier_ids:
+        bump_menu_version(store.id)
+    return JsonResponse({"data": {"dishes": dish_ids, "modifiers": modifier_ids}})
+
+
 @require_POST
 @login_required
 def add_order(request: HttpRequest, store_id: int) -> HttpResponse:
-    """Adds the order to the database"""
-    store = get_store(request.user, store_id)
+    """Adds the order to the database.
+
+    Retries sent with the same ``Idempotency-Key`` header get the response
+    of the first request instead of creating the order again.
+    """
+    store = request_store(request, store_id)
     if store is None:
         return JsonResponse({"error": "Store not found"}, status=404)
 
     post_dict = json.loads(request.body)
+    try:
+        key = idempotency_key(request)
+        digest = order_fingerprint(post_dict)
+        record = find_record(store, key) if key else None
+        if record is not None:
+            check_record(record, digest)
+            return replay(record)
+    except IdempotencyError as error:
+        return JsonResponse({"error": error.message}, status=error.status)
+
     isOnline = post_dict.get("isOnline", False)
     isCompleted = post_dict.get("isCompleted", False)
     dishes = post_dict.get("dishes", None)
@@ -122,66 +325,91 @@ def add_order(request: HttpRequest, store_id: int) -> HttpResponse:
     if len(dishes) == 0:
         return JsonResponse({"error": "No dishes in order"}, status=400)
 
-    order = Order.objects.create(
-        is_online=isOnline,
-        is_completed=isCompleted,
-        store=store,
-        created_at=now(),
-    )
-    relations: List[OrderDishRelation] = []
-    for dish in dishes:
-        try:
-            dish_obj = Dish.objects.filter(id=dish.get("id")).get()
-        except Dish.DoesNotExist:
-            return JsonResponse({"error": "Dish not found"}, status=404)
-
-        modifiers = dish.get("modifier", [])
-        mods = list(
-            map(
-                lambda x: DishModifier.objects.filter(dish=dish_obj, id=x).get(),
-                modifiers,
+    try:
+        lines = resolve_cart(store, dishes)
+    except CartError as error:
+        return JsonResponse({"error": error.message}, status=error.status)
+
+    try:
+        with transaction.atomic():
+            order = create_order(
+                store, lines, is_online=isOnline, is_completed=isCompleted
             )
-        )
-        quantity = dish.get("quantity", None)
-        if quantity is None:
-            return JsonResponse({"error": "Missing parameter"}, status=400)
-        relation = OrderDishRelation.objects.create(
-            order=order,
-            dish=dish_obj,
-            quantity=dish.get("quantity"),
-            other_comments=dish.get("other_comments", ""),
-        )
-        relation.modifiers.set(mods)
-        relations.append(relation)
+            if key:
+                remember(store, key, digest, order.id, 200, ORDER_ADDED)
+    except IntegrityError:
+        # A concurrent retry stored the key first, its order stands
+        record = find_record(store, key)
+        if record is None:
+            raise
+        try:
+            check_record(record, digest)
+        except IdempotencyError as error:
+            return JsonResponse({"error": error.message}, status=error.status)
+        return replay(record)
+    bump_orders_version(store.id)
+    publish_order_created(order)
 
-    order.save()
-    for r in relations:
-        r.save()
+    return JsonResponse(ORDER_ADDED)
 
-    return JsonResponse({"data": "Order added successfully"})
+
+@require_POST
+@login_required
+def batch_orders(request: HttpRequest, store_id: int) -> HttpResponse:
+    """Adds the orders a store queued while offline, with a result per order"""
+    store = request_store(request, store_id)
+    if store is None:
+        return JsonResponse({"error": "Store not found"}, status=404)
+
+    post_dict = json.loads(request.body)
+    if not isinstance(post_dict, dict):
+        return JsonResponse({"error": "Missing parameter"}, status=400)
+    entries = post_dict.get("orders", None)
+    if not isinstance(entries, list) or len(entries) == 0:
+        return JsonResponse({"error": "Missing parameter"}, status=400)
+    if len(entries) > settings.ORDER_BATCH_MAX_ORDERS:
+        return JsonResponse({"error": "Too many orders"}, status=400)
+
+    results, created = upload_orders(store, entries)
+    if created:
+        bump_orders_version(store.id)
+        publish_orders_created(store.id, created)
+    return JsonResponse({"data": results})
 
 
 @require_GET
 @login_required
+@condition(etag_func=menu_etag)
 def get_dishes(request: HttpRequest, store_id: int) -> HttpResponse:
     """Gets the possible dishes"""
-    store = get_store(request.user, store_id)
+    store = request_store(request, store_id)
     if store is None:
         return JsonResponse({"error": "Store not found"}, status=404)
-    return JsonResponse(
-        {
-            "data": list(
-                map(lambda x: x.to_dict(), Dish.objects.filter(store=store).all())
-            )
-        }
-    )
+
+    def build() -> bytes:
+        dishes, next_cursor = paginate(
+            prefetch_dishes(Dish.objects.filter(store=store)), request, ("id",)
+        )
+        return json.dumps(
+            {"data": serialize_dishes(dishes), "next": next_cursor},
+            cls=DjangoJSONEncoder,
+        ).encode()
+
+    variant = f"{request.GET.get('cursor', '')}:{request.GET.get('limit', '')}"
+    try:
+        content, hit = cached_menu(store.id, variant, build)
+    except PaginationError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    response = HttpResponse(content, content_type="application/json")
+    response["X-Menu-Cache"] = "hit" if hit else "miss"
+    return response
 
 
 @require_POST
 @login_required
 def add_dishes(request: HttpRequest, store_id: int) -> HttpResponse:
     """Creates a new dish and adds it into the database"""
-    store = get_store(request.user, store_id)
+    store = request_store(request, store_id)
     if store is None:
         return JsonResponse({"error": "Store not found"}, status=404)
 
@@ -222,15 +450,41 @@ def add_dishes(request: HttpRequest, store_id: int) -> HttpResponse:
     for mod in mod_objs:
         mod.save()
     dish.save()
+    bump_menu_version(store.id)
 
     return JsonResponse({"data": "Dish created successfully"})
 
 
+@require_POST
+@login_required
+def bulk_menu(request: HttpRequest, store_id: int) -> HttpResponse:
+    """Applies a list of dish and modifier operations in one transaction"""
+    store = request_store(request, store_id)
+    if store is None:
+        return JsonResponse({"error": "Store not found"}, status=404)
+
+    post_dict = json.loads(request.body)
+    operations = post_dict.get("operations", None)
+    if not isinstance(operations, list) or len(operations) == 0:
+        return JsonResponse({"error": "Missing parameter"}, status=400)
+    if len(operations) > settings.MENU_BULK_MAX_OPERATIONS:
+        return JsonResponse({"error": "Too many operations"}, status=400)
+
+    changes = plan_changes(store, operations)
+    if changes.failed:
+        return JsonResponse(
+            {"error": "Invalid operations", "results": changes.results}, status=400
+        )
+    apply_changes(changes)
+    bump_menu_version(store.id)
+    return JsonResponse({"data": changes.results})
+
+
 @require_POST
 @login_required
 def edit_dish(request: HttpRequest, store_id: int, dish_id: int) -> HttpResponse:
     """Edits the dish"""
-    store = get_store(request.user, store_id)
+    store = request_store(request, store_id)
     if store is None:
         return JsonResponse({"error": "Store not found"}, status=404)
     try:
@@ -252,6 +506,7 @@ def edit_dish(request: HttpRequest, store_id: int, dish_id: int) -> HttpResponse
     if image is not None:
         dish.image = image
     dish.save()
+    bump_menu_version(store.id)
     return JsonResponse({"data": "Dish updated successfully"})
 
 
@@ -259,7 +514,7 @@ def edit_dish(request: HttpRequest, store_id: int, dish_id: int) -> HttpResponse
 @login_required
 def delete_dish(request: HttpRequest, store_id: int, dish_id: int) -> HttpResponse:
     """Deletes the dish"""
-    store = get_store(request.user, store_id)
+    store = request_store(request, store_id)
     if store is None:
         return JsonResponse({"error": "Store not found"}, status=404)
     try:
@@ -268,6 +523,7 @@ def delete_dish(request: HttpRequest, store_id: int, dish_id: int) -> HttpRespon
         return JsonResponse({"error": "Dish not found"}, status=404)
 
     dish.delete()
+    bump_menu_version(store.id)
     return JsonResponse({"data": "Dish deleted successfully"})
 
 
@@ -277,7 +533,7 @@ def add_dish_modifier(
     request: HttpRequest, store_id: int, dish_id: int
 ) -> HttpResponse:
     """Adds a modifier to the dish"""
-    store = get_store(request.user, store_id)
+    store = request_store(request, store_id)
     if store is None:
         return JsonResponse({"error": "Store not found"}, status=404)
     try:
@@ -299,6 +555,7 @@ def add_dish_modifier(
         is_available=is_available,
     )
     modifier.save()
+    bump_menu_version(store.id)
     return JsonResponse({"data": "Modifier added successfully"})
 
 
@@ -306,7 +563,13 @@ def add_dish_modifier(
 @login_required
 def get_stores(request: HttpRequest) -> HttpResponse:
     """Gets the stores"""
-    return JsonResponse({"data": list(map(lambda x: x.to_dict(), Store.objects.all()))})
+    try:
+        stores, next_cursor = paginate(Store.objects.all(), request, ("id",))
+    except PaginationError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    return JsonResponse(
+        {"data": list(map(lambda x: x.to_dict(), stores)), "next": next_cursor}
+    )
 
 
 @require_POST
@@ -317,10 +580,14 @@ def add_store(request: HttpRequest) -> HttpResponse:
     name = post_dict.get("name", None)
     image = post_dict.get("image", None)
     description = post_dict.get("description", "")
+    store_timezone = post_dict.get("timezone", settings.TIME_ZONE)
 
     if name is None:
         return JsonResponse({"error": "Missing parameters"}, status=400)
 
+    if not is_valid_timezone(store_timezone):
+        return JsonResponse({"error": "Invalid timezone"}, status=400)
+
     if Store.objects.filter(name=name).exists():
         return JsonResponse({"error": "Store already exists"}, status=400)
 
@@ -329,6 +596,7 @@ def add_store(request: HttpRequest) -> HttpResponse:
         image=image,
         description=description,
         user=request.user,
+        timezone=store_timezone,
     )
     store.save()
 
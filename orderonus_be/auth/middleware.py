@@ -0,0 +1,35 @@
+from typing import Any, Optional
+from django.http.request import HttpRequest
+from django.http.response import HttpResponse, JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from .tokens import bearer_token, verify_token
+
+
+class DeviceTokenMiddleware(MiddlewareMixin):
+    """Authenticate requests carrying a device token.
+
+    Must come after ``AuthenticationMiddleware``. A valid token replaces the
+    lazily loaded session user before anything reads it, so neither the
+    session nor the user is fetched from the database.
+    """
+
+    def process_request(
+        self: "DeviceTokenMiddleware", request: HttpRequest
+    ) -> Optional[HttpResponse]:
+        value = bearer_token(request)
+        if value is None:
+            return None
+        token = verify_token(value)
+        if token is None:
+            return JsonResponse({"error": "Invalid token"}, status=401)
+
+        user = token.get_user()
+
+        async def auser() -> Any:
+            return user
+
+        request.user = user
+        request.auser = auser
+        request.device_token = token
+        return None
@@ -1,6 +1,12 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 
+from api.models import Store
+from .tokens import RevocationList, issue_token, revocations, verify_token
+
 
 # Create your tests here.
 class LoginTest(TestCase):
@@ -143,3 +149,135 @@ class RegisterTest(TestCase):
         )
         self.assertEqual(response.status_code, 201, response.content)
         self.assertEqual(response.json(), {"data": "User created successfully"})
+
+
+class DeviceTokenTest(TestCase):
+    def setUp(self) -> None:
+        """Set up the test"""
+        revocations.clear()
+        cache.clear()
+        self.username = "test"
+        self.password = "test"
+        self.user = User.objects.create_user(self.username, "", self.password)
+        self.store = Store.objects.create(name="Store", description="", user=self.user)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        """Tear down the test"""
+        revocations.clear()
+        return super().tearDown()
+
+    def issue(self: "DeviceTokenTest") -> str:
+        """Issue a token with the user's credentials"""
+        response = self.client.post(
+            "/accounts/tokens/",
+            {"username": self.username, "password": self.password, "device": "POS 1"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()["data"]["token"]
+
+    def get_dishes(self: "DeviceTokenTest", token: str) -> int:
+        """Call an API endpoint with the token and return the status"""
+        response = self.client.get(
+            f"/api/stores/{self.store.id}/dishes/",
+            HTTP_AUTHORIZATION=f"Bearer {token}",
+        )
+        return response.status_code
+
+    def test_token_authenticates_api_requests(self: "DeviceTokenTest") -> None:
+        """Requests with a valid token are let into login_required views"""
+        token = self.issue()
+        self.assertEqual(self.get_dishes(token), 200)
+        self.assertEqual(verify_token(token).device, "POS 1")
+
+    def test_token_skips_session_and_user_lookup(self: "DeviceTokenTest") -> None:
+        """Authenticating with a token does not query the database"""
+        token = self.issue()
+        self.get_dishes(token)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.get_dishes(token), 200)
+        for query in context.captured_queries:
+            self.assertNotIn("django_session", query["sql"])
+            self.assertNotIn("auth_user", query["sql"])
+
+    def test_token_fail_bad_credentials(self: "DeviceTokenTest") -> None:
+        """Tokens are only issued to the right password"""
+        response = self.client.post(
+            "/accounts/tokens/",
+            {"username": self.username, "password": "wrong", "device": "POS 1"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 404, response.content)
+        response = self.client.post(
+            "/accounts/tokens/",
+            {"username": self.username, "password": self.password},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(response.json(), {"error": "Device not provided"})
+
+    def test_token_fail_tampered(self: "DeviceTokenTest") -> None:
+        """Tokens that were not signed by the server are rejected"""
+        token = self.issue()
+        other = User.objects.create_user("other", "", "other")
+        payload, _, signature = token.rpartition(":")
+        forged = issue_token(other, "POS 1").rpartition(":")[0] + ":" + signature
+        self.assertEqual(self.get_dishes(forged), 401)
+        self.assertEqual(self.get_dishes(payload + ":" + signature[::-1]), 401)
+
+    def test_token_fail_expired(self: "DeviceTokenTest") -> None:
+        """Tokens stop working after their maximum age"""
+        token = self.issue()
+        with override_settings(DEVICE_TOKEN_MAX_AGE=-1):
+            self.assertEqual(self.get_dishes(token), 401)
+
+    def test_token_revoke(self: "DeviceTokenTest") -> None:
+        """Revoked tokens are rejected while other tokens keep working"""
+        token = self.issue()
+        other = self.issue()
+        response = self.client.post(
+            "/accounts/tokens/revoke",
+            {},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {token}",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.get_dishes(token), 401)
+        self.assertEqual(self.get_dishes(other), 200)
+
+        # A process that has not seen the revocation picks it up from the cache
+        revocations.clear()
+        self.assertEqual(self.get_dishes(token), 401)
+
+    def test_token_revoke_all(self: "DeviceTokenTest") -> None:
+        """All of a user's tokens can be revoked at once"""
+        tokens = [self.issue(), self.issue()]
+        response = self.client.post(
+            "/accounts/tokens/revoke",
+            {"all": True},
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {tokens[0]}",
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([self.get_dishes(token) for token in tokens], [401, 401])
+
+        # Tokens issued right after the revocation work
+        self.assertEqual(self.get_dishes(self.issue()), 200)
+
+    def test_token_revoke_concurrently(self: "DeviceTokenTest") -> None:
+        """Revocations made by several processes are all kept"""
+        tokens = [issue_token(self.user, "POS 1"), issue_token(self.user, "POS 2")]
+        other = issue_token(self.user, "POS 3")
+        workers = [RevocationList(), RevocationList()]
+        # Both processes have looked at the tokens before revoking one each
+        for token in tokens:
+            for worker in workers:
+                self.assertFalse(worker.is_revoked(verify_token(token)))
+        workers[0].revoke(verify_token(tokens[0]))
+        workers[1].revoke(verify_token(tokens[1]))
+
+        fresh = RevocationList()
+        self.assertTrue(fresh.is_revoked(verify_token(tokens[0])))
+        self.assertTrue(fresh.is_revoked(verify_token(tokens[1])))
+        self.assertFalse(fresh.is_revoked(verify_token(other)))
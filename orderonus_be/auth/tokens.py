@@ -0,0 +1,216 @@
+"""Signed device tokens for POS tablets.
+
+A device token carries the user id and username, the device name, a token
+id and the time it was issued, signed with HMAC using the ``SECRET_KEY``.
+Verifying one takes a signature check and a look at the revocation list,
+without touching the database. Revocations are shared with the other
+processes through the default cache, one key per revoked token or user,
+and each process asks the cache about a token at most every
+``DEVICE_TOKEN_REVOCATION_REFRESH`` seconds. With several worker processes
+the default cache must be a shared backend such as Redis or Memcached:
+with the local memory cache a revocation only reaches the process that
+made it.
+
+Tokens stay valid when the user is deactivated or changes their password
+until they expire or are revoked.
+"""
+
+import secrets
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+
+SALT = "orderonus.auth.device-token"
+
+
+@dataclass
+class DeviceToken:
+    """The verified contents of a device token"""
+
+    user_id: int
+    username: str
+    device: str
+    token_id: str
+    # Seconds since the epoch, with the fraction, to order it after revocations
+    issued_at: float
+
+    @property
+    def expires_at(self: "DeviceToken") -> int:
+        return int(self.issued_at) + settings.DEVICE_TOKEN_MAX_AGE
+
+    def get_user(self: "DeviceToken") -> User:
+        """The token's user, without loading it from the database"""
+        user = User(id=self.user_id, username=self.username, is_active=True)
+        user._state.adding = False
+        return user
+
+
+class RevocationList:
+    """Revoked token ids and per-user cut-offs, kept until the tokens expire.
+
+    Each revoked token and each user's cut-off has its own cache key, so
+    processes revoking at the same time do not overwrite each other. What a
+    process learned about a token is trusted for
+    ``DEVICE_TOKEN_REVOCATION_REFRESH`` seconds before the cache is asked
+    again.
+    """
+
+    def __init__(self: "RevocationList") -> None:
+        self.lock = threading.Lock()
+        # token id -> when the token would have expired anyway
+        self.tokens: Dict[str, int] = {}
+        # user id -> tokens issued up to this time are revoked
+        self.users: Dict[int, float] = {}
+        # token id -> when the cache was last asked about it
+        self.checked: Dict[str, float] = {}
+        self.pruned_at = 0.0
+
+    def is_revoked(self: "RevocationList", token: DeviceToken) -> bool:
+        if not self.is_fresh(token):
+            self.fetch(token)
+        with self.lock:
+            cutoff = self.users.get(token.user_id, 0)
+            return token.token_id in self.tokens or token.issued_at <= cutoff
+
+    def is_fresh(self: "RevocationList", token: DeviceToken) -> bool:
+        """Whether the cache was asked about the token recently enough"""
+        refresh = settings.DEVICE_TOKEN_REVOCATION_REFRESH
+        with self.lock:
+            checked = self.checked.get(token.token_id)
+            return checked is not None and time.monotonic() - checked < refresh
+
+    def fetch(self: "RevocationList", token: DeviceToken) -> None:
+        """Pick up revocations of the token made by other processes"""
+        keys = [token_key(token.token_id), user_key(token.user_id)]
+        shared = cache.get_many(keys)
+        with self.lock:
+            if keys[0] in shared:
+                self.merge_token(token.token_id, shared[keys[0]])
+            if keys[1] in shared:
+                self.merge_user(token.user_id, shared[keys[1]])
+            self.checked[token.token_id] = time.monotonic()
+            self.prune()
+
+    def revoke(self: "RevocationList", token: DeviceToken) -> None:
+        """Revoke one token"""
+        with self.lock:
+            self.merge_token(token.token_id, token.expires_at)
+        timeout = max(token.expires_at - int(time.time()), 1)
+        cache.set(token_key(token.token_id), token.expires_at, timeout)
+
+    def revoke_user(self: "RevocationList", user_id: int) -> None:
+        """Revoke every token issued to the user so far"""
+        cutoff = time.time()
+        with self.lock:
+            self.merge_user(user_id, cutoff)
+        # Another process may set an earlier cut-off at the same time, keep
+        # writing until the later one sticks
+        key = user_key(user_id)
+        while (cache.get(key) or 0) < cutoff:
+            cache.set(key, cutoff, settings.DEVICE_TOKEN_MAX_AGE)
+
+    def merge_token(self: "RevocationList", token_id: str, expires_at: int) -> None:
+        self.tokens[token_id] = max(self.tokens.get(token_id, 0), expires_at)
+
+    def merge_user(self: "RevocationList", user_id: int, cutoff: float) -> None:
+        self.users[user_id] = max(self.users.get(user_id, 0), cutoff)
+
+    def prune(self: "RevocationList") -> None:
+        """Forget revocations of expired tokens and stale checks, now and then"""
+        refresh = settings.DEVICE_TOKEN_REVOCATION_REFRESH
+        if time.monotonic() - self.pruned_at < refresh:
+            return
+        self.pruned_at = time.monotonic()
+        now = int(time.time())
+        self.tokens = {
+            token_id: expires_at
+            for token_id, expires_at in self.tokens.items()
+            if expires_at > now
+        }
+        self.users = {
+            user_id: cutoff
+            for user_id, cutoff in self.users.items()
+            if cutoff + settings.DEVICE_TOKEN_MAX_AGE > now
+        }
+        self.checked = {
+            token_id: checked
+            for token_id, checked in self.checked.items()
+            if self.pruned_at - checked < refresh
+        }
+
+    def clear(self: "RevocationList") -> None:
+        with self.lock:
+            self.tokens.clear()
+            self.users.clear()
+            self.checked.clear()
+            self.pruned_at = 0.0
+
+
+def token_key(token_id: str) -> str:
+    return f"auth:device-token:revoked:{token_id}"
+
+
+def user_key(user_id: int) -> str:
+    return f"auth:device-token:revoked-user:{user_id}"
+
+
+revocations = RevocationList()
+
+
+def new_token(user: User, device: str) -> DeviceToken:
+    """A new token for one of the user's devices, to be signed"""
+    return DeviceToken(
+        user_id=user.id,
+        username=user.username,
+        device=device,
+        token_id=secrets.token_urlsafe(9),
+        issued_at=time.time(),
+    )
+
+
+def sign_token(token: DeviceToken) -> str:
+    return signing.Signer(salt=SALT).sign_object(
+        {
+            "u": token.user_id,
+            "n": token.username,
+            "d": token.device,
+            "j": token.token_id,
+            "i": token.issued_at,
+        }
+    )
+
+
+def issue_token(user: User, device: str) -> str:
+    """Sign a new token for one of the user's devices"""
+    return sign_token(new_token(user, device))
+
+
+def verify_token(value: str) -> Optional[DeviceToken]:
+    """The token's contents if it is genuine, unexpired and not revoked"""
+    try:
+        payload = signing.Signer(salt=SALT).unsign_object(value)
+        token = DeviceToken(
+            user_id=payload["u"],
+            username=payload["n"],
+            device=payload["d"],
+            token_id=payload["j"],
+            issued_at=payload["i"],
+        )
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None
+    if token.expires_at <= time.time() or revocations.is_revoked(token):
+        return None
+    return token
+
+
+def bearer_token(request: Any) -> Optional[str]:
+    """The token sent in an ``Authorization: Bearer`` header"""
+    scheme, _, value = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+    if scheme.lower() != "bearer" or not value.strip():
+        return None
+    return value.strip()
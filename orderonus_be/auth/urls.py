@@ -1,4 +1,9 @@
 from django.urls import path
-from .views import user_login, user_register
+from .views import device_token, revoke_device_token, user_login, user_register
 
-urlpatterns = [path("login/", user_login), path("register/", user_register)]
+urlpatterns = [
+    path("login/", user_login),
+    path("register/", user_register),
+    path("tokens/", device_token),
+    path("tokens/revoke", revoke_device_token),
+]
@@ -5,6 +5,8 @@ from django.http.response import HttpResponse, JsonResponse
 from django.views.decorators.http import require_http_methods, require_POST
 from django.contrib.auth import authenticate, login
 
+from .tokens import bearer_token, new_token, revocations, sign_token, verify_token
+
 
 # Create your views here.
 @require_http_methods(["GET", "POST"])
@@ -50,3 +52,55 @@ def user_register(request: HttpRequest) -> HttpResponse:
     user.save()
 
     return JsonResponse({"data": "User created successfully"}, status=201)
+
+
+@require_POST
+def device_token(request: HttpRequest) -> HttpResponse:
+    """Issue a long-lived token for a POS device.
+
+    The user is taken from the session, or from the username and password
+    in the body. Device tokens cannot be used to issue more tokens.
+    """
+    post_dict = json.loads(request.body)
+    device = post_dict.get("device", None)
+    if device in [None, ""]:
+        return JsonResponse({"error": "Device not provided"}, status=400)
+
+    user = request.user
+    if getattr(request, "device_token", None) is not None or not user.is_authenticated:
+        username = post_dict.get("username", None)
+        password = post_dict.get("password", None)
+        if (None in [username, password]) or ("" in [username, password]):
+            return JsonResponse(
+                {"error": "Username or password not provided"}, status=400
+            )
+        user = authenticate(request, username=username, password=password)
+        if user is None:
+            return JsonResponse(
+                {"error": "User does not exist or Password is incorrect"}, status=404
+            )
+
+    token = new_token(user, str(device))
+    return JsonResponse(
+        {"data": {"token": sign_token(token), "expires_at": token.expires_at}},
+        status=201,
+    )
+
+
+@require_POST
+def revoke_device_token(request: HttpRequest) -> HttpResponse:
+    """Revoke a device token of the user, or all of them with ``all``"""
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Please log in first"}, status=401)
+
+    post_dict = json.loads(request.body)
+    if post_dict.get("all", False):
+        revocations.revoke_user(request.user.id)
+        return JsonResponse({"data": "Device tokens revoked successfully"})
+
+    value = post_dict.get("token", None) or bearer_token(request)
+    token = verify_token(value) if value else None
+    if token is None or token.user_id != request.user.id:
+        return JsonResponse({"error": "Token not found"}, status=404)
+    revocations.revoke(token)
+    return JsonResponse({"data": "Device token revoked successfully"})
@@ -0,0 +1,79 @@
+import os
+import re
+from typing import BinaryIO, Iterator, Optional, Tuple
+from django.conf import settings
+from django.utils.http import http_date, parse_http_date_safe
+
+# ManifestStaticFilesStorage names, e.g. app.3f2a9c1b7d4e.js: the first 12
+# hex digits of the MD5 of the content. Dates and other numbers are not
+# hashes, so at least one letter is required
+HASHED_NAME = re.compile(r"\.(?=[0-9]*[a-f])[0-9a-f]{12}\.[^./]+$")
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def cache_control(path: str) -> str:
+    """Cache forever names that change with their content, revalidate the rest"""
+    if HASHED_NAME.search(path):
+        return "public, max-age=31536000, immutable"
+    return f"public, max-age={settings.FILE_CACHE_MAX_AGE}"
+
+
+def file_etag(stat: os.stat_result) -> str:
+    """A validator that changes whenever the file is replaced or modified"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """The inclusive byte range asked for, or None to send the whole file.
+
+    Raises ``ValueError`` when the range cannot be satisfied. Requests for
+    several ranges are answered with the whole file, which is allowed.
+    """
+    if not header:
+        return None
+    match = RANGE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # The final N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def range_applies(if_range: Optional[str], etag: str, mtime: float) -> bool:
+    """Whether a Range request still refers to the file as it is now"""
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def read_range(file: BinaryIO, start: int, length: int) -> Iterator[bytes]:
+    """Yield ``length`` bytes of the file from ``start`` and close it"""
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(length, settings.FILE_CHUNK_SIZE))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def last_modified(stat: os.stat_result) -> str:
+    return http_date(stat.st_mtime)
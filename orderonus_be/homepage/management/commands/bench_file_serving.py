@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.utils.http import http_date
+from django.views.static import serve
+
+from api.benchmarks import summarize
+from ...views import serve_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare django.views.static.serve with serve_file on full, "
+        "conditional and range requests for a small and a large file"
+    )
+
+    def add_arguments(self: "Command", parser: Any) -> None:
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--large-size", type=int, default=5 * 1024 * 1024)
+        parser.add_argument("--output", help="Write the results as JSON to a file")
+
+    def handle(self: "Command", *args: Any, **options: Any) -> None:
+        root = tempfile.mkdtemp()
+        try:
+            files = {
+                "small": ("app.3f2a9c1b7d4e.css", 16 * 1024),
+                "large": ("menu.mp4", options["large_size"]),
+            }
+            for name, size in files.values():
+                with open(os.path.join(root, name), "wb") as file:
+                    file.write(os.urandom(size))
+
+            results: Dict[str, Dict[str, Dict[str, float]]] = {}
+            for label, (name, size) in files.items():
+                mtime = os.stat(os.path.join(root, name)).st_mtime
+                scenarios = {
+                    "full": {},
+                    "if-modified-since": {"HTTP_IF_MODIFIED_SINCE": http_date(mtime)},
+                    "range": {"HTTP_RANGE": "bytes=0-65535"},
+                }
+                for scenario, headers in scenarios.items():
+                    key = f"{label}/{scenario}"
+                    results[key] = {
+                        "static.serve": self.run(serve, root, name, headers, options),
+                        "serve_file": self.run(
+                            serve_file, root, name, headers, options
+                        ),
+                    }
+        finally:
+            shutil.rmtree(root)
+
+        self.stdout.write(
+            f"{'request':<26}{'view':<14}{'req/s':>10}{'p50 ms':>10}"
+            f"{'p99 ms':>10}{'bytes':>10}"
+        )
+        for key, views in results.items():
+            for view, summary in views.items():
+                self.stdout.write(
+                    f"{key:<26}{view:<14}{summary['throughput']:>10}"
+                    f"{summary['p50_ms']:>10}{summary['p99_ms']:>10}"
+                    f"{summary['bytes']:>10}"
+                )
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(results, output, indent=2)
+
+    def run(
+        self: "Command",
+        view: Callable[..., Any],
+        root: str,
+        name: str,
+        headers: Dict[str, str],
+        options: Dict[str, Any],
+    ) -> Dict[str, float]:
+        """Time the view answering the request, reading the whole body.
+
+        The body is read in Python here, so this measures the work done by
+        the view and not the sendfile path a WSGI server takes for whole
+        files.
+        """
+        factory = RequestFactory()
+        latencies = []
+        sent = 0
+        start = time.perf_counter()
+        for _ in range(options["requests"]):
+            request = factory.get(f"/media/{name}", **headers)
+            began = time.perf_counter()
+            response = view(request, name, document_root=root)
+            sent = sum(len(chunk) for chunk in response)
+            response.close()
+            latencies.append(time.perf_counter() - began)
+        summary = summarize(latencies, time.perf_counter() - start)
+        summary["bytes"] = sent
+        return summary
@@ -1,4 +1,14 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+from django.http import Http404
+from django.http.response import FileResponse, HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from orderonus_be.metrics import registry
+
+from .files import cache_control
+from .views import serve_file
 
 
 # Create your tests here.
@@ -8,3 +18,151 @@ class HomepageTest(TestCase):
         response = self.client.get("/")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json(), {"data": "Server is up and running"})
+
+
+class ServeFileTest(TestCase):
+    def setUp(self: "ServeFileTest") -> None:
+        """Write the files to serve"""
+        self.root = tempfile.mkdtemp()
+        self.content = bytes(range(256)) * 4
+        for name in ["photo.jpg", "app.3f2a9c1b7d4e.js"]:
+            with open(os.path.join(self.root, name), "wb") as file:
+                file.write(self.content)
+        self.factory = RequestFactory()
+        return super().setUp()
+
+    def tearDown(self: "ServeFileTest") -> None:
+        """Remove the files"""
+        shutil.rmtree(self.root)
+        return super().tearDown()
+
+    def get(self: "ServeFileTest", name: str, **headers: str) -> HttpResponse:
+        request = self.factory.get(f"/media/{name}", **headers)
+        return serve_file(request, name, document_root=self.root)
+
+    def test_serve_whole_file(self: "ServeFileTest") -> None:
+        """Whole files are sent as a FileResponse with validators"""
+        response = self.get("photo.jpg")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(b"".join(response), self.content)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+        self.assertIn("ETag", response)
+        self.assertIn("Last-Modified", response)
+
+    def test_serve_hashed_file_immutable(self: "ServeFileTest") -> None:
+        """Files with a content hash in their name are cached for good"""
+        response = self.get("app.3f2a9c1b7d4e.js")
+        self.assertEqual(
+            response["Cache-Control"], "public, max-age=31536000, immutable"
+        )
+
+    def test_unhashed_names_revalidate(self: "ServeFileTest") -> None:
+        """Names that only look like they carry a hash are not cached for good"""
+        for name in [
+            "report.20240101.pdf",
+            "logo.deadbeef.png",
+            "scan.202401011230.pdf",
+            "app.3f2a9c1b7d4e5f.js",
+        ]:
+            self.assertEqual(cache_control(name), "public, max-age=3600", name)
+
+    def test_serve_not_modified(self: "ServeFileTest") -> None:
+        """Unchanged files are answered with 304"""
+        response = self.get("photo.jpg")
+        by_date = self.get(
+            "photo.jpg", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        by_etag = self.get("photo.jpg", HTTP_IF_NONE_MATCH=response["ETag"])
+        response.close()
+        self.assertEqual((by_date.status_code, by_etag.status_code), (304, 304))
+        self.assertEqual(by_etag["ETag"], response["ETag"])
+
+    def test_serve_range(self: "ServeFileTest") -> None:
+        """Byte ranges are answered with 206 and only the bytes asked for"""
+        for header, expected, content_range in [
+            ("bytes=10-19", self.content[10:20], "bytes 10-19/1024"),
+            ("bytes=1000-", self.content[1000:], "bytes 1000-1023/1024"),
+            ("bytes=-5", self.content[-5:], "bytes 1019-1023/1024"),
+            ("bytes=1020-5000", self.content[1020:], "bytes 1020-1023/1024"),
+        ]:
+            response = self.get("photo.jpg", HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(b"".join(response.streaming_content), expected)
+            self.assertEqual(response["Content-Range"], content_range)
+            self.assertEqual(response["Content-Length"], str(len(expected)))
+
+    def test_serve_range_fail(self: "ServeFileTest") -> None:
+        """Ranges past the end are rejected, stale ranges get the whole file"""
+        response = self.get("photo.jpg", HTTP_RANGE="bytes=2000-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */1024")
+        response = self.get("photo.jpg", HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_serve_fail_outside_root(self: "ServeFileTest") -> None:
+        """Paths cannot escape the document root or name directories"""
+        for name in ["../secret", "missing.jpg", ""]:
+            with self.assertRaises(Http404):
+                self.get(name)
+        response = self.client.get("/media/missing.jpg")
+        self.assertEqual(response.status_code, 404)
+
+
+class MetricsTest(TestCase):
+    def setUp(self: "MetricsTest") -> None:
+        registry.clear()
+        self.directory = tempfile.mkdtemp()
+        return super().setUp()
+
+    def tearDown(self: "MetricsTest") -> None:
+        shutil.rmtree(self.directory)
+        return super().tearDown()
+
+    def test_metrics(self: "MetricsTest") -> None:
+        """Requests are counted per route and status with latency histograms"""
+        self.client.get("/")
+        self.client.get("/")
+        self.client.get("/missing/")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        text = response.content.decode()
+        route = 'route="homepage.views.homepage"'
+        self.assertIn(
+            f'orderonus_http_requests_total{{{route},method="GET",status="200"}} 2',
+            text,
+        )
+        self.assertIn(
+            'orderonus_http_requests_total{route="<unresolved>",method="GET",'
+            'status="404"} 1',
+            text,
+        )
+        self.assertIn(
+            f'orderonus_http_request_duration_seconds_bucket{{{route},le="+Inf"}} 2',
+            text,
+        )
+        self.assertIn(
+            f"orderonus_http_request_duration_seconds_count{{{route}}} 2", text
+        )
+
+    def test_metrics_of_every_process(self: "MetricsTest") -> None:
+        """Totals written by other processes are added to this one's"""
+        with override_settings(METRICS_DIR=self.directory):
+            self.client.get("/")
+            registry.flush(force=True)
+            self.assertTrue(
+                os.path.exists(os.path.join(self.directory, f"{os.getpid()}.json"))
+            )
+            snapshot = registry.snapshot()
+            with open(os.path.join(self.directory, "1.json"), "w") as file:
+                json.dump(snapshot, file)
+            text = self.client.get("/metrics").content.decode()
+        self.assertIn(
+            'orderonus_http_requests_total{route="homepage.views.homepage",'
+            'method="GET",status="200"} 2',
+            text,
+        )
@@ -1,6 +1,7 @@
 from django.urls import path
-from .views import homepage
+from .views import homepage, metrics
 
 urlpatterns = [
     path("", homepage),
+    path("metrics", metrics, name="metrics"),
 ]
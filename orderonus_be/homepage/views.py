@@ -1,7 +1,29 @@
+import mimetypes
+import posixpath
+from pathlib import Path
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404
 from django.http.request import HttpRequest
-from django.http.response import HttpResponse, JsonResponse
+from django.http.response import (
+    FileResponse,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.conf import settings
-from django.views.static import serve
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_GET
+from orderonus_be.metrics import CONTENT_TYPE, collect, exposition
+
+from .files import (
+    cache_control,
+    file_etag,
+    last_modified,
+    parse_range,
+    range_applies,
+    read_range,
+)
 
 # Create your views here.
 def homepage(_: HttpRequest) -> HttpResponse:
@@ -9,7 +31,74 @@ def homepage(_: HttpRequest) -> HttpResponse:
     return JsonResponse({"data": "Server is up and running"})
 
 
+@require_GET
+def metrics(_: HttpRequest) -> HttpResponse:
+    """Request counts and latencies of every worker, for Prometheus"""
+    return HttpResponse(exposition(collect()), content_type=CONTENT_TYPE)
+
+
 def serve_static(request: HttpRequest, path: str) -> HttpResponse:
     """Serve static files"""
-    print(f"Requesting static file: {path}")
-    return serve(request, path, document_root=settings.STATIC_ROOT)
+    return serve_file(request, path, document_root=settings.STATIC_ROOT)
+
+
+def serve_file(request: HttpRequest, path: str, document_root: str) -> HttpResponse:
+    """Serve a file below document_root with validators, ranges and cache headers.
+
+    Whole files are sent with ``FileResponse`` so WSGI servers can use
+    sendfile, byte ranges are streamed from an offset.
+    """
+    if request.method not in ["GET", "HEAD"]:
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+    path = posixpath.normpath(path).lstrip("/")
+    try:
+        fullpath = Path(safe_join(document_root, path))
+    except SuspiciousFileOperation:
+        raise Http404("File not found")
+    if not fullpath.is_file():
+        raise Http404("File not found")
+
+    stat = fullpath.stat()
+    etag = file_etag(stat)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified(stat),
+        "Cache-Control": cache_control(path),
+        "Accept-Ranges": "bytes",
+    }
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=int(stat.st_mtime)
+    )
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified[header] = value
+        return not_modified
+
+    content_type, encoding = mimetypes.guess_type(str(fullpath))
+    content_type = content_type or "application/octet-stream"
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    byte_range = None
+    if range_applies(request.headers.get("If-Range"), etag, stat.st_mtime):
+        try:
+            byte_range = parse_range(request.headers.get("Range"), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{stat.st_size}"
+            return response
+
+    if byte_range is None:
+        response = FileResponse(fullpath.open("rb"), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            read_range(fullpath.open("rb"), start, end - start + 1),
+            status=206,
+            content_type=content_type,
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        response["Content-Length"] = str(end - start + 1)
+    for header, value in headers.items():
+        response[header] = value
+    return response
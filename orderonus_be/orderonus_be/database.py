@@ -0,0 +1,54 @@
+"""SQLite configuration for running the API with concurrent writers.
+
+``sqlite_database`` builds the ``DATABASES`` entry: connections are kept
+between requests, wait for locks instead of failing with "database is
+locked", and start transactions with ``BEGIN IMMEDIATE`` through the
+backend in ``orderonus_be.sqlite``, so a transaction that reads before it
+writes cannot deadlock with another one. The pragmas below are applied to
+every new connection.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, Union
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# Seconds a connection waits for another writer before giving up
+BUSY_TIMEOUT = 20
+
+PRAGMAS = {
+    # Readers do not block the writer and the writer does not block readers
+    "journal_mode": "WAL",
+    # Safe with WAL, only the last transactions can be lost on power failure
+    "synchronous": "NORMAL",
+    # Read the database through a 256 MiB memory map
+    "mmap_size": 256 * 1024 * 1024,
+    # A 64 MiB page cache, negative values are in KiB
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": BUSY_TIMEOUT * 1000,
+}
+
+
+def sqlite_database(
+    name: Union[str, Path], conn_max_age: int = 600, **test: Any
+) -> Dict[str, Any]:
+    """A ``DATABASES`` entry for a SQLite file tuned for concurrent requests"""
+    return {
+        "ENGINE": "orderonus_be.sqlite",
+        "NAME": name,
+        "CONN_MAX_AGE": conn_max_age,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {"timeout": BUSY_TIMEOUT},
+        "TEST": test,
+    }
+
+
+@receiver(connection_created)
+def configure_sqlite(sender: Any, connection: Any, **kwargs: Any) -> None:
+    """Apply the pragmas to a new SQLite connection"""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
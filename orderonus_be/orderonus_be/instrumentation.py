@@ -0,0 +1,190 @@
+"""Per-request SQL and timing instrumentation.
+
+``RequestTimingMiddleware`` counts the SQL queries of each request and the
+time spent running them, serializing models and in total. The figures are
+sent back in a ``Server-Timing`` header and requests over
+``SLOW_REQUEST_MS`` or ``SLOW_REQUEST_QUERIES`` are logged with their route
+name. With ``REQUEST_TIMING`` off the middleware removes itself.
+
+Queries are counted by a wrapper installed on every database connection,
+which finds the current request through a context variable. Context
+variables follow ``sync_to_async``, so queries run by async views in
+worker threads are counted too. Streaming responses are measured until
+their first byte is ready, not until they are sent.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import wraps
+from typing import Any, Callable, Iterator, Optional, TypeVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http.request import HttpRequest
+from django.http.response import HttpResponseBase
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+@dataclass
+class RequestTimings:
+    """What one request spent its time on, in seconds"""
+
+    started_at: float
+    queries: int = 0
+    db: float = 0.0
+    serialize: float = 0.0
+    total: float = 0.0
+
+    def server_timing(self: "RequestTimings") -> str:
+        """The figures as a ``Server-Timing`` header value, in milliseconds"""
+        return ", ".join(
+            [
+                f'db;dur={self.db * 1000:.2f};desc="{self.queries} queries"',
+                f"serialize;dur={self.serialize * 1000:.2f}",
+                f"total;dur={self.total * 1000:.2f}",
+            ]
+        )
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    """The timings of the request being handled, if it is measured"""
+    return _current.get()
+
+
+def record_query(
+    execute: Callable, sql: str, params: Any, many: bool, context: Any
+) -> Any:
+    """Database execute wrapper adding each query to the current request"""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - start
+        timings.queries += 1
+
+
+@receiver(connection_created)
+def instrument_connection(sender: Any, connection: Any, **kwargs: Any) -> None:
+    """Install ``record_query`` on a new connection"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def measure(name: str) -> Iterator[None]:
+    """Add the time spent in the block to one of the request's figures"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(timings, name, getattr(timings, name) + time.perf_counter() - start)
+
+
+def timed(name: str) -> Callable[[F], F]:
+    """Decorator adding the time spent in a function to one of the figures"""
+
+    def decorator(function: F) -> F:
+        @wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with measure(name):
+                return function(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def route_name(request: HttpRequest) -> str:
+    """The name of the route the request resolved to"""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "<unresolved>"
+    return match.view_name or match._func_path
+
+
+class RequestTimingMiddleware:
+    """Measure every request, report it in ``Server-Timing`` and log slow ones"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self: "RequestTimingMiddleware", get_response: Callable) -> None:
+        if not settings.REQUEST_TIMING:
+            raise MiddlewareNotUsed()
+        # Connections opened before the middleware was loaded
+        for connection in connections.all(initialized_only=True):
+            instrument_connection(None, connection)
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self: "RequestTimingMiddleware", request: HttpRequest) -> Any:
+        if self.is_async:
+            return self.__acall__(request)
+        timings = RequestTimings(started_at=time.perf_counter())
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(
+        self: "RequestTimingMiddleware", request: HttpRequest
+    ) -> HttpResponseBase:
+        timings = RequestTimings(started_at=time.perf_counter())
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(
+        self: "RequestTimingMiddleware",
+        request: HttpRequest,
+        response: HttpResponseBase,
+        timings: RequestTimings,
+    ) -> HttpResponseBase:
+        timings.total = time.perf_counter() - timings.started_at
+        request.timings = timings
+        response["Server-Timing"] = timings.server_timing()
+        if (
+            timings.total * 1000 >= settings.SLOW_REQUEST_MS
+            or timings.queries >= settings.SLOW_REQUEST_QUERIES
+        ):
+            logger.warning(
+                "Slow request %s %s (%s): %d %.1fms, %d queries in %.1fms, "
+                "serialize %.1fms",
+                request.method,
+                request.path,
+                route_name(request),
+                response.status_code,
+                timings.total * 1000,
+                timings.queries,
+                timings.db * 1000,
+                timings.serialize * 1000,
+            )
+        return response
@@ -0,0 +1,276 @@
+"""Request counts and latency histograms in the Prometheus text format.
+
+``MetricsMiddleware`` counts every request by route name, method and status
+and adds its duration to the route's histogram, and the API's caches count
+their hits and misses with ``observe_cache``. Each thread counts into its
+own shard, so recording a request takes no lock; the shards are only summed
+when the metrics are read.
+
+With ``METRICS_DIR`` set, every process writes its totals to
+``<METRICS_DIR>/<pid>.json`` at most every ``METRICS_FLUSH_INTERVAL``
+seconds and the metrics endpoint adds up the files of all processes, so
+any worker can answer for the whole server. The directory should be
+emptied when the server is deployed.
+"""
+
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Tuple
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http.request import HttpRequest
+from django.http.response import HttpResponseBase
+
+from .instrumentation import route_name
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+RequestKey = Tuple[str, str, str]
+
+
+class Shard:
+    """The counters of one thread"""
+
+    def __init__(self: "Shard") -> None:
+        # (route, method, status) -> requests
+        self.requests: Dict[RequestKey, int] = {}
+        # route -> [count per bucket..., sum of durations, count]
+        self.latency: Dict[str, List[float]] = {}
+        # (cache, "hit" or "miss") -> lookups
+        self.cache: Dict[Tuple[str, str], int] = {}
+
+
+class Registry:
+    """Counters of every thread of this process"""
+
+    def __init__(self: "Registry") -> None:
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.shards: List[Shard] = []
+        self.flushed_at = 0.0
+
+    def shard(self: "Registry") -> Shard:
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            shard = self.local.shard = Shard()
+            with self.lock:
+                self.shards.append(shard)
+        return shard
+
+    def observe(
+        self: "Registry", route: str, method: str, status: int, duration: float
+    ) -> None:
+        """Record one request"""
+        shard = self.shard()
+        key = (route, method, str(status))
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        buckets = settings.METRICS_BUCKETS
+        histogram = shard.latency.get(route)
+        if histogram is None:
+            histogram = shard.latency[route] = [0] * (len(buckets) + 2)
+        for index, bound in enumerate(buckets):
+            if duration <= bound:
+                histogram[index] += 1
+                break
+        histogram[-2] += duration
+        histogram[-1] += 1
+
+    def observe_cache(self: "Registry", cache: str, hit: bool) -> None:
+        """Record one lookup in a cache"""
+        shard = self.shard()
+        key = (cache, "hit" if hit else "miss")
+        shard.cache[key] = shard.cache.get(key, 0) + 1
+
+    def snapshot(self: "Registry") -> Dict[str, Any]:
+        """The totals of this process, as written to its metrics file"""
+        requests: Dict[RequestKey, int] = defaultdict(int)
+        latency: Dict[str, List[float]] = {}
+        lookups: Dict[Tuple[str, str], int] = defaultdict(int)
+        with self.lock:
+            shards = list(self.shards)
+        for shard in shards:
+            # dict.copy() cannot be interrupted by the owning thread
+            for key, count in shard.requests.copy().items():
+                requests[key] += count
+            for route, values in shard.latency.copy().items():
+                total = latency.setdefault(route, [0] * len(values))
+                for index, value in enumerate(list(values)):
+                    total[index] += value
+            for key, count in shard.cache.copy().items():
+                lookups[key] += count
+        return {
+            "buckets": list(settings.METRICS_BUCKETS),
+            "requests": [[*key, count] for key, count in requests.items()],
+            "latency": [[route, values] for route, values in latency.items()],
+            "cache": [[*key, count] for key, count in lookups.items()],
+        }
+
+    def flush(self: "Registry", force: bool = False) -> None:
+        """Write this process' totals to ``METRICS_DIR``"""
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self.flushed_at < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self.flushed_at = now
+        try:
+            os.makedirs(directory, exist_ok=True)
+            descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(descriptor, "w") as file:
+                json.dump(self.snapshot(), file)
+            os.replace(temporary, os.path.join(directory, f"{os.getpid()}.json"))
+        except OSError:
+            logger.exception("Could not write metrics to %s", directory)
+
+    def clear(self: "Registry") -> None:
+        with self.lock:
+            for shard in self.shards:
+                shard.requests.clear()
+                shard.latency.clear()
+                shard.cache.clear()
+
+
+registry = Registry()
+
+
+def collect() -> List[Dict[str, Any]]:
+    """The snapshots of every process, this one read live"""
+    snapshots = [registry.snapshot()]
+    directory = settings.METRICS_DIR
+    if not directory or not os.path.isdir(directory):
+        return snapshots
+    own = f"{os.getpid()}.json"
+    for name in os.listdir(directory):
+        if not name.endswith(".json") or name == own:
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):
+            # Being replaced or truncated by its process
+            continue
+    return snapshots
+
+
+def label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def exposition(snapshots: List[Dict[str, Any]]) -> str:
+    """The combined snapshots in the Prometheus text format"""
+    buckets = list(settings.METRICS_BUCKETS)
+    requests: Dict[RequestKey, int] = defaultdict(int)
+    latency: Dict[str, List[float]] = {}
+    lookups: Dict[Tuple[str, str], int] = defaultdict(int)
+    for snapshot in snapshots:
+        for route, method, status, count in snapshot["requests"]:
+            requests[(route, method, status)] += count
+        for cache, result, count in snapshot.get("cache", []):
+            lookups[(cache, result)] += count
+        if snapshot["buckets"] != buckets:
+            # Written before the buckets were changed
+            continue
+        for route, values in snapshot["latency"]:
+            total = latency.setdefault(route, [0] * len(values))
+            for index, value in enumerate(values):
+                total[index] += value
+
+    lines = [
+        "# HELP orderonus_http_requests_total Requests by route, method and status.",
+        "# TYPE orderonus_http_requests_total counter",
+    ]
+    for (route, method, status), count in sorted(requests.items()):
+        lines.append(
+            f'orderonus_http_requests_total{{route="{label(route)}",'
+            f'method="{label(method)}",status="{status}"}} {count}'
+        )
+    lines += [
+        "# HELP orderonus_http_request_duration_seconds Request latency by route.",
+        "# TYPE orderonus_http_request_duration_seconds histogram",
+    ]
+    for route, values in sorted(latency.items()):
+        name = f'route="{label(route)}"'
+        cumulative = 0
+        for bound, count in zip(buckets, values):
+            cumulative += count
+            lines.append(
+                f"orderonus_http_request_duration_seconds_bucket"
+                f'{{{name},le="{bound}"}} {int(cumulative)}'
+            )
+        lines += [
+            f'orderonus_http_request_duration_seconds_bucket{{{name},le="+Inf"}} '
+            f"{int(values[-1])}",
+            f"orderonus_http_request_duration_seconds_sum{{{name}}} {values[-2]}",
+            f"orderonus_http_request_duration_seconds_count{{{name}}} "
+            f"{int(values[-1])}",
+        ]
+    lines += [
+        "# HELP orderonus_cache_lookups_total Cache lookups by cache and result.",
+        "# TYPE orderonus_cache_lookups_total counter",
+    ]
+    for (cache, result), count in sorted(lookups.items()):
+        lines.append(
+            f'orderonus_cache_lookups_total{{cache="{label(cache)}",'
+            f'result="{result}"}} {count}'
+        )
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Count requests and time them for the metrics endpoint"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self: "MetricsMiddleware", get_response: Callable) -> None:
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self: "MetricsMiddleware", request: HttpRequest) -> Any:
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        return self.record(request, response, start)
+
+    async def __acall__(
+        self: "MetricsMiddleware", request: HttpRequest
+    ) -> HttpResponseBase:
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        return self.record(request, response, start)
+
+    def record(
+        self: "MetricsMiddleware",
+        request: HttpRequest,
+        response: HttpResponseBase,
+        start: float,
+    ) -> HttpResponseBase:
+        method = request.method if request.method in METHODS else "other"
+        registry.observe(
+            route_name(request),
+            method,
+            response.status_code,
+            time.perf_counter() - start,
+        )
+        registry.flush()
+        return response
+
+
+atexit.register(registry.flush, True)
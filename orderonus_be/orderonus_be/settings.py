@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 
+from .database import sqlite_database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -57,12 +60,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "orderonus_be.metrics.MetricsMiddleware",
+    "orderonus_be.instrumentation.RequestTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     # "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "auth.middleware.DeviceTokenMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -91,13 +97,37 @@ WSGI_APPLICATION = "orderonus_be.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# WAL journaling, a busy timeout and persistent connections, see database.py.
+# Tests use a file too, so that concurrent writers can be tested, named after
+# the process so that concurrent test runs do not share it
+
 DATABASES = {
+    "default": sqlite_database(
+        BASE_DIR / "db.sqlite3",
+        NAME=os.path.join(
+            tempfile.gettempdir(), f"orderonus_test_{os.getpid()}.sqlite3"
+        ),
+    )
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Local memory by default, point "default" at a shared backend such as Redis
+# or Memcached when running several worker processes: cached pages, versions
+# and device token revocations are only shared between workers through it
+
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "orderonus",
     }
 }
 
+# Cache alias used by the API, and how long a serialized menu page is kept
+API_CACHE_ALIAS = "default"
+MENU_CACHE_TIMEOUT = 60 * 60 * 24
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -138,7 +168,110 @@ MEDIA_URL = "media/"
 STATIC_ROOT = os.path.join(BASE_DIR, "static")  # your static/ files folder
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")  # your static/ files folder
 
+# Serve media and static files from Django, with validators, byte ranges
+# and cache headers. Disable when a web server in front serves them
+SERVE_FILES = os.getenv("SERVE_FILES", "1") == "1"
+# Seconds clients may cache files whose names do not contain a content hash
+FILE_CACHE_MAX_AGE = 3600
+# Bytes read at a time when streaming a byte range
+FILE_CHUNK_SIZE = 64 * 1024
+
+# Image derivatives
+# Longest side in pixels of each variant generated for store and dish images,
+# their WebP/JPEG quality, and the threads generating them
+
+IMAGE_VARIANTS = {"thumb": 160, "medium": 640}
+IMAGE_QUALITY = 80
+IMAGE_WORKERS = 2
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# API pagination
+# Page size used when a listing is requested without ?limit=, and the
+# largest page a client may ask for
+
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 500
+
+# Orders fetched per query when streaming an order export
+EXPORT_CHUNK_SIZE = 500
+
+# Seconds an order's Idempotency-Key is remembered for retries
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# Orders accepted by one offline batch upload and written per transaction
+ORDER_BATCH_MAX_ORDERS = 1000
+ORDER_BATCH_CHUNK_SIZE = 250
+
+# Operations accepted by one bulk menu request
+MENU_BULK_MAX_OPERATIONS = 1000
+
+# Dishes listed by the sales analytics endpoint unless ?top= is given
+ANALYTICS_TOP_DISHES = 10
+
+# Order archiving
+# Completed orders older than ARCHIVE_AFTER_DAYS days are moved to the
+# archive table by `manage.py archive_orders`, ARCHIVE_BATCH_SIZE orders
+# per transaction
+
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 1000
+
+# Device tokens
+# Seconds a token stays valid, and seconds a process trusts what it knows
+# about a token's revocation before asking the shared cache again
+
+DEVICE_TOKEN_MAX_AGE = 90 * 24 * 60 * 60
+DEVICE_TOKEN_REVOCATION_REFRESH = 30
+
+# Store ownership cache
+# Stores kept per process, seconds an entry is trusted, and an optional
+# cache alias to share the entries between processes instead
+
+STORE_CACHE_SIZE = 1024
+STORE_CACHE_TTL = 60
+STORE_CACHE_ALIAS = os.getenv("STORE_CACHE_ALIAS") or None
+
+# Request instrumentation
+# Count the queries of every request and time it, reporting the figures in
+# a Server-Timing header. Requests taking at least SLOW_REQUEST_MS
+# milliseconds or running SLOW_REQUEST_QUERIES queries are logged
+
+REQUEST_TIMING = os.getenv("REQUEST_TIMING", "1") == "1"
+SLOW_REQUEST_MS = 500
+SLOW_REQUEST_QUERIES = 50
+
+# Tests
+# The runner quiets the slow request warnings, see testing.py
+
+TEST_RUNNER = "orderonus_be.testing.TestRunner"
+
+# Metrics
+# Count requests and their latency per route for /metrics. With METRICS_DIR
+# set, each process writes its totals there every METRICS_FLUSH_INTERVAL
+# seconds so /metrics reports every worker. METRICS_BUCKETS are the upper
+# bounds in seconds of the latency histogram buckets
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_DIR = os.getenv("METRICS_DIR") or None
+METRICS_FLUSH_INTERVAL = 5
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Serve the read endpoints (orders, order_by_id, get_dishes, get_stores) with
+# their async implementations, for deployments behind an ASGI server
+
+API_ASYNC_VIEWS = os.getenv("API_ASYNC_VIEWS", "") == "1"
+
+# Live order streams
+# Seconds between keep-alive comments, events kept per store for clients
+# resuming with Last-Event-ID, events queued per client before it is
+# disconnected, and seconds a store's events are kept after its last
+# client leaves
+
+ORDER_STREAM_HEARTBEAT = 15
+ORDER_STREAM_HISTORY = 500
+ORDER_STREAM_QUEUE_SIZE = 1000
+ORDER_STREAM_RETENTION = 300
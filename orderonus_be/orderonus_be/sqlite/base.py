@@ -0,0 +1,16 @@
+"""The SQLite backend, starting every transaction with ``BEGIN IMMEDIATE``.
+
+A deferred transaction that reads before it writes has to upgrade its
+lock, and two of them doing so at once deadlock with "database is locked"
+however long the busy timeout. Taking the write lock when the transaction
+begins makes writers queue up instead. Django 5.1 offers this as the
+``transaction_mode`` option; the backend gives the same on earlier versions.
+"""
+
+from typing import Any
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def _start_transaction_under_autocommit(self: "DatabaseWrapper") -> Any:
+        self.cursor().execute("BEGIN IMMEDIATE")
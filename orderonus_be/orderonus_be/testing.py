@@ -0,0 +1,24 @@
+"""Test runner keeping the slow request warnings out of the test output.
+
+Hashing passwords and waiting on SQLite locks make some test requests
+slower than ``SLOW_REQUEST_MS``. The instrumentation logger is quieted for
+the run instead of changing the thresholds, so the middleware behaves as
+in production and tests can still catch its warnings with ``assertLogs``.
+"""
+
+import logging
+from typing import Any
+from django.test.runner import DiscoverRunner
+
+from .instrumentation import logger
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self: "TestRunner", **kwargs: Any) -> None:
+        super().setup_test_environment(**kwargs)
+        self.instrumentation_level = logger.level
+        logger.setLevel(logging.ERROR)
+
+    def teardown_test_environment(self: "TestRunner", **kwargs: Any) -> None:
+        logger.setLevel(self.instrumentation_level)
+        super().teardown_test_environment(**kwargs)
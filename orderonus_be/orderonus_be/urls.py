@@ -13,12 +13,31 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
 from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+from django.urls import path, include, re_path
 from django.conf import settings
+from homepage.views import serve_file, serve_static
 
-urlpatterns = static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT) + [
+
+def file_pattern(prefix: str) -> str:
+    return rf"^{re.escape(prefix.lstrip('/'))}(?P<path>.*)$"
+
+
+file_patterns = (
+    [
+        re_path(
+            file_pattern(settings.MEDIA_URL),
+            serve_file,
+            {"document_root": settings.MEDIA_ROOT},
+        ),
+        re_path(file_pattern(settings.STATIC_URL), serve_static),
+    ]
+    if settings.SERVE_FILES
+    else []
+)
+
+urlpatterns = file_patterns + [
     path("admin/", admin.site.urls),
     path("api/", include("api.urls"), name="api"),
     path("accounts/", include("auth.urls"), name="auth"),